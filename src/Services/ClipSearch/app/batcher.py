@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class BatcherQueueFullError(Exception):
+    pass
+
+
+class InferenceBatcher:
+    """Dynamic micro-batching scheduler for model inference.
+
+    Requests are queued and flushed as one batched encode call on a dedicated
+    worker thread once either ``max_batch_size`` items are waiting or
+    ``max_delay_ms`` has passed since the first item of the batch arrived.
+    While a batch is being encoded the next one keeps filling up, so batch size
+    grows with load instead of latency.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        encode_fn: Callable[[List[Any]], np.ndarray],
+        max_batch_size: int,
+        max_delay_ms: float,
+        max_queue_size: int
+    ):
+        self.name = name
+        self._encode_fn = encode_fn
+        self._max_batch_size = max(1, max_batch_size)
+        self._max_delay = max(0.0, max_delay_ms) / 1000.0
+        self._max_queue_size = max_queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-encoder")
+
+    async def start(self):
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self._max_queue_size)
+        self._worker = asyncio.create_task(self._run())
+        logger.info(
+            f"Started {self.name} batcher (max_batch_size={self._max_batch_size}, "
+            f"max_delay_ms={self._max_delay * 1000:.1f}, max_queue_size={self._max_queue_size})"
+        )
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        self._executor.shutdown(wait=False)
+        logger.info(f"Stopped {self.name} batcher")
+
+    async def submit(self, item: Any) -> np.ndarray:
+        if self._queue is None:
+            raise RuntimeError(f"{self.name} batcher is not started")
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, future))
+        except asyncio.QueueFull:
+            raise BatcherQueueFullError(f"{self.name} inference queue is full")
+        return await future
+
+    async def _collect_batch(self) -> List[Tuple[Any, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self._max_delay
+        while len(batch) < self._max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            batch = [(item, future) for item, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+
+            try:
+                vectors = await loop.run_in_executor(
+                    self._executor, self._encode_fn, [item for item, _ in batch]
+                )
+            except Exception as e:
+                logger.error(f"{self.name} batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
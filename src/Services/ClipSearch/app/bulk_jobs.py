@@ -0,0 +1,341 @@
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional
+
+from .config import BULK_JOB_DB_PATH, BULK_JOB_STALE_SECONDS, INGEST_CHUNK_SIZE
+from .ingest import StreamingIngest
+from .metrics import track_operation
+from .models import ProductIndexRequest
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bulk_jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    committed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    owner TEXT,
+    heartbeat REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    run_started_at REAL,
+    run_start_offset INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS bulk_jobs_status ON bulk_jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS bulk_job_products (
+    job_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, position)
+) WITHOUT ROWID;
+"""
+
+
+class BulkJobNotFoundError(Exception):
+    pass
+
+
+class BulkJobStateError(Exception):
+    pass
+
+
+class BulkJobStore:
+    """Job rows and their pending products in a local SQLite database.
+
+    ``committed`` is the number of leading products known to be written to
+    ES. Several API workers may share the file; WAL mode lets readers proceed
+    during writes and a job is claimed with a conditional UPDATE so only one
+    worker runs it.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def create(self, products: List[ProductIndexRequest]) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO bulk_job_products (job_id, position, data) VALUES (?, ?, ?)",
+                    ((job_id, position, product.model_dump_json()) for position, product in enumerate(products))
+                )
+                self._conn.execute(
+                    "INSERT INTO bulk_jobs (id, status, total, created_at) VALUES (?, 'pending', ?, ?)",
+                    (job_id, len(products), time.time())
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM bulk_jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def list(self, limit: int) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM bulk_jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def claim_next(self, owner: str, stale_seconds: float) -> Optional[Dict]:
+        """Take the oldest pending job, or a running one whose worker stopped heartbeating."""
+        now = time.time()
+        stale_before = now - stale_seconds
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id FROM bulk_jobs WHERE status = 'pending' OR (status = 'running' AND heartbeat < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (stale_before,)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE bulk_jobs SET status = 'running', owner = ?, heartbeat = ?, error = NULL, "
+                        "attempts = attempts + 1, started_at = COALESCE(started_at, ?), "
+                        "run_started_at = ?, run_start_offset = committed WHERE id = ?",
+                        (owner, now, now, now, row["id"])
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"]) if row is not None else None
+
+    def products(self, job_id: str, offset: int, limit: int) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM bulk_job_products WHERE job_id = ? AND position >= ? ORDER BY position LIMIT ?",
+                (job_id, offset, limit)
+            ).fetchall()
+        return [row["data"] for row in rows]
+
+    def checkpoint(self, job_id: str, owner: str, committed: int, failed: int) -> bool:
+        """Record progress; False if another worker has taken the job over."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE bulk_jobs SET committed = ?, failed = failed + ?, heartbeat = ? "
+                "WHERE id = ? AND owner = ? AND status = 'running'",
+                (committed, failed, time.time(), job_id, owner)
+            )
+        return cursor.rowcount == 1
+
+    def heartbeat(self, job_id: str, owner: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE bulk_jobs SET heartbeat = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (time.time(), job_id, owner)
+            )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id: str, owner: str, status: str, error: Optional[str] = None):
+        """Leave the running state; completed jobs also drop their stored products."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.execute(
+                    "UPDATE bulk_jobs SET status = ?, error = ?, owner = NULL, heartbeat = NULL, "
+                    "finished_at = CASE WHEN ? = 'pending' THEN NULL ELSE ? END "
+                    "WHERE id = ? AND owner = ? AND status = 'running'",
+                    (status, error, status, time.time(), job_id, owner)
+                )
+                if cursor.rowcount == 1 and status == "completed":
+                    self._conn.execute("DELETE FROM bulk_job_products WHERE job_id = ?", (job_id,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def requeue(self, job_id: str, stale_seconds: float) -> bool:
+        """Mark a failed (or orphaned running) job pending again, keeping its checkpoint."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE bulk_jobs SET status = 'pending', error = NULL, owner = NULL, heartbeat = NULL, finished_at = NULL "
+                "WHERE id = ? AND (status = 'failed' OR (status = 'running' AND heartbeat < ?))",
+                (job_id, time.time() - stale_seconds)
+            )
+        return cursor.rowcount == 1
+
+
+def job_to_dict(job: Dict) -> Dict:
+    end = job["finished_at"] or (time.time() if job["status"] == "running" else None)
+    elapsed = None
+    if job["started_at"] and end:
+        elapsed = end - job["started_at"]
+    docs_per_second = 0.0
+    if job["run_started_at"] and end:
+        run_elapsed = end - job["run_started_at"]
+        if run_elapsed > 0:
+            docs_per_second = (job["committed"] - job["run_start_offset"]) / run_elapsed
+    remaining = job["total"] - job["committed"]
+    return {
+        "jobId": job["id"],
+        "status": job["status"],
+        "total": job["total"],
+        "processed": job["committed"],
+        "failed": job["failed"],
+        "progress": job["committed"] / job["total"] if job["total"] else None,
+        "docsPerSecond": round(docs_per_second, 1),
+        "elapsedSeconds": round(elapsed, 1) if elapsed is not None else None,
+        "etaSeconds": round(remaining / docs_per_second, 1) if job["status"] == "running" and docs_per_second > 0 else None,
+        "attempts": job["attempts"],
+        "error": job["error"]
+    }
+
+
+class BulkIndexJobManager:
+    """Runs submitted bulk-index jobs in the background, one at a time per worker.
+
+    Products are stored with the job, and the committed offset is
+    checkpointed after every chunk, so a job that failed or whose process died
+    resumes from the last checkpoint instead of starting over; chunks written
+    after the checkpoint are simply indexed again. Jobs left running by a
+    stopped worker are picked up once their heartbeat is ``stale_seconds`` old.
+    """
+
+    def __init__(
+        self,
+        search_engine,
+        db_path: str = BULK_JOB_DB_PATH,
+        chunk_size: int = INGEST_CHUNK_SIZE,
+        stale_seconds: float = BULK_JOB_STALE_SECONDS
+    ):
+        self._engine = search_engine
+        self._store = BulkJobStore(db_path)
+        self._chunk_size = max(1, chunk_size)
+        self._stale_seconds = stale_seconds
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._schedule())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._store.close()
+
+    async def submit(self, products: List[ProductIndexRequest]) -> Dict:
+        job_id = await asyncio.to_thread(self._store.create, products)
+        logger.info(f"Bulk index job {job_id} queued with {len(products)} products")
+        self._wakeup.set()
+        return await self.get(job_id)
+
+    async def get(self, job_id: str) -> Dict:
+        job = await asyncio.to_thread(self._store.get, job_id)
+        if job is None:
+            raise BulkJobNotFoundError(f"Bulk index job {job_id} not found")
+        return job_to_dict(job)
+
+    async def list(self, limit: int = 50) -> List[Dict]:
+        return [job_to_dict(job) for job in await asyncio.to_thread(self._store.list, limit)]
+
+    async def resume(self, job_id: str) -> Dict:
+        job = await self.get(job_id)
+        if not await asyncio.to_thread(self._store.requeue, job_id, self._stale_seconds):
+            raise BulkJobStateError(f"Bulk index job {job_id} is {job['status']} and cannot be resumed")
+        logger.info(f"Bulk index job {job_id} queued to resume at {job['processed']}/{job['total']}")
+        self._wakeup.set()
+        return await self.get(job_id)
+
+    async def _schedule(self):
+        await self._engine.es_ready.wait()
+        while not self._engine.text_model.is_ready:
+            await asyncio.sleep(1.0)
+        while True:
+            try:
+                job = await asyncio.to_thread(self._store.claim_next, self._owner, self._stale_seconds)
+            except Exception as e:
+                logger.error(f"Failed to claim bulk index job: {e}")
+                job = None
+            if job is not None:
+                await self._run(job)
+                continue
+            self._wakeup.clear()
+            try:
+                # Also poll, so jobs orphaned by other workers are picked up
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._stale_seconds / 2)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, job: Dict):
+        job_id = job["id"]
+        offset = job["committed"]
+        logger.info(f"Running bulk index job {job_id} from {offset}/{job['total']} (attempt {job['attempts']})")
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        ingest = StreamingIngest(self._engine, chunk_size=self._chunk_size)
+        status, error = "completed", None
+        try:
+            with track_operation("bulk_index_job"):
+                async with aclosing(ingest.run(self._stored_products(job_id, offset))) as reports:
+                    async for report in reports:
+                        if report["error"] is not None:
+                            status, error = "failed", report["error"]
+                            break
+                        offset += report["received"]
+                        if not await asyncio.to_thread(self._store.checkpoint, job_id, self._owner, offset, report["failed"]):
+                            logger.warning(f"Bulk index job {job_id} was taken over by another worker")
+                            return
+            if status == "completed" and ingest.error is not None:
+                status, error = "failed", ingest.error
+            if status == "completed" and offset < job["total"]:
+                status, error = "failed", f"Stopped at {offset} of {job['total']} products"
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back so the next start resumes it right away
+            self._store.finish(job_id, self._owner, "pending")
+            raise
+        except Exception as e:
+            status, error = "failed", str(e)
+        finally:
+            heartbeat.cancel()
+
+        await asyncio.to_thread(self._store.finish, job_id, self._owner, status, error)
+        if status == "completed":
+            logger.info(f"Bulk index job {job_id} completed: {offset} products, {ingest.failed} failed in this run")
+        else:
+            logger.error(f"Bulk index job {job_id} failed at {offset}/{job['total']}: {error}")
+
+    async def _stored_products(self, job_id: str, offset: int) -> AsyncIterator[bytes]:
+        while True:
+            rows = await asyncio.to_thread(self._store.products, job_id, offset, self._chunk_size)
+            if not rows:
+                return
+            offset += len(rows)
+            yield ("\n".join(rows) + "\n").encode("utf-8")
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(self._stale_seconds / 4)
+            try:
+                await asyncio.to_thread(self._store.heartbeat, job_id, self._owner)
+            except Exception as e:
+                logger.warning(f"Failed to heartbeat bulk index job {job_id}: {e}")
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import math
+import random
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from elasticsearch import ApiError
+from elasticsearch.helpers import expand_action
+
+from .config import (
+    BULK_CHUNK_BYTES,
+    BULK_CHUNK_MAX_DOCS,
+    BULK_INITIAL_CONCURRENCY,
+    BULK_MIN_CONCURRENCY,
+    BULK_MAX_CONCURRENCY,
+    BULK_LATENCY_TOLERANCE,
+    BULK_MAX_RETRIES,
+    BULK_BACKOFF_SECONDS,
+    BULK_MAX_BACKOFF_SECONDS
+)
+from .metrics import BULK_CONCURRENCY, BULK_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest response in the latency moving averages
+_LATENCY_ALPHA = 0.2
+# Applied to the latency baselines on every slow response, so a cluster whose
+# steady-state latency has moved up is not held at minimum concurrency forever
+_BASELINE_DRIFT = 1.05
+# Latency grows with the request size, so baselines are kept per size band of
+# a quarter octave (sizes within ~19% of each other share one)
+_SIZE_BANDS_PER_OCTAVE = 4
+# Once the cluster has pushed back, growing needs this many times more healthy
+# responses, so the limit settles near capacity instead of probing past it constantly
+_CAUTIOUS_GROWTH = 4
+
+# One document as its serialized bulk lines: action metadata, plus the source unless it is a delete
+_Doc = Tuple[bytes, ...]
+
+
+class AdaptiveBulkWriter:
+    """Bulk writer that adapts to what the cluster can absorb.
+
+    Actions are serialized once and cut into chunks of at most ``chunk_bytes``
+    (or ``max_docs``), and the chunks are sent in parallel. Documents ES
+    rejects with 429 are resent with full-jitter exponential backoff, up to
+    ``max_retries`` times. The number of bulk requests in flight is shared by
+    all callers: it is halved on rejections or when responses are on average
+    more than ``latency_tolerance`` times slower than the fastest seen for
+    requests of about the same size, and grows by one
+    after a run of healthy responses (a longer run once the cluster has pushed
+    back).
+
+    ``write`` returns ``(success, failed_items)`` like ``async_bulk`` with
+    ``raise_on_error=False``.
+    """
+
+    def __init__(
+        self,
+        chunk_bytes: int = BULK_CHUNK_BYTES,
+        max_docs: int = BULK_CHUNK_MAX_DOCS,
+        initial_concurrency: int = BULK_INITIAL_CONCURRENCY,
+        min_concurrency: int = BULK_MIN_CONCURRENCY,
+        max_concurrency: int = BULK_MAX_CONCURRENCY,
+        latency_tolerance: float = BULK_LATENCY_TOLERANCE,
+        max_retries: int = BULK_MAX_RETRIES,
+        backoff_seconds: float = BULK_BACKOFF_SECONDS,
+        max_backoff_seconds: float = BULK_MAX_BACKOFF_SECONDS
+    ):
+        self.chunk_bytes = max(1, chunk_bytes)
+        self.max_docs = max(1, max_docs)
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.latency_tolerance = latency_tolerance
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.concurrency = min(max(initial_concurrency, self.min_concurrency), self.max_concurrency)
+        BULK_CONCURRENCY.set(self.concurrency)
+
+        self._in_flight = 0
+        self._waiters: List[asyncio.Future] = []
+        self._latency: Optional[float] = None
+        self._baselines: Dict[int, float] = {}
+        self._slowdown: Optional[float] = None
+        self._healthy = 0
+        self._congested = False
+        self._cooldown_until = 0.0
+
+    async def write(self, client, actions: Iterable[Any], **bulk_kwargs) -> Tuple[int, List[Dict]]:
+        serializer = client.transport.serializers.get_serializer("application/json")
+        chunks = await asyncio.to_thread(self._chunk, actions, serializer)
+        tasks = [asyncio.create_task(self._send(client, chunk, bulk_kwargs)) for chunk in chunks]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        success = sum(ok for ok, _ in results)
+        failed = [item for _, items in results for item in items]
+        return success, failed
+
+    def _chunk(self, actions: Iterable[Any], serializer) -> List[List[_Doc]]:
+        chunks: List[List[_Doc]] = []
+        chunk: List[_Doc] = []
+        size = 0
+        for action in actions:
+            meta, source = expand_action(action)
+            doc = tuple(_to_bytes(serializer.dumps(part)) for part in ((meta,) if source is None else (meta, source)))
+            doc_size = sum(len(line) + 1 for line in doc)
+            if chunk and (size + doc_size > self.chunk_bytes or len(chunk) >= self.max_docs):
+                chunks.append(chunk)
+                chunk, size = [], 0
+            chunk.append(doc)
+            size += doc_size
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    async def _send(self, client, docs: List[_Doc], bulk_kwargs: Dict) -> Tuple[int, List[Dict]]:
+        success = 0
+        failed: List[Dict] = []
+        attempt = 0
+        while docs:
+            size = sum(len(line) + 1 for doc in docs for line in doc)
+            await self._acquire()
+            started = time.perf_counter()
+            try:
+                response = await client.bulk(operations=[line for doc in docs for line in doc], **bulk_kwargs)
+                items = response.body["items"]
+            except ApiError as e:
+                if e.status_code != 429:
+                    raise
+                items = None
+            finally:
+                self._release()
+            latency = time.perf_counter() - started
+
+            rejected: List[Tuple[_Doc, Dict]] = []
+            if items is None:
+                rejected = [(doc, {"index": {"status": 429, "error": "es_rejected_execution_exception"}}) for doc in docs]
+            else:
+                for doc, item in zip(docs, items):
+                    result = next(iter(item.values()))
+                    status = result.get("status", 500)
+                    if status == 429:
+                        rejected.append((doc, item))
+                    elif 200 <= status < 300:
+                        success += 1
+                    else:
+                        failed.append(item)
+            self._observe(latency, size, bool(rejected))
+
+            if not rejected:
+                break
+            if attempt >= self.max_retries:
+                logger.warning(f"Giving up on {len(rejected)} bulk documents still rejected after {attempt} retries")
+                failed.extend(item for _, item in rejected)
+                break
+            BULK_RETRIES.inc(len(rejected))
+            await asyncio.sleep(random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt)))
+            attempt += 1
+            docs = [doc for doc, _ in rejected]
+        return success, failed
+
+    async def _acquire(self):
+        while self._in_flight >= self.concurrency:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                self._waiters.remove(waiter)
+        self._in_flight += 1
+
+    def _release(self):
+        self._in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        # Every waiter re-checks the limit, which may have moved since it started waiting
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _observe(self, latency: float, size: int, rejected: bool):
+        now = time.monotonic()
+        self._latency = _average(self._latency, latency)
+        # Compared with the fastest response of the same size band, so that the
+        # small last chunk of every write does not make full-size chunks look slow
+        band = round(_SIZE_BANDS_PER_OCTAVE * math.log2(max(size, 1)))
+        baseline = self._baselines.get(band)
+        if baseline is None or latency < baseline:
+            self._baselines[band] = baseline = latency
+        self._slowdown = _average(self._slowdown, latency / baseline if baseline > 0 else 1.0)
+        slow = self._slowdown > self.latency_tolerance
+
+        if rejected or slow:
+            self._healthy = 0
+            self._congested = True
+            if slow:
+                self._baselines = {band: value * _BASELINE_DRIFT for band, value in self._baselines.items()}
+            # Responses to requests sent under the old limit arrive for about one
+            # round trip after a cut; they should not cut it again
+            if now >= self._cooldown_until and self.concurrency > self.min_concurrency:
+                self._set_concurrency(max(self.min_concurrency, self.concurrency // 2))
+                self._cooldown_until = now + self._latency
+                reason = "rejections" if rejected else f"latency {self._slowdown:.1f}x baseline"
+                logger.info(f"ES bulk concurrency reduced to {self.concurrency} ({reason})")
+            return
+
+        self._healthy += 1
+        streak = self.concurrency * (_CAUTIOUS_GROWTH if self._congested else 1)
+        if self._healthy >= streak and self.concurrency < self.max_concurrency:
+            self._healthy = 0
+            self._set_concurrency(self.concurrency + 1)
+            logger.debug(f"ES bulk concurrency raised to {self.concurrency}")
+
+    def _set_concurrency(self, value: int):
+        self.concurrency = value
+        BULK_CONCURRENCY.set(value)
+        self._wake()
+
+
+def _average(current: Optional[float], value: float) -> float:
+    return value if current is None else (1 - _LATENCY_ALPHA) * current + _LATENCY_ALPHA * value
+
+
+def _to_bytes(value) -> bytes:
+    return value if isinstance(value, bytes) else value.encode("utf-8")
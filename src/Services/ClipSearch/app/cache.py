@@ -0,0 +1,307 @@
+import hashlib
+import logging
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    # Only normalizations that do not change what the (cased) text model sees.
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """Bounded LRU cache with per-entry TTL for query embeddings.
+
+    When ``redis_url`` is set, entries are also written to Redis so several
+    replicas share warm vectors; local misses fall back to Redis before the
+    caller runs the model.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl_seconds: float,
+        namespace: str,
+        redis_url: Optional[str] = None
+    ):
+        self._max_size = max_size
+        self._ttl = ttl_seconds
+        self._namespace = namespace
+        self._entries: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self._redis = None
+        if redis_url:
+            self._connect_redis(redis_url)
+
+    def _connect_redis(self, redis_url: str):
+        try:
+            import redis
+            self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.05)
+            self._redis.ping()
+            logger.info(f"Embedding cache '{self._namespace}' shared via Redis")
+        except Exception as e:
+            logger.error(f"Redis connection failed, using local cache only: {e}")
+            self._redis = None
+
+    def _redis_key(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return f"{self._namespace}:{digest}"
+
+    @staticmethod
+    def key(model_name: str, query: str) -> str:
+        # The model name carries the backend: ONNX, int8 and torch vectors differ slightly
+        return f"{model_name}:{query}"
+
+    def get_many(self, model_name: str, queries: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached vectors for ``queries`` (``None`` where missing); local misses
+        are looked up in Redis with a single round trip."""
+        keys = [self.key(model_name, query) for query in queries]
+        vectors: List[Optional[np.ndarray]] = [None] * len(keys)
+        now = time.monotonic()
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None:
+                    expires_at, vector = entry
+                    if expires_at > now:
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        vectors[i] = vector
+                        continue
+                    del self._entries[key]
+                missing.append(i)
+
+        if not missing:
+            return vectors
+        found = self._redis_get_many([keys[i] for i in missing])
+        with self._lock:
+            for i, vector in zip(missing, found):
+                if vector is not None:
+                    self.redis_hits += 1
+                    self._put_local(keys[i], vector, now)
+                    vectors[i] = vector
+                else:
+                    self.misses += 1
+        return vectors
+
+    def set_many(self, model_name: str, queries: List[str], vectors: np.ndarray):
+        keys = [self.key(model_name, query) for query in queries]
+        vectors = np.asarray(vectors, dtype=np.float32)
+        now = time.monotonic()
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._put_local(key, vector, now)
+        self._redis_set_many(keys, vectors)
+
+    def _put_local(self, key: str, vector: np.ndarray, now: float):
+        if self._max_size <= 0:
+            return
+        self._entries[key] = (now + self._ttl, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def _redis_get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        if self._redis is None:
+            return [None] * len(keys)
+        try:
+            values = self._redis.mget([self._redis_key(key) for key in keys])
+            return [np.frombuffer(data, dtype=np.float32) if data else None for data in values]
+        except Exception as e:
+            logger.warning(f"Redis get error: {e}")
+            return [None] * len(keys)
+
+    def _redis_set_many(self, keys: List[str], vectors: np.ndarray):
+        if self._redis is None:
+            return
+        try:
+            pipeline = self._redis.pipeline(transaction=False)
+            for key, vector in zip(keys, vectors):
+                pipeline.setex(self._redis_key(key), int(self._ttl), vector.tobytes())
+            pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Redis set error: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.redis_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxSize": self._max_size,
+                "hits": self.hits,
+                "redisHits": self.redis_hits,
+                "misses": self.misses,
+                "hitRate": (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+                "redisEnabled": self._redis is not None
+            }
+
+
+class ImageEmbeddingCache:
+    """Content-addressed cache for query image embeddings.
+
+    Vectors live in one preallocated float16 matrix sized from ``max_bytes``;
+    the least recently used slot is recycled when the store is full. Entries
+    are keyed by the SHA-256 of the raw image bytes and, optionally, by a
+    64-bit difference hash so re-encoded copies of the same photo also hit.
+    """
+
+    def __init__(self, max_bytes: int, dims: int, use_perceptual_hash: bool = False):
+        self._capacity = max(0, max_bytes // (dims * np.dtype(np.float16).itemsize))
+        self._vectors = np.zeros((self._capacity, dims), dtype=np.float16)
+        self._slots: "OrderedDict[str, int]" = OrderedDict()
+        self._perceptual_keys: Dict[str, str] = {}
+        self._slot_perceptual_key: Dict[int, str] = {}
+        self._free_slots = list(range(self._capacity - 1, -1, -1))
+        self._use_perceptual_hash = use_perceptual_hash
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+
+    @property
+    def use_perceptual_hash(self) -> bool:
+        return self._use_perceptual_hash
+
+    @staticmethod
+    def content_key(image_bytes: bytes) -> str:
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    @staticmethod
+    def perceptual_key(image) -> str:
+        from PIL import Image
+        pixels = np.asarray(image.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+        bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+        return f"{int(''.join('1' if b else '0' for b in bits), 2):016x}"
+
+    def get(self, content_key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            slot = self._slots.get(content_key)
+            if slot is None:
+                if not self._use_perceptual_hash:
+                    self.misses += 1
+                return None
+            self._slots.move_to_end(content_key)
+            self.hits += 1
+            return self._vectors[slot].astype(np.float32)
+
+    def get_perceptual(self, perceptual_key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            content_key = self._perceptual_keys.get(perceptual_key)
+            if content_key is None:
+                self.misses += 1
+                return None
+            slot = self._slots[content_key]
+            self._slots.move_to_end(content_key)
+            self.perceptual_hits += 1
+            return self._vectors[slot].astype(np.float32)
+
+    def set(self, vector: np.ndarray, content_key: str, perceptual_key: Optional[str] = None):
+        if self._capacity == 0:
+            return
+        with self._lock:
+            slot = self._slots.get(content_key)
+            if slot is None:
+                slot = self._free_slots.pop() if self._free_slots else self._evict()
+                self._slots[content_key] = slot
+            self._slots.move_to_end(content_key)
+            self._vectors[slot] = vector
+            if perceptual_key:
+                self._perceptual_keys[perceptual_key] = content_key
+                self._slot_perceptual_key[slot] = perceptual_key
+
+    def _evict(self) -> int:
+        content_key, slot = self._slots.popitem(last=False)
+        perceptual_key = self._slot_perceptual_key.pop(slot, None)
+        if perceptual_key and self._perceptual_keys.get(perceptual_key) == content_key:
+            del self._perceptual_keys[perceptual_key]
+        return slot
+
+    def clear(self):
+        with self._lock:
+            self._slots.clear()
+            self._perceptual_keys.clear()
+            self._slot_perceptual_key.clear()
+            self._free_slots = list(range(self._capacity - 1, -1, -1))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.perceptual_hits + self.misses
+            return {
+                "size": len(self._slots),
+                "capacity": self._capacity,
+                "bytes": int(self._vectors.nbytes),
+                "hits": self.hits,
+                "perceptualHits": self.perceptual_hits,
+                "misses": self.misses,
+                "hitRate": (self.hits + self.perceptual_hits) / lookups if lookups else 0.0,
+                "perceptualHashEnabled": self._use_perceptual_hash
+            }
+
+
+class SearchResultCache:
+    """LRU+TTL cache of ranked product id lists.
+
+    Keys embed the index version they were computed against, so bumping the
+    version on any write makes older entries unreachable; ``invalidate`` also
+    drops them eagerly to free memory.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self._max_size = max_size
+        self._ttl = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, List[str], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Tuple[List[str], int]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, product_ids, total = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return product_ids, total
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, product_ids: List[str], total: int):
+        if self._max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, product_ids, total)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxSize": self._max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0
+            }
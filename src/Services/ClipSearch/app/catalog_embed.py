@@ -0,0 +1,471 @@
+"""Offline catalogue embedding for initial loads and model upgrades.
+
+``embed`` reads product dumps (JSONL, CSV or the Product API's seed
+``clean_*.json`` arrays) and spreads HTML stripping and encoding over a
+process pool with one torch thread per process. Vectors are written straight
+into ``vectors.npy`` (row i belongs to line i of ``products.jsonl``), and
+``manifest.json`` is written last to mark the artifact as complete.
+
+``load`` bulk-loads an artifact into Elasticsearch with ``parallel_bulk``.
+By default it fills a new versioned index and then points the alias at it.
+Like a ``/reindex`` target, the index is registered in the API's shared
+state (``SHARED_STATE_DB_PATH``, so run the load where the API's data
+directory is): API writes made during the load are mirrored into it and are
+not overwritten by the artifact, API deletes are applied to it again before
+the swap, and the swap invalidates the API's result caches. Only one load or
+reindex runs at a time. Only text is embedded offline: ``imageUrls`` are
+kept in the documents, and a later ``/reindex`` adds the product image
+vectors.
+
+    python -m app.catalog_embed embed data/clean_*.json --output /data/catalog
+    python -m app.catalog_embed load /data/catalog --threads 8
+"""
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk, parallel_bulk
+
+from .config import (
+    ELASTICSEARCH_URL,
+    ELASTICSEARCH_USER,
+    ELASTICSEARCH_PASSWORD,
+    ELASTICSEARCH_INDEX,
+    ES_REQUEST_TIMEOUT,
+    ES_HTTP_COMPRESS,
+    ES_MAX_RETRIES,
+    EMBEDDING_DIMS,
+    ENCODE_BATCH_SIZE,
+    REINDEX_STALE_SECONDS,
+    SHARED_STATE_DB_PATH,
+    TEXT_MODEL_NAME,
+    TEXT_ENCODER_BACKEND
+)
+from .embedding_store import ProductVectorStore
+from .encoders import load_text_encoder
+from .models import ProductIndexRequest
+from .reindex import ReindexInProgressError, restored_index_settings
+from .search_engine import (
+    alias_swap_actions,
+    index_body,
+    next_versioned_index,
+    product_document,
+    weighted_average,
+    weighted_field_texts
+)
+from .shared_state import SharedStateStore
+
+logger = logging.getLogger(__name__)
+
+PRODUCTS_FILE = "products.jsonl"
+VECTORS_FILE = "vectors.npy"
+MANIFEST_FILE = "manifest.json"
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def _optional(value) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+def product_from_record(record: Dict) -> ProductIndexRequest:
+    """Map a dump or seed record (camelCase or snake_case) to a ProductIndexRequest."""
+    category_ids = record.get("categoryIds", record.get("category_ids"))
+    if category_ids is None and record.get("categories"):
+        category_ids = [category["id"] for category in record["categories"] if isinstance(category, dict)]
+    elif isinstance(category_ids, str):
+        category_ids = [part for part in category_ids.split("|") if part]
+
+    brand_id = record.get("brandId", record.get("brand_id"))
+    if brand_id is None and isinstance(record.get("brand"), dict):
+        brand_id = record["brand"].get("id")
+
+    image_urls = record.get("imageUrls", record.get("image_urls", record.get("images")))
+    if isinstance(image_urls, str):
+        image_urls = [part for part in image_urls.split("|") if part]
+    elif image_urls:
+        image_urls = [str(image["url"] if isinstance(image, dict) else image) for image in image_urls]
+
+    price = record.get("price")
+    return ProductIndexRequest(
+        id=str(record["id"]),
+        name=record.get("name") or "",
+        description=_optional(record.get("description")),
+        shortDescription=_optional(record.get("shortDescription", record.get("short_description"))),
+        categoryIds=[str(category_id) for category_id in category_ids] if category_ids else None,
+        brandId=_optional(brand_id),
+        price=float(price) if price not in (None, "") else None,
+        imageUrls=image_urls or None
+    )
+
+
+def read_records(path: str) -> Iterator[Dict]:
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            yield from csv.DictReader(f)
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            yield from json.load(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_products(paths: List[str], products_path: str, limit: Optional[int] = None) -> int:
+    count = 0
+    with open(products_path, "w", encoding="utf-8") as out:
+        for path in paths:
+            for record in read_records(path):
+                out.write(product_from_record(record).model_dump_json())
+                out.write("\n")
+                count += 1
+                if limit is not None and count >= limit:
+                    return count
+    return count
+
+
+def _chunks(products_path: str, chunk_size: int) -> Iterator[Tuple[int, List[Tuple[str, Optional[str], Optional[str]]]]]:
+    start = 0
+    fields = []
+    with open(products_path, "r", encoding="utf-8") as f:
+        for line in f:
+            product = ProductIndexRequest.model_validate_json(line)
+            fields.append((product.name, product.shortDescription, product.description))
+            if len(fields) >= chunk_size:
+                yield start, fields
+                start += len(fields)
+                fields = []
+    if fields:
+        yield start, fields
+
+
+_worker_model = None
+_worker_vectors = None
+
+
+def _init_worker(vectors_path: str):
+    global _worker_model, _worker_vectors
+    import torch
+    # Parallelism comes from the process pool; intra-op threads would only contend
+    torch.set_num_threads(1)
+    _worker_model = load_text_encoder()
+    _worker_vectors = np.load(vectors_path, mmap_mode="r+")
+
+
+def _embed_chunk(task: Tuple[int, List[Tuple[str, Optional[str], Optional[str]]]]) -> int:
+    start, fields = task
+    texts = []
+    rows = []
+    weights = []
+    for row, (name, short_desc, description) in enumerate(fields):
+        for text, weight in weighted_field_texts(name, short_desc, description):
+            texts.append(text)
+            rows.append(row)
+            weights.append(weight)
+    vectors = np.zeros((0, EMBEDDING_DIMS), dtype=np.float32)
+    if texts:
+        vectors = _worker_model.encode(texts, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True)
+    _worker_vectors[start:start + len(fields)] = weighted_average(len(fields), vectors, rows, weights)
+    _worker_vectors.flush()
+    return len(fields)
+
+
+def embed_catalog(paths: List[str], output: str, workers: int, chunk_size: int, limit: Optional[int] = None) -> Dict:
+    os.makedirs(output, exist_ok=True)
+    manifest_path = os.path.join(output, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    products_path = os.path.join(output, PRODUCTS_FILE)
+    vectors_path = os.path.join(output, VECTORS_FILE)
+
+    started = time.perf_counter()
+    count = write_products(paths, products_path, limit)
+    logger.info(f"Read {count} products from {len(paths)} files")
+    vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=np.float32, shape=(count, EMBEDDING_DIMS))
+    del vectors
+
+    done = 0
+    # spawn: workers must not inherit a torch runtime already initialized in this process
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=_init_worker, initargs=(vectors_path,)) as pool:
+        for embedded in pool.imap_unordered(_embed_chunk, _chunks(products_path, chunk_size)):
+            done += embedded
+            elapsed = time.perf_counter() - started
+            logger.info(f"Embedded {done}/{count} products ({done / elapsed:.1f} docs/s)")
+
+    manifest = {
+        "model": TEXT_MODEL_NAME,
+        "backend": TEXT_ENCODER_BACKEND,
+        "dims": EMBEDDING_DIMS,
+        "count": count,
+        "sources": paths,
+        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "seconds": round(time.perf_counter() - started, 1)
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_manifest(artifact: str, force: bool = False) -> Dict:
+    manifest_path = os.path.join(artifact, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise ArtifactError(f"{artifact} has no {MANIFEST_FILE}; the embed run did not finish")
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest["dims"] != EMBEDDING_DIMS:
+        raise ArtifactError(f"Artifact vectors have {manifest['dims']} dims, the index expects {EMBEDDING_DIMS}")
+    if not force and (manifest["model"], manifest["backend"]) != (TEXT_MODEL_NAME, TEXT_ENCODER_BACKEND):
+        raise ArtifactError(
+            f"Artifact was embedded with {manifest['model']} ({manifest['backend']}) but the service uses "
+            f"{TEXT_MODEL_NAME} ({TEXT_ENCODER_BACKEND}); pass --force to load it anyway"
+        )
+    return manifest
+
+
+def iter_artifact(artifact: str) -> Iterator[Tuple[ProductIndexRequest, np.ndarray]]:
+    vectors = np.load(os.path.join(artifact, VECTORS_FILE), mmap_mode="r")
+    with open(os.path.join(artifact, PRODUCTS_FILE), "r", encoding="utf-8") as f:
+        for row, line in enumerate(f):
+            yield ProductIndexRequest.model_validate_json(line), vectors[row]
+
+
+def _concrete_indices(es: Elasticsearch) -> List[str]:
+    if es.indices.exists_alias(name=ELASTICSEARCH_INDEX):
+        return list(es.indices.get_alias(name=ELASTICSEARCH_INDEX).keys())
+    if es.indices.exists(index=ELASTICSEARCH_INDEX):
+        return [ELASTICSEARCH_INDEX]
+    return []
+
+
+def _delete_documents(es: Elasticsearch, index: str, product_ids: List[str]):
+    actions = ({"_op_type": "delete", "_index": index, "_id": product_id} for product_id in product_ids)
+    _, errors = bulk(es, actions, raise_on_error=False, stats_only=False)
+    errors = [item for item in errors if next(iter(item.values())).get("status") != 404]
+    if errors:
+        raise RuntimeError(f"Failed to delete {len(errors)} products removed during the load")
+
+
+def load_catalog(
+    artifact: str,
+    threads: int,
+    chunk_size: int,
+    index: Optional[str] = None,
+    swap: bool = True,
+    delete_old: bool = False,
+    product_vectors_dir: Optional[str] = None,
+    force: bool = False
+) -> Dict:
+    manifest = read_manifest(artifact, force)
+    es = Elasticsearch(
+        [ELASTICSEARCH_URL],
+        basic_auth=(ELASTICSEARCH_USER, ELASTICSEARCH_PASSWORD),
+        request_timeout=ES_REQUEST_TIMEOUT,
+        connections_per_node=threads,
+        http_compress=ES_HTTP_COMPRESS,
+        max_retries=ES_MAX_RETRIES,
+        retry_on_timeout=True
+    )
+    product_vectors = ProductVectorStore(product_vectors_dir, dims=EMBEDDING_DIMS) if product_vectors_dir else None
+    # A new index that replaces the live one is registered like a /reindex target,
+    # so the API mirrors its writes and records its deletes while the load runs
+    shared_state = None
+    job_id = uuid.uuid4().hex
+    owner = f"catalog-load:{socket.gethostname()}:{os.getpid()}"
+    heartbeat_stop = threading.Event()
+    target = index
+    started = time.perf_counter()
+    try:
+        old_indices = _concrete_indices(es)
+        restore_settings = None
+        if target is None:
+            if swap:
+                if not os.path.exists(SHARED_STATE_DB_PATH):
+                    logger.warning(
+                        f"No API shared state at {SHARED_STATE_DB_PATH}; writes made through the API "
+                        f"during the load will not reach the new index"
+                    )
+                shared_state = SharedStateStore(SHARED_STATE_DB_PATH, REINDEX_STALE_SECONDS)
+                active = shared_state.create_reindex(job_id, owner)
+                if active is not None:
+                    raise ReindexInProgressError(f"Reindex {active['id']} is already running")
+                shared_state.update_reindex(
+                    job_id, owner, status="running", phase="creating", total=manifest["count"], started_at=time.time()
+                )
+                threading.Thread(
+                    target=_heartbeat, args=(shared_state, job_id, owner, heartbeat_stop), daemon=True
+                ).start()
+            existing = es.indices.get(index=f"{ELASTICSEARCH_INDEX}_v*", allow_no_indices=True)
+            target = next_versioned_index(list(existing))
+            current = None
+            if old_indices:
+                current = es.indices.get_settings(index=old_indices[0])[old_indices[0]]["settings"]["index"]
+            restore_settings = restored_index_settings(current)
+            logger.info(f"Creating Elasticsearch index: {target}")
+            es.indices.create(index=target, body=index_body({"index": {"refresh_interval": "-1", "number_of_replicas": 0}}))
+            if shared_state is not None:
+                shared_state.update_reindex(job_id, owner, phase="loading", source_indices=old_indices, target_index=target)
+        # create: a live write mirrored into the target is newer than the artifact
+        op_type = "create" if shared_state is not None else "index"
+
+        pending_vectors: Dict[str, np.ndarray] = {}
+
+        def actions():
+            for product, vector in iter_artifact(artifact):
+                if product_vectors is not None:
+                    pending_vectors[product.id] = vector
+                yield {"_op_type": op_type, "_index": target, "_id": product.id, "_source": product_document(product, vector.tolist())}
+
+        success = failed = skipped = 0
+        batch_ids, batch_vectors = [], []
+        for ok, item in parallel_bulk(
+            es, actions(), thread_count=threads, chunk_size=chunk_size,
+            raise_on_error=False, raise_on_exception=False
+        ):
+            result = next(iter(item.values()))
+            vector = pending_vectors.pop(result.get("_id"), None)
+            if ok:
+                success += 1
+                # Only for created documents, so a mirrored live write keeps its vector
+                if vector is not None:
+                    batch_ids.append(result["_id"])
+                    batch_vectors.append(vector)
+                    if len(batch_ids) >= chunk_size:
+                        product_vectors.put_many(batch_ids, np.stack(batch_vectors))
+                        batch_ids, batch_vectors = [], []
+            elif op_type == "create" and result.get("status") == 409:
+                skipped += 1
+            else:
+                failed += 1
+                if failed <= 10:
+                    logger.warning(f"Failed to index {item}")
+            done = success + failed + skipped
+            if done % 10000 == 0:
+                elapsed = time.perf_counter() - started
+                logger.info(f"Loaded {done}/{manifest['count']} products ({done / elapsed:.1f} docs/s)")
+                if shared_state is not None:
+                    shared_state.update_reindex(job_id, owner, processed=done, failed=failed)
+        if batch_ids:
+            product_vectors.put_many(batch_ids, np.stack(batch_vectors))
+
+        if shared_state is not None:
+            shared_state.update_reindex(job_id, owner, phase="finalizing", processed=success + failed + skipped, failed=failed)
+            # The artifact may have recreated products deleted through the API meanwhile
+            deleted = shared_state.recorded_deletes(target)
+            if deleted:
+                _delete_documents(es, target, deleted)
+                if product_vectors is not None:
+                    product_vectors.delete_many(deleted)
+                logger.info(f"Re-applied {len(deleted)} deletes made during the load")
+        if restore_settings is not None:
+            es.indices.put_settings(index=target, settings={"index": restore_settings})
+        es.indices.refresh(index=target)
+
+        swapped = False
+        if index is None and swap:
+            shared_state.update_reindex(job_id, owner, phase="swapping")
+            es.indices.update_aliases(actions=alias_swap_actions([name for name in old_indices if name != target], target))
+            swapped = True
+            # Keys the API's result caches; cached results of the old index must not be served
+            shared_state.bump_index_version()
+            if delete_old:
+                shared_state.update_reindex(job_id, owner, phase="cleanup")
+                for old_index in old_indices:
+                    if old_index not in (target, ELASTICSEARCH_INDEX):
+                        es.indices.delete(index=old_index, ignore_unavailable=True)
+            shared_state.update_reindex(job_id, owner, status="completed", phase="completed", finished_at=time.time())
+        return {
+            "index": target,
+            "success": success,
+            "failed": failed,
+            "skipped": skipped,
+            "aliasSwapped": swapped,
+            "previousIndices": old_indices,
+            "seconds": round(time.perf_counter() - started, 1)
+        }
+    except Exception as e:
+        if shared_state is not None:
+            shared_state.update_reindex(job_id, owner, status="failed", error=str(e), finished_at=time.time())
+        raise
+    finally:
+        heartbeat_stop.set()
+        if shared_state is not None:
+            if target:
+                shared_state.clear_deletes(target)
+            shared_state.close()
+        es.close()
+        if product_vectors is not None:
+            product_vectors.close()
+
+
+def _heartbeat(shared_state: SharedStateStore, job_id: str, owner: str, stop: threading.Event):
+    while not stop.wait(REINDEX_STALE_SECONDS / 4):
+        try:
+            shared_state.update_reindex(job_id, owner)
+        except Exception as e:
+            logger.warning(f"Failed to heartbeat catalog load {job_id}: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    embed_parser = subparsers.add_parser("embed", help="Embed a product dump into an artifact directory")
+    embed_parser.add_argument("inputs", nargs="+", help="JSONL, CSV or seed JSON array files")
+    embed_parser.add_argument("--output", required=True, help="Artifact directory")
+    embed_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Encoder processes (default: all cores)")
+    embed_parser.add_argument("--chunk-size", type=int, default=256, help="Products per work item")
+    embed_parser.add_argument("--limit", type=int, help="Stop after this many products")
+
+    load_parser = subparsers.add_parser("load", help="Bulk-load an artifact into Elasticsearch")
+    load_parser.add_argument("artifact", help="Artifact directory written by embed")
+    load_parser.add_argument("--threads", type=int, default=4, help="parallel_bulk threads")
+    load_parser.add_argument("--chunk-size", type=int, default=500, help="Documents per bulk request")
+    load_parser.add_argument("--index", help="Write into this existing index or alias instead of a new versioned index")
+    load_parser.add_argument("--no-swap", action="store_true", help="Leave the alias on the current index")
+    load_parser.add_argument("--delete-old", action="store_true", help="Drop the previous indices after the alias swap")
+    load_parser.add_argument("--product-vectors", help="Also fill this rescoring vector store directory")
+    load_parser.add_argument("--force", action="store_true", help="Load even if the artifact was made with another model")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == "embed":
+        manifest = embed_catalog(args.inputs, args.output, max(1, args.workers), max(1, args.chunk_size), args.limit)
+        print(f"Embedded {manifest['count']} products into {args.output} in {manifest['seconds']}s")
+    else:
+        result = load_catalog(
+            args.artifact,
+            threads=max(1, args.threads),
+            chunk_size=max(1, args.chunk_size),
+            index=args.index,
+            swap=not args.no_swap,
+            delete_old=args.delete_old,
+            product_vectors_dir=args.product_vectors,
+            force=args.force
+        )
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,116 @@ ELASTICSEARCH_URL = os.getenv("ELASTICSEARCH_URL", "http://elasticsearch:9200")
 ELASTICSEARCH_USER = os.getenv("ELASTICSEARCH_USER", "elastic")
 ELASTICSEARCH_PASSWORD = os.getenv("ELASTICSEARCH_PASSWORD", "admin")
 ELASTICSEARCH_INDEX = os.getenv("ELASTICSEARCH_INDEX", "products")
+ES_REQUEST_TIMEOUT = float(os.getenv("ES_REQUEST_TIMEOUT", "30"))
+ES_MAX_CONNECTIONS = int(os.getenv("ES_MAX_CONNECTIONS", "32"))
+ES_HTTP_COMPRESS = os.getenv("ES_HTTP_COMPRESS", "true").lower() == "true"
+ES_MAX_RETRIES = int(os.getenv("ES_MAX_RETRIES", "3"))
+
+# Bulk writes: chunks are cut by serialized size; concurrency adapts between the bounds
+# from response latency and 429 rejections, which are retried with jittered backoff
+BULK_CHUNK_BYTES = int(os.getenv("BULK_CHUNK_BYTES", str(5 * 1024 * 1024)))
+BULK_CHUNK_MAX_DOCS = int(os.getenv("BULK_CHUNK_MAX_DOCS", "5000"))
+BULK_INITIAL_CONCURRENCY = int(os.getenv("BULK_INITIAL_CONCURRENCY", "2"))
+BULK_MIN_CONCURRENCY = int(os.getenv("BULK_MIN_CONCURRENCY", "1"))
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "8"))
+BULK_LATENCY_TOLERANCE = float(os.getenv("BULK_LATENCY_TOLERANCE", "2.0"))
+BULK_MAX_RETRIES = int(os.getenv("BULK_MAX_RETRIES", "5"))
+BULK_BACKOFF_SECONDS = float(os.getenv("BULK_BACKOFF_SECONDS", "0.5"))
+BULK_MAX_BACKOFF_SECONDS = float(os.getenv("BULK_MAX_BACKOFF_SECONDS", "30"))
 
 IMG_MODEL_NAME = "clip-ViT-B-32"
 TEXT_MODEL_NAME = "sentence-transformers/clip-ViT-B-32-multilingual-v1"
+# Local model cache; safetensors weights in it are memory-mapped on load
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "/app/models")
+MODEL_WAIT_TIMEOUT_SECONDS = float(os.getenv("MODEL_WAIT_TIMEOUT_SECONDS", "30"))
 RRF_K = 60
+# "rrf": client-side Reciprocal Rank Fusion of separate kNN and BM25 queries; "es": ES sums raw scores
+SEARCH_FUSION_MODE = os.getenv("SEARCH_FUSION_MODE", "rrf")
+RRF_WINDOW_SIZE = int(os.getenv("RRF_WINDOW_SIZE", "100"))
+CURSOR_KEEP_ALIVE = os.getenv("CURSOR_KEEP_ALIVE", "2m")
+CURSOR_KNN_K = int(os.getenv("CURSOR_KNN_K", "1000"))
+SEARCH_BATCH_MAX_SIZE = int(os.getenv("SEARCH_BATCH_MAX_SIZE", "50"))
+
+EMBEDDING_DIMS = 512
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", "64"))
+NAME_WEIGHT = 3.0
+DESCRIPTION_WEIGHT = 2.0
+
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "32"))
+BATCH_MAX_DELAY_MS = float(os.getenv("BATCH_MAX_DELAY_MS", "5"))
+BATCH_MAX_QUEUE = int(os.getenv("BATCH_MAX_QUEUE", "1024"))
+
+REDIS_URL = os.getenv("REDIS_URL")
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "10000"))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600"))
+IMAGE_CACHE_MAX_MB = float(os.getenv("IMAGE_CACHE_MAX_MB", "64"))
+IMAGE_CACHE_PERCEPTUAL_HASH = os.getenv("IMAGE_CACHE_PERCEPTUAL_HASH", "false").lower() == "true"
+
+# Query images are rejected above these limits and downscaled to CLIP's input size on decode
+IMAGE_UPLOAD_MAX_BYTES = int(os.getenv("IMAGE_UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(40_000_000)))
+IMAGE_INPUT_SIZE = 224
+
+# Product images: URLs are downloaded, paths and file:// URLs are read from PRODUCT_IMAGE_ROOT
+PRODUCT_IMAGE_ROOT = os.getenv("PRODUCT_IMAGE_ROOT", "/app/data/images")
+PRODUCT_IMAGE_FETCH_CONCURRENCY = int(os.getenv("PRODUCT_IMAGE_FETCH_CONCURRENCY", "16"))
+PRODUCT_IMAGE_FETCH_TIMEOUT = float(os.getenv("PRODUCT_IMAGE_FETCH_TIMEOUT", "10"))
+PRODUCT_IMAGE_MAX_BYTES = int(os.getenv("PRODUCT_IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+PRODUCT_IMAGE_MAX_PER_PRODUCT = int(os.getenv("PRODUCT_IMAGE_MAX_PER_PRODUCT", "8"))
+# Hosts image URLs may point at: "cdn.example.com" exactly, ".example.com" for its
+# subdomains; empty allows any host. Private, loopback and link-local addresses are always refused.
+PRODUCT_IMAGE_ALLOWED_HOSTS = [host.strip().lower() for host in os.getenv("PRODUCT_IMAGE_ALLOWED_HOSTS", "").split(",") if host.strip()]
+# Image-only queries: share of the kNN score from product image vectors vs the
+# text-derived product vector (0 = text vector only, 1 = product images only).
+# With rescoring enabled the text-vector share is rescored exactly; at 1 there
+# is no text share, so nothing is rescored.
+IMAGE_QUERY_IMAGE_WEIGHT = float(os.getenv("IMAGE_QUERY_IMAGE_WEIGHT", "0.7"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "2000"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "60"))
+RESULT_CACHE_WINDOW = int(os.getenv("RESULT_CACHE_WINDOW", "100"))
+
+# Text encoder: torch | onnx | onnx-int8; image encoder: torch | torch-int8
+TEXT_ENCODER_BACKEND = os.getenv("TEXT_ENCODER_BACKEND", "torch")
+IMG_ENCODER_BACKEND = os.getenv("IMG_ENCODER_BACKEND", "torch")
+ONNX_EXPORT_DIR = os.getenv("ONNX_EXPORT_DIR", "/app/models/onnx")
+ONNX_QUANTIZATION_CONFIG = os.getenv("ONNX_QUANTIZATION_CONFIG", "avx2")
+ENCODER_VERIFY = os.getenv("ENCODER_VERIFY", "true").lower() == "true"
+ENCODER_MIN_COSINE = float(os.getenv("ENCODER_MIN_COSINE", "0.99"))
+
+# With several API workers the models live in one shared encoder process (app.encoder_service)
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+ENCODER_SERVICE_SOCKET = os.getenv("ENCODER_SERVICE_SOCKET")
+# Requests are pickled, so the key is what keeps other local users from running code in the
+# encoder process; app.serve generates one per launch and there is deliberately no default
+ENCODER_SERVICE_AUTHKEY = os.getenv("ENCODER_SERVICE_AUTHKEY")
+ENCODER_SERVICE_START_TIMEOUT_SECONDS = float(os.getenv("ENCODER_SERVICE_START_TIMEOUT_SECONDS", "600"))
+# Longest a single encode request may take before the service is treated as hung
+ENCODER_SERVICE_TIMEOUT_SECONDS = float(os.getenv("ENCODER_SERVICE_TIMEOUT_SECONDS", "120"))
+
+EMBEDDING_STORE_ENABLED = os.getenv("EMBEDDING_STORE_ENABLED", "true").lower() == "true"
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "/app/data/embeddings")
+
+REINDEX_BATCH_SIZE = int(os.getenv("REINDEX_BATCH_SIZE", "500"))
+# A reindex whose worker stopped heartbeating this long ago is treated as failed
+REINDEX_STALE_SECONDS = float(os.getenv("REINDEX_STALE_SECONDS", "60"))
+
+# Index version and reindex jobs, shared by all API workers through a local SQLite file
+SHARED_STATE_DB_PATH = os.getenv("SHARED_STATE_DB_PATH", "/app/data/shared_state.sqlite3")
+# Workers keep the index version and reindex targets in memory and re-read them this often
+SHARED_STATE_REFRESH_SECONDS = float(os.getenv("SHARED_STATE_REFRESH_SECONDS", "0.5"))
+
+# Streaming NDJSON ingest: products per chunk, chunks buffered between pipeline stages
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "500"))
+INGEST_QUEUE_DEPTH = int(os.getenv("INGEST_QUEUE_DEPTH", "2"))
+INGEST_MAX_LINE_BYTES = int(os.getenv("INGEST_MAX_LINE_BYTES", str(1024 * 1024)))
+
+# Background bulk-index jobs; state and pending products live in a local SQLite file
+BULK_JOB_DB_PATH = os.getenv("BULK_JOB_DB_PATH", "/app/data/bulk_jobs.sqlite3")
+# A running job whose heartbeat is older than this is taken over by any worker
+BULK_JOB_STALE_SECONDS = float(os.getenv("BULK_JOB_STALE_SECONDS", "60"))
+
+# ES vector index: hnsw (float32) | int8_hnsw (ES >= 8.12) | byte (client-side int8 quantization)
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw")
+RESCORE_ENABLED = os.getenv("RESCORE_ENABLED", "true" if VECTOR_INDEX_TYPE != "hnsw" else "false").lower() == "true"
+RESCORE_WINDOW = int(os.getenv("RESCORE_WINDOW", "100"))
+PRODUCT_VECTOR_STORE_DIR = os.getenv("PRODUCT_VECTOR_STORE_DIR", "/app/data/product_vectors")
@@ -0,0 +1,237 @@
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MemmapVectorStore:
+    """Float32 vectors in a growable memory-mapped matrix plus a key -> row log.
+
+    ``vectors.f32`` holds the rows; ``index.tsv`` is an append-only log of
+    ``key<TAB>row`` lines (row ``-1`` marks a deletion, last line wins). Rows
+    are flushed before their index lines are written, so a crash can lose
+    recent entries but never leaves the index pointing at garbage.
+
+    Several processes (API workers) may open the same directory: writers take
+    an exclusive ``flock`` on ``.lock`` and replay log lines appended by other
+    processes before allocating rows, and readers replay them before lookups,
+    so every process sees the same key -> row mapping.
+    """
+
+    def __init__(self, directory: str, dims: int, initial_capacity: int = 4096):
+        self._directory = directory
+        self._dims = dims
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._index_path = os.path.join(directory, "index.tsv")
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        self._free_rows: Set[int] = set()
+        self._next_row = 0
+        # Identity and replayed length of index.tsv; a new inode means another process cleared it
+        self._index_inode: Optional[int] = None
+        self._index_offset = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, ".lock"), "a+b")
+        with self._lock, self._file_lock():
+            if not os.path.exists(self._index_path):
+                open(self._index_path, "ab").close()
+            self._sync()
+            existing_rows = os.path.getsize(self._vectors_path) // (dims * 4) if os.path.exists(self._vectors_path) else 0
+            self._capacity = max(initial_capacity, existing_rows, self._next_row)
+            self._vectors = self._open_vectors(self._capacity)
+        logger.info(f"Vector store at {directory} holds {len(self._rows)} vectors")
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """Replay index lines written since the last sync (by any process); call with ``_lock`` held."""
+        stat = os.stat(self._index_path)
+        if stat.st_ino != self._index_inode or stat.st_size < self._index_offset:
+            self._rows.clear()
+            self._free_rows.clear()
+            self._next_row = 0
+            self._index_inode = stat.st_ino
+            self._index_offset = 0
+        if stat.st_size == self._index_offset:
+            return
+        with open(self._index_path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read(stat.st_size - self._index_offset)
+        # A line still being appended by another process is picked up next time
+        complete = data.rfind(b"\n") + 1
+        self._index_offset += complete
+        for line in data[:complete].decode("utf-8").splitlines():
+            key, _, row = line.rpartition("\t")
+            if not key or not row.lstrip("-").isdigit():
+                continue
+            row = int(row)
+            if row < 0:
+                old_row = self._rows.pop(key, None)
+                if old_row is not None:
+                    self._free_rows.add(old_row)
+            else:
+                self._rows[key] = row
+                self._free_rows.discard(row)
+                self._next_row = max(self._next_row, row + 1)
+        if hasattr(self, "_vectors"):
+            self._grow(self._next_row)
+
+    def _open_vectors(self, capacity: int) -> np.memmap:
+        size = capacity * self._dims * 4
+        with open(self._vectors_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self._dims))
+
+    def _grow(self, required_rows: int):
+        capacity = self._capacity
+        while capacity < required_rows:
+            capacity *= 2
+        if capacity == self._capacity:
+            return
+        self._vectors.flush()
+        del self._vectors
+        self._vectors = self._open_vectors(capacity)
+        self._capacity = capacity
+
+    def _allocate_row(self) -> int:
+        if self._free_rows:
+            return self._free_rows.pop()
+        row = self._next_row
+        self._next_row = row + 1
+        return row
+
+    def _append_index(self, lines: str):
+        # Called with the file lock held, so nobody else appended since the last sync
+        with open(self._index_path, "ab") as f:
+            f.write(lines.encode("utf-8"))
+            self._index_offset = f.tell()
+
+    def _lookup(self, keys: List[str]) -> Tuple[np.ndarray, List[int]]:
+        result = np.zeros((len(keys), self._dims), dtype=np.float32)
+        missing = []
+        with self._lock:
+            self._sync()
+            for i, key in enumerate(keys):
+                row = self._rows.get(key)
+                if row is None:
+                    missing.append(i)
+                else:
+                    result[i] = self._vectors[row]
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        return result, missing
+
+    def _write(self, keys: List[str], vectors: np.ndarray, overwrite: bool):
+        with self._lock, self._file_lock():
+            self._sync()
+            new_entries = []
+            updated = False
+            for key, vector in zip(keys, vectors):
+                row = self._rows.get(key)
+                if row is not None:
+                    if overwrite:
+                        self._vectors[row] = vector
+                        updated = True
+                    continue
+                row = self._allocate_row()
+                self._rows[key] = row
+                new_entries.append((key, row, vector))
+            if new_entries:
+                self._grow(max(row for _, row, _ in new_entries) + 1)
+                for _, row, vector in new_entries:
+                    self._vectors[row] = vector
+            if not new_entries and not updated:
+                return
+            self._vectors.flush()
+            if new_entries:
+                self._append_index("".join(f"{key}\t{row}\n" for key, row, _ in new_entries))
+
+    def _remove(self, keys: List[str]):
+        with self._lock, self._file_lock():
+            self._sync()
+            removed = []
+            for key in keys:
+                row = self._rows.pop(key, None)
+                if row is not None:
+                    self._free_rows.add(row)
+                    removed.append(key)
+            if removed:
+                self._append_index("".join(f"{key}\t-1\n" for key in removed))
+
+    def clear(self):
+        with self._lock, self._file_lock():
+            # Replace rather than truncate, so other processes notice the new inode
+            tmp_path = f"{self._index_path}.tmp"
+            open(tmp_path, "wb").close()
+            os.replace(tmp_path, self._index_path)
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            self._vectors.flush()
+            self._lock_file.close()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._rows),
+                "capacity": self._capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0
+            }
+
+
+class EmbeddingStore(MemmapVectorStore):
+    """Content-addressed store of text embeddings keyed by ``sha1(model name + text)``,
+    so unchanged product texts are never re-encoded. The model name passed in
+    should include the backend that actually encoded the texts."""
+
+    @staticmethod
+    def key(model_name: str, text: str) -> str:
+        return hashlib.sha1(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model_name: str, texts: List[str]) -> Tuple[np.ndarray, List[int]]:
+        """Return stored vectors for ``texts`` and the positions that missed."""
+        return self._lookup([self.key(model_name, text) for text in texts])
+
+    def put_many(self, model_name: str, texts: List[str], vectors: np.ndarray):
+        self._write([self.key(model_name, text) for text in texts], vectors, overwrite=False)
+
+
+class ProductVectorStore(MemmapVectorStore):
+    """Full-precision, L2-normalized product vectors keyed by product id, used
+    to rescore candidates coming back from a quantized ES vector index."""
+
+    def put_many(self, product_ids: List[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self._write(list(product_ids), vectors / norms, overwrite=True)
+
+    def get_many(self, product_ids: List[str]) -> Tuple[np.ndarray, List[int]]:
+        return self._lookup(list(product_ids))
+
+    def delete_many(self, product_ids: List[str]):
+        self._remove(list(product_ids))
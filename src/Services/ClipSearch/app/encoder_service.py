@@ -0,0 +1,312 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.connection import AuthenticationError, Client, Connection, Listener
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .config import (
+    EMBEDDING_DIMS,
+    MODEL_WAIT_TIMEOUT_SECONDS,
+    ENCODER_SERVICE_SOCKET,
+    ENCODER_SERVICE_AUTHKEY,
+    ENCODER_SERVICE_START_TIMEOUT_SECONDS,
+    ENCODER_SERVICE_TIMEOUT_SECONDS
+)
+from .encoders import LazyModel, ModelNotReadyError, load_image_encoder, load_text_encoder
+
+logger = logging.getLogger(__name__)
+
+MODEL_LOADERS = {"text": load_text_encoder, "image": load_image_encoder}
+
+
+class EncoderServiceError(Exception):
+    pass
+
+
+class EncoderServer:
+    """Owns the models and serves encode requests from API workers.
+
+    Each worker connects over a Unix socket and sends its inputs pickled
+    together with the name of a shared-memory buffer it owns; the vectors are
+    written straight into that buffer and only the row count goes back over
+    the socket. One model copy serves every worker; encodes of the same model
+    are serialized since torch already spreads a batch over all cores.
+    """
+
+    def __init__(self, socket_path: str, authkey: bytes):
+        self._socket_path = socket_path
+        self._authkey = authkey
+        self._models = {
+            name: LazyModel(name, loader, MODEL_WAIT_TIMEOUT_SECONDS)
+            for name, loader in MODEL_LOADERS.items()
+        }
+        self._model_locks = {name: threading.Lock() for name in MODEL_LOADERS}
+
+    def serve_forever(self):
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+        self._models["text"].start_loading()
+        with Listener(self._socket_path, family="AF_UNIX", authkey=self._authkey) as listener:
+            logger.info(f"Encoder service listening on {self._socket_path}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, AuthenticationError) as e:
+                    logger.warning(f"Rejected encoder client: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), name="encoder-client", daemon=True).start()
+
+    def _handle(self, conn: Connection):
+        buffers: Dict[str, SharedMemory] = {}
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    break
+                conn.send(self._dispatch(request, buffers))
+        finally:
+            for shm in buffers.values():
+                shm.close()
+            conn.close()
+
+    def _dispatch(self, request: Dict, buffers: Dict[str, SharedMemory]) -> Dict:
+        try:
+            op = request["op"]
+            if op == "encode":
+                return self._encode(request, buffers)
+            if op == "load":
+                self._models[request["model"]].start_loading()
+                return {"ok": True}
+            if op == "status":
+                return {"ok": True, "models": {name: model.status() for name, model in self._models.items()}}
+            raise ValueError(f"Unknown encoder service op '{op}'")
+        except Exception as e:
+            return {"ok": False, "error": str(e), "notReady": isinstance(e, ModelNotReadyError)}
+
+    def _encode(self, request: Dict, buffers: Dict[str, SharedMemory]) -> Dict:
+        name = request["model"]
+        inputs = request["inputs"]
+        with self._model_locks[name]:
+            vectors = self._models[name].encode(
+                inputs,
+                batch_size=request["batch_size"],
+                convert_to_numpy=True,
+                normalize_embeddings=request["normalize_embeddings"]
+            )
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(inputs), -1)
+
+        shm = self._attach(request["shm"], buffers)
+        if vectors.nbytes > shm.size:
+            raise EncoderServiceError(f"Shared buffer of {shm.size} bytes is too small for {vectors.nbytes}")
+        out = np.ndarray(vectors.shape, dtype=np.float32, buffer=shm.buf)
+        out[:] = vectors
+        del out
+        return {"ok": True, "rows": vectors.shape[0], "dims": vectors.shape[1]}
+
+    @staticmethod
+    def _attach(name: str, buffers: Dict[str, SharedMemory]) -> SharedMemory:
+        shm = buffers.get(name)
+        if shm is not None:
+            return shm
+        # A client only ever uses its latest buffer, so drop older ones
+        for old in buffers.values():
+            old.close()
+        buffers.clear()
+        shm = SharedMemory(name=name)
+        # The client owns the segment; keep this process's tracker from unlinking it
+        resource_tracker.unregister(shm._name, "shared_memory")
+        buffers[name] = shm
+        return shm
+
+
+class _EncoderConnection:
+    def __init__(self, socket_path: str, authkey: bytes, dims: int):
+        self._conn = Client(socket_path, family="AF_UNIX", authkey=authkey)
+        self._dims = dims
+        self._shm: Optional[SharedMemory] = None
+        self._capacity = 0
+
+    def request(self, message: Dict, timeout: Optional[float] = None) -> Dict:
+        self._conn.send(message)
+        if timeout is not None and not self._conn.poll(timeout):
+            # The answer may still arrive later, so the connection cannot be reused
+            raise TimeoutError(f"Encoder service did not answer within {timeout}s")
+        response = self._conn.recv()
+        if not response["ok"]:
+            if response.get("notReady"):
+                raise ModelNotReadyError(response["error"])
+            raise EncoderServiceError(response["error"])
+        return response
+
+    def encode(self, model: str, inputs: List[Any], batch_size: int, normalize_embeddings: bool) -> np.ndarray:
+        self._ensure_capacity(len(inputs))
+        response = self.request({
+            "op": "encode",
+            "model": model,
+            "inputs": inputs,
+            "batch_size": batch_size,
+            "normalize_embeddings": normalize_embeddings,
+            "shm": self._shm.name
+        }, timeout=ENCODER_SERVICE_TIMEOUT_SECONDS)
+        shape = (response["rows"], response["dims"])
+        return np.ndarray(shape, dtype=np.float32, buffer=self._shm.buf).copy()
+
+    def _ensure_capacity(self, rows: int):
+        if rows <= self._capacity:
+            return
+        self._release_buffer()
+        self._capacity = max(rows, 2 * self._capacity, 64)
+        self._shm = SharedMemory(create=True, size=self._capacity * self._dims * 4)
+
+    def _release_buffer(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def close(self):
+        self._conn.close()
+        self._release_buffer()
+
+
+class RemoteEncoder:
+    """SentenceTransformer-style ``encode`` backed by the shared encoder service.
+
+    Construction blocks until the service reports the model as loaded, so it
+    can be used as a ``LazyModel`` loader. Connections are pooled, one per
+    concurrent caller, each with its own shared-memory result buffer.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        socket_path: Optional[str] = None,
+        authkey: Optional[bytes] = None,
+        dims: int = EMBEDDING_DIMS
+    ):
+        self.model = model
+        self.encoder_backend: Optional[str] = None
+        self._socket_path = socket_path or ENCODER_SERVICE_SOCKET
+        self._authkey = authkey or _configured_authkey()
+        self._dims = dims
+        self._idle: List[_EncoderConnection] = []
+        self._lock = threading.Lock()
+        self._wait_until_loaded()
+
+    def _connect(self) -> _EncoderConnection:
+        return _EncoderConnection(self._socket_path, self._authkey, self._dims)
+
+    def _wait_until_loaded(self):
+        deadline = time.monotonic() + ENCODER_SERVICE_START_TIMEOUT_SECONDS
+        conn = None
+        while True:
+            try:
+                if conn is None:
+                    conn = self._connect()
+                    conn.request({"op": "load", "model": self.model})
+                status = conn.request({"op": "status"})["models"][self.model]
+                if status["status"] == "ready":
+                    # Same attribute as local models, so callers can tell a fallback backend apart
+                    self.encoder_backend = status.get("backend")
+                    break
+                if status["status"] == "failed":
+                    conn.close()
+                    raise EncoderServiceError(f"Encoder service failed to load {self.model} model: {status['error']}")
+            except (OSError, EOFError) as e:
+                if conn is not None:
+                    conn.close()
+                    conn = None
+                logger.info(f"Waiting for encoder service at {self._socket_path}: {e}")
+            if time.monotonic() > deadline:
+                if conn is not None:
+                    conn.close()
+                raise EncoderServiceError(f"Encoder service did not load {self.model} model in time")
+            time.sleep(0.5)
+        self._idle.append(conn)
+        logger.info(f"Using {self.model} model from encoder service at {self._socket_path}")
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        inputs = [sentences] if single else list(sentences)
+        if not inputs:
+            return np.zeros((0, self._dims), dtype=np.float32)
+
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        try:
+            if conn is None:
+                conn = self._connect()
+            vectors = conn.encode(self.model, inputs, batch_size, normalize_embeddings)
+        except (OSError, EOFError) as e:
+            # Lost or timed out: app.serve restarts a service that exits, so report not
+            # ready (503) until it is back rather than failing the request outright
+            if conn is not None:
+                conn.close()
+            raise ModelNotReadyError(f"Encoder service is unavailable: {str(e) or 'connection closed'}")
+        except Exception:
+            if conn is not None:
+                with self._lock:
+                    self._idle.append(conn)
+            raise
+        with self._lock:
+            self._idle.append(conn)
+        return vectors[0] if single else vectors
+
+    def ping(self, timeout: float = 2.0) -> Dict:
+        """Status of this model in the service; raises if the service is unreachable or
+        the model is not loaded there (e.g. the service was restarted)."""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        try:
+            if conn is None:
+                conn = self._connect()
+            status = conn.request({"op": "status"}, timeout=timeout)["models"][self.model]
+        except (OSError, EOFError, EncoderServiceError) as e:
+            if conn is not None:
+                conn.close()
+            raise EncoderServiceError(f"Encoder service is unreachable: {e}")
+        with self._lock:
+            self._idle.append(conn)
+        if status["status"] != "ready":
+            raise EncoderServiceError(f"Encoder service {self.model} model is {status['status']}")
+        return status
+
+    def close(self):
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._idle.clear()
+
+
+def _configured_authkey() -> bytes:
+    if not ENCODER_SERVICE_AUTHKEY:
+        raise EncoderServiceError("ENCODER_SERVICE_AUTHKEY must be set to a secret shared with the API workers")
+    return ENCODER_SERVICE_AUTHKEY.encode("utf-8")
+
+
+def run_encoder_service(socket_path: str, authkey: bytes):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    EncoderServer(socket_path, authkey).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared ClipSearch encoder process for multiple API workers")
+    parser.add_argument("--socket", default=ENCODER_SERVICE_SOCKET or "/tmp/clipsearch-encoder.sock")
+    args = parser.parse_args()
+    try:
+        authkey = _configured_authkey()
+    except EncoderServiceError as e:
+        parser.error(str(e))
+    run_encoder_service(args.socket, authkey)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from .config import (
+    IMG_MODEL_NAME,
+    TEXT_MODEL_NAME,
+    TEXT_ENCODER_BACKEND,
+    IMG_ENCODER_BACKEND,
+    ONNX_EXPORT_DIR,
+    ONNX_QUANTIZATION_CONFIG,
+    ENCODER_VERIFY,
+    ENCODER_MIN_COSINE,
+    MODEL_CACHE_DIR
+)
+
+logger = logging.getLogger(__name__)
+
+TEXT_BACKENDS = ("torch", "onnx", "onnx-int8")
+IMG_BACKENDS = ("torch", "torch-int8")
+
+VERIFICATION_SENTENCES = [
+    "laptop",
+    "iphone 15 pro max 256gb",
+    "tai nghe bluetooth chống ồn",
+    "Giày thể thao nam chạy bộ",
+    "Nồi chiên không dầu dung tích lớn 6L",
+    "wireless mechanical keyboard with RGB backlight",
+    "Sữa rửa mặt cho da dầu mụn",
+    "Bàn làm việc gỗ thông minh có ngăn kéo"
+]
+
+# Results of comparing exported/quantized encoders with the torch model, per model file
+VERIFICATION_FILE = "verification.json"
+
+
+class EncoderVerificationError(Exception):
+    pass
+
+
+class ModelNotReadyError(Exception):
+    pass
+
+
+class LazyModel:
+    """Loads a model on a background thread and proxies ``encode`` to it.
+
+    ``start_loading`` kicks off the load eagerly; otherwise the first
+    ``encode`` call triggers it. Callers block for at most ``wait_timeout``
+    seconds before getting ``ModelNotReadyError``. A failed load is retried by
+    the next caller.
+    """
+
+    def __init__(self, name: str, loader: Callable[[], SentenceTransformer], wait_timeout: float):
+        self.name = name
+        self._loader = loader
+        self._wait_timeout = wait_timeout
+        self._model: Optional[SentenceTransformer] = None
+        self._error: Optional[Exception] = None
+        self._loaded = threading.Event()
+        self._loading = False
+        self._lock = threading.Lock()
+        self.load_seconds: Optional[float] = None
+
+    def start_loading(self):
+        with self._lock:
+            if self._loading or self._model is not None:
+                return
+            self._loading = True
+            self._error = None
+            self._loaded.clear()
+        threading.Thread(target=self._load, name=f"{self.name}-model-loader", daemon=True).start()
+
+    def _load(self):
+        logger.info(f"Loading {self.name} model in background...")
+        start = time.perf_counter()
+        try:
+            model = self._loader()
+            with self._lock:
+                self._model = model
+                self.load_seconds = time.perf_counter() - start
+            logger.info(f"Loaded {self.name} model in {self.load_seconds:.1f}s")
+        except Exception as e:
+            logger.error(f"Failed to load {self.name} model: {e}")
+            with self._lock:
+                self._error = e
+        finally:
+            with self._lock:
+                self._loading = False
+            self._loaded.set()
+
+    @property
+    def is_ready(self) -> bool:
+        return self._model is not None
+
+    @property
+    def backend(self) -> Optional[str]:
+        """Backend the model actually loaded with, which differs from the
+        configured one after a fallback; ``None`` until loaded."""
+        return getattr(self._model, "encoder_backend", None)
+
+    def get(self) -> SentenceTransformer:
+        model = self._model
+        if model is not None:
+            return model
+        self.start_loading()
+        if not self._loaded.wait(self._wait_timeout) or self._model is None:
+            reason = f": {self._error}" if self._error else ""
+            raise ModelNotReadyError(f"{self.name} model is not ready{reason}")
+        return self._model
+
+    def encode(self, *args, **kwargs):
+        return self.get().encode(*args, **kwargs)
+
+    def status(self) -> Dict:
+        with self._lock:
+            if self._model is not None:
+                state = "ready"
+            elif self._loading:
+                state = "loading"
+            elif self._error is not None:
+                state = "failed"
+            else:
+                state = "not_loaded"
+            return {
+                "status": state,
+                "backend": self.backend,
+                "loadSeconds": self.load_seconds,
+                "error": str(self._error) if self._error else None
+            }
+
+
+def _export_path(model_name: str) -> str:
+    return os.path.join(ONNX_EXPORT_DIR, model_name.replace("/", "__"))
+
+
+def _quantized_file_name() -> str:
+    return f"onnx/model_qint8_{ONNX_QUANTIZATION_CONFIG}.onnx"
+
+
+def export_onnx_text_model(model_name: str = TEXT_MODEL_NAME, quantize: bool = True) -> str:
+    """Export the text model to ONNX (and an int8 dynamic-quantized variant)
+    under ``ONNX_EXPORT_DIR``, verify the exports against the torch model and
+    return the export directory."""
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    path = _export_path(model_name)
+    logger.info(f"Exporting {model_name} to ONNX at {path}")
+    model = SentenceTransformer(model_name, backend="onnx", cache_folder=MODEL_CACHE_DIR)
+    model.save_pretrained(path)
+    if quantize:
+        logger.info(f"Quantizing {model_name} to int8 ({ONNX_QUANTIZATION_CONFIG})")
+        export_dynamic_quantized_onnx_model(
+            model,
+            quantization_config=ONNX_QUANTIZATION_CONFIG,
+            model_name_or_path=path
+        )
+    verify_onnx_text_model(model_name, ("onnx", "onnx-int8") if quantize else ("onnx",))
+    return path
+
+
+def cosine_agreement(reference, candidate, inputs: Optional[List] = None) -> float:
+    """Minimum cosine similarity between two encoders over sample inputs
+    (sentences by default)."""
+    inputs = inputs or VERIFICATION_SENTENCES
+    expected = reference.encode(inputs, convert_to_numpy=True, normalize_embeddings=True)
+    actual = candidate.encode(inputs, convert_to_numpy=True, normalize_embeddings=True)
+    return float(np.min(np.sum(expected * actual, axis=1)))
+
+
+def _onnx_file_name(backend: str) -> str:
+    return _quantized_file_name() if backend == "onnx-int8" else "onnx/model.onnx"
+
+
+def _read_verification(model_name: str) -> Dict[str, float]:
+    try:
+        with open(os.path.join(_export_path(model_name), VERIFICATION_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def verify_onnx_text_model(model_name: str, backends) -> Dict[str, float]:
+    """Compare ONNX exports with the torch model and save each agreement next to
+    the export, so loading them later does not need the torch reference."""
+    results = _read_verification(model_name)
+    reference = SentenceTransformer(model_name, cache_folder=MODEL_CACHE_DIR)
+    for backend in backends:
+        candidate = SentenceTransformer(
+            _export_path(model_name), backend="onnx", model_kwargs={"file_name": _onnx_file_name(backend)}
+        )
+        results[_onnx_file_name(backend)] = cosine_agreement(reference, candidate)
+    path = os.path.join(_export_path(model_name), VERIFICATION_FILE)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+    return results
+
+
+def _load_onnx_text_model(model_name: str, quantized: bool) -> SentenceTransformer:
+    path = _export_path(model_name)
+    file_name = _onnx_file_name("onnx-int8" if quantized else "onnx")
+    if not os.path.exists(os.path.join(path, file_name)):
+        export_onnx_text_model(model_name, quantize=quantized)
+    return SentenceTransformer(path, backend="onnx", model_kwargs={"file_name": file_name})
+
+
+def _tag(model, backend: str):
+    model.encoder_backend = backend
+    return model
+
+
+def _load_torch_text_model() -> SentenceTransformer:
+    return _tag(SentenceTransformer(TEXT_MODEL_NAME, cache_folder=MODEL_CACHE_DIR), "torch")
+
+
+def load_text_encoder(backend: str = TEXT_ENCODER_BACKEND) -> SentenceTransformer:
+    if backend not in TEXT_BACKENDS:
+        raise ValueError(f"Unknown text encoder backend '{backend}', expected one of {TEXT_BACKENDS}")
+
+    logger.info(f"Loading text model {TEXT_MODEL_NAME} with backend: {backend}")
+    if backend == "torch":
+        return _load_torch_text_model()
+
+    try:
+        model = _load_onnx_text_model(TEXT_MODEL_NAME, quantized=backend == "onnx-int8")
+    except Exception as e:
+        logger.error(f"Failed to load ONNX text model, falling back to torch: {e}")
+        return _load_torch_text_model()
+
+    if ENCODER_VERIFY:
+        # Exports are verified when they are made; only older exports are checked here, once
+        agreement = _read_verification(TEXT_MODEL_NAME).get(_onnx_file_name(backend))
+        if agreement is None:
+            agreement = verify_onnx_text_model(TEXT_MODEL_NAME, (backend,))[_onnx_file_name(backend)]
+        if agreement < ENCODER_MIN_COSINE:
+            logger.error(
+                f"{backend} text encoder cosine agreement {agreement:.4f} is below "
+                f"{ENCODER_MIN_COSINE}, falling back to torch"
+            )
+            return _load_torch_text_model()
+        logger.info(f"{backend} text encoder verified, min cosine agreement {agreement:.4f}")
+    return _tag(model, backend)
+
+
+def _verification_images(count: int = 8, size: int = 224) -> List:
+    """Deterministic smooth colour fields, enough to exercise the vision tower."""
+    from PIL import Image
+
+    rng = np.random.RandomState(0)
+    images = []
+    for _ in range(count):
+        coarse = rng.randint(0, 256, size=(4, 4, 3), dtype=np.uint8)
+        images.append(Image.fromarray(coarse).resize((size, size), Image.BICUBIC))
+    return images
+
+
+def load_image_encoder(backend: str = IMG_ENCODER_BACKEND) -> SentenceTransformer:
+    # The CLIP vision tower is not a plain transformers module, so the ONNX
+    # backend of sentence-transformers cannot load it; int8 uses torch dynamic
+    # quantization of the Linear layers instead.
+    if backend not in IMG_BACKENDS:
+        raise ValueError(f"Unknown image encoder backend '{backend}', expected one of {IMG_BACKENDS}")
+
+    logger.info(f"Loading image model {IMG_MODEL_NAME} with backend: {backend}")
+    model = SentenceTransformer(IMG_MODEL_NAME, device="cpu", cache_folder=MODEL_CACHE_DIR)
+    if backend == "torch":
+        return _tag(model, "torch")
+
+    import torch
+    quantized = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if ENCODER_VERIFY:
+        # Quantization happens at load time, and the fp32 model is already in memory to compare with
+        agreement = cosine_agreement(model, quantized, _verification_images())
+        if agreement < ENCODER_MIN_COSINE:
+            logger.error(
+                f"{backend} image encoder cosine agreement {agreement:.4f} is below "
+                f"{ENCODER_MIN_COSINE}, falling back to torch"
+            )
+            return _tag(model, "torch")
+        logger.info(f"{backend} image encoder verified, min cosine agreement {agreement:.4f}")
+    return _tag(quantized, backend)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and verify ClipSearch encoder backends")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("export", help="Export the text model to ONNX fp32 and int8")
+    verify_parser = subparsers.add_parser("verify", help="Compare a backend against the torch text model")
+    verify_parser.add_argument("--backend", choices=TEXT_BACKENDS[1:], default="onnx-int8")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == "export":
+        path = export_onnx_text_model()
+        print(f"Exported {TEXT_MODEL_NAME} to {path}")
+        results = _read_verification(TEXT_MODEL_NAME)
+    else:
+        results = verify_onnx_text_model(TEXT_MODEL_NAME, (args.backend,))
+
+    for backend in ("onnx", "onnx-int8") if args.command == "export" else (args.backend,):
+        agreement = results[_onnx_file_name(backend)]
+        status = "OK" if agreement >= ENCODER_MIN_COSINE else "FAILED"
+        print(f"{backend}: min cosine agreement {agreement:.4f} ({status}, threshold {ENCODER_MIN_COSINE})")
+        if agreement < ENCODER_MIN_COSINE:
+            raise EncoderVerificationError(f"{backend} encoder disagrees with torch reference")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from .config import INGEST_CHUNK_SIZE, INGEST_QUEUE_DEPTH, INGEST_MAX_LINE_BYTES
+from .models import ProductIndexRequest
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class _Chunk:
+    def __init__(self, number: int):
+        self.number = number
+        self.first_line: Optional[int] = None
+        self.last_line: Optional[int] = None
+        self.products: List[ProductIndexRequest] = []
+        self.errors: List[Dict] = []
+        self.field_texts = None
+        self.images: Optional[List[List[bytes]]] = None
+        self.actions: Optional[List[Dict]] = None
+        self.error: Optional[str] = None
+
+    def add_line(self, line_number: int):
+        if self.first_line is None:
+            self.first_line = line_number
+        self.last_line = line_number
+
+    @property
+    def size(self) -> int:
+        return len(self.products) + len(self.errors)
+
+
+async def ndjson_lines(body: AsyncIterator[bytes], max_line_bytes: int = INGEST_MAX_LINE_BYTES) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    """Split a byte stream into ``(line number, line)`` pairs; lines longer
+    than ``max_line_bytes`` are dropped as they arrive and yielded as ``None``."""
+    buffer = bytearray()
+    line_number = 0
+    oversized = False
+    async for data in body:
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                if not oversized:
+                    buffer += data[start:]
+                    if len(buffer) > max_line_bytes:
+                        oversized = True
+                        buffer.clear()
+                break
+            line_number += 1
+            if not oversized:
+                buffer += data[start:end]
+            if oversized or len(buffer) > max_line_bytes:
+                yield line_number, None
+            else:
+                yield line_number, bytes(buffer)
+            buffer.clear()
+            oversized = False
+            start = end + 1
+    if oversized:
+        yield line_number + 1, None
+    elif buffer.strip():
+        yield line_number + 1, bytes(buffer)
+
+
+class StreamingIngest:
+    """Index an NDJSON stream of products through a three-stage pipeline.
+
+    Lines are parsed and HTML-cleaned into chunks of ``chunk_size`` while the
+    chunk's product images are fetched, chunks are encoded into bulk actions
+    on a worker thread, and the actions are written with the bulk writer. The
+    stages are connected by queues holding at most ``queue_depth`` chunks, so
+    chunk N+1 is encoded while chunk N is written, and reading the request
+    body pauses whenever the pipeline is full. Memory is bounded by the chunks
+    in flight regardless of the stream length, as long as the caller does not
+    keep the reports.
+
+    ``run`` yields one report per chunk in stream order; ``summary`` has the
+    totals once it is exhausted.
+    """
+
+    def __init__(self, search_engine, chunk_size: int = INGEST_CHUNK_SIZE, queue_depth: int = INGEST_QUEUE_DEPTH):
+        self._engine = search_engine
+        self._chunk_size = max(1, chunk_size)
+        self._queue_depth = max(1, queue_depth)
+        self.chunks = 0
+        self.received = 0
+        self.indexed = 0
+        self.failed = 0
+        self.error: Optional[str] = None
+        self.seconds = 0.0
+
+    async def run(self, body: AsyncIterator[bytes]) -> AsyncIterator[Dict]:
+        cleaned: asyncio.Queue = asyncio.Queue(maxsize=self._queue_depth)
+        encoded: asyncio.Queue = asyncio.Queue(maxsize=self._queue_depth)
+        reports: asyncio.Queue = asyncio.Queue(maxsize=self._queue_depth)
+        started = time.perf_counter()
+        tasks = [
+            asyncio.create_task(self._stage(self._read_and_clean(body, cleaned), cleaned)),
+            asyncio.create_task(self._stage(self._encode(cleaned, encoded), encoded)),
+            asyncio.create_task(self._stage(self._write(encoded, reports), reports))
+        ]
+        try:
+            while True:
+                report = await reports.get()
+                if report is _DONE:
+                    break
+                yield report
+        finally:
+            self.seconds = time.perf_counter() - started
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _stage(self, work, downstream: asyncio.Queue):
+        # Always signal the next stage, even if this one fails, so the pipeline drains
+        try:
+            await work
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.error = self.error or str(e)
+            logger.error(f"Streaming ingest stopped: {e}")
+        await downstream.put(_DONE)
+
+    async def _read_and_clean(self, body: AsyncIterator[bytes], cleaned: asyncio.Queue):
+        chunk = _Chunk(1)
+        async for line_number, line in ndjson_lines(body):
+            if line is not None and not line.strip():
+                continue
+            chunk.add_line(line_number)
+            if line is None:
+                chunk.errors.append({"line": line_number, "error": f"Line exceeds {INGEST_MAX_LINE_BYTES} bytes"})
+            else:
+                try:
+                    chunk.products.append(ProductIndexRequest.model_validate_json(line))
+                except ValidationError as e:
+                    chunk.errors.append({"line": line_number, "error": _validation_message(e)})
+            if chunk.size >= self._chunk_size:
+                await cleaned.put(await self._clean(chunk))
+                chunk = _Chunk(chunk.number + 1)
+        if chunk.size:
+            await cleaned.put(await self._clean(chunk))
+
+    async def _clean(self, chunk: _Chunk) -> _Chunk:
+        if chunk.products:
+            chunk.field_texts, chunk.images = await asyncio.gather(
+                asyncio.to_thread(self._engine.product_field_texts, chunk.products),
+                self._engine.image_fetcher.fetch(chunk.products)
+            )
+        return chunk
+
+    async def _encode(self, cleaned: asyncio.Queue, encoded: asyncio.Queue):
+        while (chunk := await cleaned.get()) is not _DONE:
+            if chunk.products:
+                try:
+                    chunk.actions = await asyncio.to_thread(
+                        self._engine.build_bulk_actions,
+                        chunk.products,
+                        chunk.field_texts,
+                        chunk.images
+                    )
+                except Exception as e:
+                    chunk.error = f"Encoding failed: {e}"
+                chunk.field_texts = None
+                chunk.images = None
+            await encoded.put(chunk)
+
+    async def _write(self, encoded: asyncio.Queue, reports: asyncio.Queue):
+        while (chunk := await encoded.get()) is not _DONE:
+            failed_ids: Dict[str, str] = {}
+            if chunk.actions:
+                try:
+                    _, failed = await self._engine.write_bulk_actions(chunk.actions)
+                    for item in failed:
+                        result = next(iter(item.values()))
+                        failed_ids.setdefault(result.get("_id"), str(result.get("error", result.get("status"))))
+                except Exception as e:
+                    chunk.error = f"Bulk write failed: {e}"
+                chunk.actions = None
+            await reports.put(self._report(chunk, failed_ids))
+
+    def _report(self, chunk: _Chunk, failed_ids: Dict[str, str]) -> Dict:
+        errors = list(chunk.errors)
+        if chunk.error is not None:
+            indexed = 0
+            errors.extend({"id": product.id, "error": chunk.error} for product in chunk.products)
+        else:
+            indexed = sum(1 for product in chunk.products if product.id not in failed_ids)
+            errors.extend({"id": product_id, "error": error} for product_id, error in failed_ids.items())
+        failed = chunk.size - indexed
+
+        self.chunks += 1
+        self.received += chunk.size
+        self.indexed += indexed
+        self.failed += failed
+        if failed:
+            logger.warning(f"Streaming ingest chunk {chunk.number}: {failed} of {chunk.size} products failed")
+        return {
+            "chunk": chunk.number,
+            "firstLine": chunk.first_line,
+            "lastLine": chunk.last_line,
+            "received": chunk.size,
+            "success": indexed,
+            "failed": failed,
+            "errors": errors,
+            "error": chunk.error  # set when the whole chunk failed to encode or write
+        }
+
+    def summary(self) -> Dict:
+        return {
+            "chunks": self.chunks,
+            "received": self.received,
+            "success": self.indexed,
+            "failed": self.failed,
+            "docsPerSecond": round(self.received / self.seconds, 1) if self.seconds > 0 else None,
+            "error": self.error
+        }
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in e['loc']) or 'line'}: {e['msg']}" for e in error.errors()
+    )
@@ -1,16 +1,32 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.requests import ClientDisconnect
+from contextlib import aclosing
+from typing import List, Optional
+import asyncio
+import json
 import logging
+from PIL import UnidentifiedImageError
 
 from .models import (
     ProductIndexRequest,
     SearchRequest,
     SearchResponse,
+    BatchSearchResponse,
     EmbeddingRequest,
     EmbeddingResponse
 )
-from .search_engine import SearchEngine
+from .search_engine import SearchEngine, InvalidCursorError, ImageTooLargeError
+from .encoders import ModelNotReadyError
+from .reindex import ReindexManager, ReindexInProgressError
+from .ingest import StreamingIngest
+from .bulk_jobs import BulkIndexJobManager, BulkJobNotFoundError, BulkJobStateError
+from .batcher import InferenceBatcher, BatcherQueueFullError
+from .metrics import mark_process_dead, render_metrics, stage, track_operation
+from .config import BATCH_MAX_SIZE, BATCH_MAX_DELAY_MS, BATCH_MAX_QUEUE, SEARCH_BATCH_MAX_SIZE, IMAGE_UPLOAD_MAX_BYTES
 
 logging.basicConfig(
     level=logging.INFO,
@@ -33,14 +49,89 @@ app.add_middleware(
 )
 
 search_engine = None
+reindex_manager = None
+bulk_job_manager = None
+text_batcher = None
+image_batcher = None
 
 @app.on_event("startup")
 async def startup_event():
-    global search_engine
+    global search_engine, reindex_manager, bulk_job_manager, text_batcher, image_batcher
     logger.info("Starting CLIP Search Service...")
     search_engine = SearchEngine()
+    search_engine.start()
+    reindex_manager = ReindexManager(search_engine)
+    bulk_job_manager = BulkIndexJobManager(search_engine)
+    bulk_job_manager.start()
+    text_batcher = InferenceBatcher(
+        "text", search_engine.encode_texts, BATCH_MAX_SIZE, BATCH_MAX_DELAY_MS, BATCH_MAX_QUEUE
+    )
+    image_batcher = InferenceBatcher(
+        "image", search_engine.encode_images, BATCH_MAX_SIZE, BATCH_MAX_DELAY_MS, BATCH_MAX_QUEUE
+    )
+    await text_batcher.start()
+    await image_batcher.start()
     logger.info("CLIP Search Service started successfully")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if text_batcher:
+        await text_batcher.stop()
+    if image_batcher:
+        await image_batcher.stop()
+    if bulk_job_manager:
+        await bulk_job_manager.close()
+    if reindex_manager:
+        await reindex_manager.close()
+    if search_engine:
+        await search_engine.close()
+    mark_process_dead()
+
+class RequestBodyStreamingResponse(StreamingResponse):
+    """StreamingResponse whose generator still reads the request body.
+
+    Below ASGI spec 2.4 (uvicorn reports 2.3) starlette watches for client
+    disconnects by reading ``receive`` while streaming, which would swallow
+    body chunks; here a disconnect surfaces through the body reader or
+    ``send`` instead."""
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+# Room for multipart boundaries and headers on top of the image itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+async def _encode_image_query(image_base64: str, decoded=None) -> List[float]:
+    prepared = await run_in_threadpool(search_engine.prepare_image_query, image_base64, decoded)
+    return await _encode_prepared_image(*prepared)
+
+async def _encode_prepared_image(cached, image, cache_keys) -> List[float]:
+    if cached is not None:
+        return cached.tolist()
+    with stage("image_encode"):
+        embedding = await image_batcher.submit(image)
+    search_engine.store_image_embedding(embedding, cache_keys)
+    return embedding.tolist()
+
+async def _encode_text_query(query: str):
+    with stage("text_encode"):
+        return await text_batcher.submit(query)
+
+async def _encode_search_query(request: SearchRequest, decoded_image=None) -> List[float]:
+    tasks = []
+    if request.query:
+        tasks.append(_encode_text_query(request.query))
+    if request.image:
+        tasks.append(_encode_image_query(request.image, decoded_image))
+    embeddings = await asyncio.gather(*tasks)
+    with stage("embedding_combine"):
+        return search_engine.combine_query_embeddings([list(e) for e in embeddings])
+
 @app.get("/")
 async def root():
     return {
@@ -51,13 +142,39 @@ async def root():
 
 @app.get("/health")
 async def health_check():
+    """Liveness only; use /ready to know whether requests can be served."""
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    if search_engine is None:
+        return JSONResponse(status_code=503, content={"ready": False})
+    status = await run_in_threadpool(search_engine.readiness)
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/metrics")
+async def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "queryEmbeddings": search_engine.query_cache.stats(),
+        "imageEmbeddings": search_engine.image_cache.stats(),
+        "searchResults": search_engine.result_cache.stats(),
+        "indexVersion": search_engine.index_version,
+        "embeddingStore": search_engine.embedding_store.stats() if search_engine.embedding_store else None,
+        "productVectors": search_engine.product_vectors.stats() if search_engine.product_vectors else None
+    }
+
 @app.post("/embeddings", response_model=EmbeddingResponse)
 async def generate_embedding(request: EmbeddingRequest):
     try:
-        embedding = search_engine.generate_embedding(request.text)
-        return EmbeddingResponse(embedding=embedding)
+        embedding = await text_batcher.submit(request.text)
+        return EmbeddingResponse(embedding=embedding.tolist())
+    except (BatcherQueueFullError, ModelNotReadyError) as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error generating embedding: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -65,8 +182,11 @@ async def generate_embedding(request: EmbeddingRequest):
 @app.post("/index-product")
 async def index_product(product: ProductIndexRequest):
     try:
-        search_engine.index_product(product)
+        with track_operation("index"):
+            await search_engine.index_product(product)
         return {"message": f"Product {product.id} indexed successfully"}
+    except ModelNotReadyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error indexing product {product.id}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -74,21 +194,81 @@ async def index_product(product: ProductIndexRequest):
 @app.post("/bulk-index-products")
 async def bulk_index_products(request: List[ProductIndexRequest]):
     try:
-        result = search_engine.bulk_index_products(request)
+        with track_operation("bulk_index"):
+            result = await search_engine.bulk_index_products(request)
         return {
             "message": f"Bulk indexed {result['success']} products",
             "success": result['success'],
             "failed": result['failed']
         }
+    except ModelNotReadyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error bulk indexing products: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/bulk-index-products/stream")
+async def stream_index_products(request: Request):
+    """Index products sent as NDJSON (one ProductIndexRequest object per line).
+
+    The body is consumed incrementally through the parse/clean, encode and
+    ES bulk pipeline, so catalogues of any size are indexed in constant
+    memory. The response is NDJSON as well: one report per chunk, sent as
+    soon as the chunk is written, and the totals as the last line. Invalid
+    lines are reported by line number and do not stop the stream."""
+    if not search_engine.text_model.is_ready:
+        raise HTTPException(status_code=503, detail="Text model is not loaded yet")
+    ingest = StreamingIngest(search_engine)
+
+    async def reports():
+        with track_operation("stream_index"):
+            async with aclosing(ingest.run(request.stream())) as chunk_reports:
+                async for report in chunk_reports:
+                    yield json.dumps(report) + "\n"
+        logger.info(
+            f"Streamed {ingest.received} products in {ingest.chunks} chunks: "
+            f"{ingest.indexed} indexed, {ingest.failed} failed"
+        )
+        yield json.dumps({"message": f"Bulk indexed {ingest.indexed} products", **ingest.summary()}) + "\n"
+
+    return RequestBodyStreamingResponse(reports(), media_type="application/x-ndjson")
+
+@app.post("/bulk-index-jobs", status_code=202)
+async def submit_bulk_index_job(request: List[ProductIndexRequest]):
+    """Queue products for indexing in the background and return the job at once.
+    Progress is checkpointed, so an interrupted job resumes where it stopped."""
+    try:
+        return await bulk_job_manager.submit(request)
+    except Exception as e:
+        logger.error(f"Error submitting bulk index job: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/bulk-index-jobs")
+async def list_bulk_index_jobs(limit: int = 50):
+    return await bulk_job_manager.list(limit)
+
+@app.get("/bulk-index-jobs/{job_id}")
+async def get_bulk_index_job(job_id: str):
+    try:
+        return await bulk_job_manager.get(job_id)
+    except BulkJobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.post("/bulk-index-jobs/{job_id}/resume", status_code=202)
+async def resume_bulk_index_job(job_id: str):
+    """Requeue a failed job from its last checkpoint."""
+    try:
+        return await bulk_job_manager.resume(job_id)
+    except BulkJobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except BulkJobStateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 
 @app.delete("/index-product/{product_id}")
 async def delete_product(product_id: str):
     try:
-        search_engine.delete_product(product_id)
+        await search_engine.delete_product(product_id)
         return {"message": f"Product {product_id} deleted successfully"}
     except Exception as e:
         logger.error(f"Error deleting product {product_id}: {str(e)}")
@@ -98,22 +278,205 @@ async def delete_product(product_id: str):
 async def recreate_index():
     """Recreate the Elasticsearch index - use when schema changes"""
     try:
-        search_engine.recreate_index()
+        await search_engine.recreate_index()
         return {"message": "Index recreated successfully"}
     except Exception as e:
         logger.error(f"Error recreating index: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/reindex", status_code=202)
+async def start_reindex(products: Optional[List[ProductIndexRequest]] = None):
+    """Zero-downtime rebuild into a new versioned index followed by an alias swap.
+    Without a body, the documents currently in the index are re-embedded."""
+    try:
+        return await reindex_manager.submit(products)
+    except ReindexInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/reindex")
+async def current_reindex():
+    job = await reindex_manager.current()
+    if job is None:
+        raise HTTPException(status_code=404, detail="No reindex has been started")
+    return job
+
+@app.get("/reindex/{job_id}")
+async def get_reindex(job_id: str):
+    job = await reindex_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Reindex {job_id} not found")
+    return job
+
 
 @app.post("/search", response_model=SearchResponse)
 async def search_products(request: SearchRequest):
     try:
-        product_ids, total = search_engine.hybrid_search(request)
+        if not request.query and not request.image:
+            return SearchResponse(productIds=[], total=0)
+        
+        next_cursor = None
+        with track_operation("search") as timings:
+            # Decoded and hashed once, off the event loop, for both the cache key and the encoder
+            decoded_image = None
+            if request.image:
+                decoded_image = await run_in_threadpool(search_engine.decode_query_image, request.image)
+            image_key = decoded_image[1] if decoded_image else None
+            if request.useCursor or request.cursor:
+                query_embedding = await _encode_search_query(request, decoded_image)
+                product_ids, total, next_cursor = await search_engine.cursor_search(request, query_embedding)
+            else:
+                with stage("result_cache"):
+                    cached = search_engine.get_cached_search(request, image_key)
+                if cached is not None:
+                    product_ids, total = cached
+                else:
+                    query_embedding = await _encode_search_query(request, decoded_image)
+                    product_ids, total = await search_engine.hybrid_search(request, query_embedding, image_key)
         
         return SearchResponse(
             productIds=product_ids,
-            total=total
+            total=total,
+            nextCursor=next_cursor,
+            debugTimings=timings if request.debug else None
         )
+    except (BatcherQueueFullError, ModelNotReadyError) as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error searching products: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+async def _read_image_upload(request: Request) -> bytes:
+    """Read the query image from a multipart ``image`` field or a raw body,
+    rejecting it with 413 as soon as it is known to exceed IMAGE_UPLOAD_MAX_BYTES.
+    Multipart bodies must declare their length; raw bodies may be chunked."""
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > IMAGE_UPLOAD_MAX_BYTES + MULTIPART_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image exceeds {IMAGE_UPLOAD_MAX_BYTES} bytes")
+    
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        # The form parser spools the whole body before the file size is known, so
+        # only parse bodies whose length was checked above
+        if not content_length.isdigit():
+            raise HTTPException(status_code=411, detail="Multipart uploads require a Content-Length header")
+        async with request.form(max_files=1, max_fields=10) as form:
+            upload = form.get("image")
+            if not isinstance(upload, UploadFile):
+                raise HTTPException(status_code=400, detail="Multipart body must contain an 'image' file")
+            if upload.size is not None and upload.size > IMAGE_UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Image exceeds {IMAGE_UPLOAD_MAX_BYTES} bytes")
+            image_bytes = await upload.read()
+    else:
+        buffer = bytearray()
+        async for chunk in request.stream():
+            buffer.extend(chunk)
+            if len(buffer) > IMAGE_UPLOAD_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"Image exceeds {IMAGE_UPLOAD_MAX_BYTES} bytes")
+        image_bytes = bytes(buffer)
+    
+    if len(image_bytes) > IMAGE_UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image exceeds {IMAGE_UPLOAD_MAX_BYTES} bytes")
+    if not image_bytes:
+        raise HTTPException(status_code=400, detail="Empty image")
+    return image_bytes
+
+@app.post("/search/image", response_model=SearchResponse)
+async def search_by_image(
+    request: Request,
+    query: Optional[str] = None,
+    page: int = 0,
+    size: int = 20,
+    debug: bool = False,
+    categoryIds: Optional[List[str]] = Query(None),
+    brandIds: Optional[List[str]] = Query(None),
+    minPrice: Optional[float] = None,
+    maxPrice: Optional[float] = None
+):
+    """Search by an uploaded image, sent either as multipart/form-data (field
+    ``image``) or as the raw request body (e.g. ``Content-Type: image/jpeg``).
+    Avoids the base64 overhead of /search; decoding and downscaling to the
+    CLIP input size run in the thread pool. ``query`` optionally adds text;
+    the filters are repeatable query parameters as in /search."""
+    image_bytes = await _read_image_upload(request)
+    search_request = SearchRequest(
+        query=query, page=page, size=size, debug=debug,
+        categoryIds=categoryIds, brandIds=brandIds, minPrice=minPrice, maxPrice=maxPrice
+    )
+    try:
+        with track_operation("image_search") as timings:
+            image_key = await run_in_threadpool(search_engine.image_cache.content_key, image_bytes)
+            with stage("result_cache"):
+                cached = search_engine.get_cached_search(search_request, image_key)
+            if cached is not None:
+                product_ids, total = cached
+            else:
+                try:
+                    prepared = await run_in_threadpool(search_engine.prepare_image_bytes, image_bytes, image_key)
+                except (UnidentifiedImageError, OSError) as e:
+                    raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+                tasks = [_encode_prepared_image(*prepared)]
+                if query:
+                    tasks.append(_encode_text_query(query))
+                embeddings = await asyncio.gather(*tasks)
+                with stage("embedding_combine"):
+                    query_embedding = search_engine.combine_query_embeddings([list(e) for e in embeddings])
+                product_ids, total = await search_engine.hybrid_search(search_request, query_embedding, image_key)
+        
+        return SearchResponse(productIds=product_ids, total=total, debugTimings=timings if debug else None)
+    except HTTPException:
+        raise
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except (BatcherQueueFullError, ModelNotReadyError) as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error searching by image: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/search/batch", response_model=BatchSearchResponse)
+async def batch_search_products(requests: List[SearchRequest]):
+    """Several searches in one call: all query texts and images are encoded in
+    one batched call per model and all searches go to ES as one msearch."""
+    if len(requests) > SEARCH_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {SEARCH_BATCH_MAX_SIZE} searches per batch")
+    if any(request.useCursor or request.cursor for request in requests):
+        raise HTTPException(status_code=400, detail="Cursor pagination is not supported in batch search")
+    try:
+        results = [([], 0)] * len(requests)
+        with track_operation("batch_search") as timings:
+            decoded_images = [None] * len(requests)
+            if any(request.image for request in requests):
+                decoded_images = await run_in_threadpool(search_engine.decode_query_images, requests)
+            image_keys = [decoded[1] if decoded else None for decoded in decoded_images]
+            pending = []
+            with stage("result_cache"):
+                for i, request in enumerate(requests):
+                    if not request.query and not request.image:
+                        continue
+                    cached = search_engine.get_cached_search(request, image_keys[i])
+                    if cached is not None:
+                        results[i] = cached
+                    else:
+                        pending.append(i)
+            
+            if pending:
+                pending_requests = [requests[i] for i in pending]
+                query_embeddings = await run_in_threadpool(
+                    search_engine.encode_search_queries, pending_requests, [decoded_images[i] for i in pending]
+                )
+                searched = await search_engine.batch_search(
+                    pending_requests, query_embeddings, [image_keys[i] for i in pending]
+                )
+                for i, result in zip(pending, searched):
+                    results[i] = result
+        
+        return BatchSearchResponse(results=[
+            SearchResponse(productIds=product_ids, total=total, debugTimings=timings if request.debug else None)
+            for request, (product_ids, total) in zip(requests, results)
+        ])
+    except ModelNotReadyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error running batch search: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
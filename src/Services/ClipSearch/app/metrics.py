@@ -0,0 +1,89 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+# Stages range from sub-millisecond cache lookups to multi-second bulk loads
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+REQUEST_SECONDS = Histogram(
+    "clipsearch_request_seconds",
+    "End-to-end latency of ClipSearch operations",
+    ["operation"],
+    buckets=LATENCY_BUCKETS
+)
+STAGE_SECONDS = Histogram(
+    "clipsearch_stage_seconds",
+    "Latency of individual stages within ClipSearch operations",
+    ["operation", "stage"],
+    buckets=LATENCY_BUCKETS
+)
+BULK_CONCURRENCY = Gauge(
+    "clipsearch_bulk_concurrency",
+    "Current limit of concurrent Elasticsearch bulk requests",
+    # Summed over live API workers in multiprocess mode
+    multiprocess_mode="livesum"
+)
+BULK_RETRIES = Counter(
+    "clipsearch_bulk_retries_total",
+    "Bulk documents resent after Elasticsearch rejected them with 429"
+)
+
+# Set per request; asyncio.to_thread and run_in_threadpool copy the context,
+# so stages timed on worker threads are attributed to the calling request.
+_operation: ContextVar[str] = ContextVar("clipsearch_operation", default="other")
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("clipsearch_timings", default=None)
+
+
+@contextmanager
+def track_operation(operation: str) -> Iterator[Dict[str, float]]:
+    """Time a whole operation and collect its stage timings (ms) into the
+    yielded dict, which callers can return as debug output."""
+    timings: Dict[str, float] = {}
+    operation_token = _operation.set(operation)
+    timings_token = _timings.set(timings)
+    start = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        elapsed = time.perf_counter() - start
+        REQUEST_SECONDS.labels(operation).observe(elapsed)
+        timings["total"] = round(elapsed * 1000, 3)
+        _timings.reset(timings_token)
+        _operation.reset(operation_token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time one stage of the current operation; repeated stages accumulate."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(_operation.get(), name).observe(elapsed)
+        timings = _timings.get()
+        if timings is not None:
+            timings[name] = round(timings.get(name, 0.0) + elapsed * 1000, 3)
+
+
+def render_metrics():
+    # With several API workers, serve.py sets PROMETHEUS_MULTIPROC_DIR and every
+    # worker writes its samples there, so any worker can report for all of them
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    """Drop this worker's live gauge samples when it exits in multiprocess mode."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
@@ -1,11 +1,15 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Dict, Optional, List
 
 class ProductIndexRequest(BaseModel):
     id: str
     name: str
     description: Optional[str] = None
     shortDescription: Optional[str] = None
+    categoryIds: Optional[List[str]] = None
+    brandId: Optional[str] = None
+    price: Optional[float] = None
+    imageUrls: Optional[List[str]] = None  # http(s) URLs, or paths under PRODUCT_IMAGE_ROOT
 
 class BulkIndexRequest(BaseModel):
     products: List[ProductIndexRequest]
@@ -15,10 +19,22 @@ class SearchRequest(BaseModel):
     image: Optional[str] = None  # base64 encoded image
     page: int = 0
     size: int = 20
+    useCursor: bool = False  # open a point-in-time and return nextCursor instead of using page
+    cursor: Optional[str] = None  # nextCursor from the previous response
+    debug: bool = False  # include per-stage timings in the response
+    categoryIds: Optional[List[str]] = None  # match products in any of these categories
+    brandIds: Optional[List[str]] = None
+    minPrice: Optional[float] = None
+    maxPrice: Optional[float] = None
 
 class SearchResponse(BaseModel):
     productIds: List[str]
     total: int
+    nextCursor: Optional[str] = None
+    debugTimings: Optional[Dict[str, float]] = None  # stage -> milliseconds, only when requested
+
+class BatchSearchResponse(BaseModel):
+    results: List[SearchResponse]  # in request order
 
 class EmbeddingRequest(BaseModel):
     text: str
@@ -0,0 +1,156 @@
+import asyncio
+import ipaddress
+import logging
+import os
+import socket
+from typing import List, Optional
+
+import httpx
+
+from .config import (
+    PRODUCT_IMAGE_ROOT,
+    PRODUCT_IMAGE_FETCH_CONCURRENCY,
+    PRODUCT_IMAGE_FETCH_TIMEOUT,
+    PRODUCT_IMAGE_MAX_BYTES,
+    PRODUCT_IMAGE_MAX_PER_PRODUCT,
+    PRODUCT_IMAGE_ALLOWED_HOSTS
+)
+from .metrics import stage
+from .models import ProductIndexRequest
+
+logger = logging.getLogger(__name__)
+
+_MAX_REDIRECTS = 5
+
+
+class ProductImageError(Exception):
+    pass
+
+
+class ProductImageFetcher:
+    """Fetch the images listed in ``imageUrls`` of a batch of products.
+
+    ``http(s)`` URLs are downloaded; paths and ``file://`` URLs are read from
+    ``root``, a local file-system stand-in for the image CDN that paths cannot
+    escape. At most ``concurrency`` fetches run at once. An image that fails or
+    exceeds ``max_bytes`` is skipped with a warning rather than failing its
+    product.
+
+    Image URLs come from catalogue data, so downloads must not reach internal
+    services: every URL, including each redirect, must name a host in
+    ``allowed_hosts`` (when set) that resolves only to public addresses, and
+    the connection goes to the address that was checked.
+    """
+
+    def __init__(
+        self,
+        root: str = PRODUCT_IMAGE_ROOT,
+        concurrency: int = PRODUCT_IMAGE_FETCH_CONCURRENCY,
+        timeout: float = PRODUCT_IMAGE_FETCH_TIMEOUT,
+        max_bytes: int = PRODUCT_IMAGE_MAX_BYTES,
+        max_per_product: int = PRODUCT_IMAGE_MAX_PER_PRODUCT,
+        allowed_hosts: Optional[List[str]] = None
+    ):
+        self._root = os.path.realpath(root)
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._timeout = timeout
+        self._max_bytes = max_bytes
+        self._max_per_product = max_per_product
+        self._allowed_hosts = PRODUCT_IMAGE_ALLOWED_HOSTS if allowed_hosts is None else allowed_hosts
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def fetch(self, products: List[ProductIndexRequest]) -> Optional[List[List[bytes]]]:
+        """Image bytes per product, in ``imageUrls`` order; ``None`` if no product has images."""
+        refs = [
+            (row, ref)
+            for row, product in enumerate(products)
+            for ref in (product.imageUrls or [])[:self._max_per_product]
+            if ref and ref.strip()
+        ]
+        if not refs:
+            return None
+        with stage("image_fetch"):
+            fetched = await asyncio.gather(*(self._fetch_one(ref.strip()) for _, ref in refs))
+        images: List[List[bytes]] = [[] for _ in products]
+        for (row, _), image_bytes in zip(refs, fetched):
+            if image_bytes is not None:
+                images[row].append(image_bytes)
+        return images
+
+    async def _fetch_one(self, ref: str) -> Optional[bytes]:
+        async with self._semaphore:
+            try:
+                if ref.startswith(("http://", "https://")):
+                    return await self._download(ref)
+                return await asyncio.to_thread(self._read_local, ref)
+            except Exception as e:
+                logger.warning(f"Skipping product image {ref}: {e}")
+                return None
+
+    async def _download(self, url: str) -> bytes:
+        if self._client is None:
+            # No proxies from the environment: the request must go to the checked address
+            self._client = httpx.AsyncClient(timeout=self._timeout, follow_redirects=False, trust_env=False)
+        target = httpx.URL(url)
+        for _ in range(_MAX_REDIRECTS + 1):
+            if target.scheme not in ("http", "https"):
+                raise ProductImageError(f"Unsupported URL scheme '{target.scheme}'")
+            host = target.host.lower()
+            self._check_host_allowed(host)
+            address = await self._resolve_public(host, target.port or (443 if target.scheme == "https" else 80))
+            async with self._client.stream(
+                "GET",
+                target.copy_with(host=address),
+                headers={"Host": target.netloc.decode("ascii")},
+                extensions={"sni_hostname": host} if target.scheme == "https" else {}
+            ) as response:
+                if response.is_redirect:
+                    target = target.join(response.headers["location"])
+                    continue
+                response.raise_for_status()
+                buffer = bytearray()
+                async for data in response.aiter_bytes():
+                    buffer += data
+                    if len(buffer) > self._max_bytes:
+                        raise ProductImageError(f"Image exceeds {self._max_bytes} bytes")
+                return bytes(buffer)
+        raise ProductImageError(f"More than {_MAX_REDIRECTS} redirects")
+
+    def _check_host_allowed(self, host: str):
+        if not self._allowed_hosts:
+            return
+        for allowed in self._allowed_hosts:
+            if host == allowed or (allowed.startswith(".") and host.endswith(allowed)):
+                return
+        raise ProductImageError(f"Host {host} is not in PRODUCT_IMAGE_ALLOWED_HOSTS")
+
+    async def _resolve_public(self, host: str, port: int) -> str:
+        """Resolve ``host`` and return an address to connect to, refusing hosts
+        with any private, loopback, link-local (cloud metadata) or reserved address."""
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise ProductImageError(f"Cannot resolve {host}: {e}")
+        addresses = [ipaddress.ip_address(info[4][0].split("%", 1)[0]) for info in infos]
+        for address in addresses:
+            mapped = getattr(address, "ipv4_mapped", None) or address
+            if not mapped.is_global or mapped.is_multicast:
+                raise ProductImageError(f"Host {host} resolves to non-public address {address}")
+        if not addresses:
+            raise ProductImageError(f"Cannot resolve {host}")
+        return str(addresses[0])
+
+    def _read_local(self, ref: str) -> bytes:
+        path = ref[len("file://"):] if ref.startswith("file://") else ref
+        full_path = os.path.realpath(os.path.join(self._root, path.lstrip("/")))
+        if os.path.commonpath([full_path, self._root]) != self._root:
+            raise ProductImageError(f"Path is outside {self._root}")
+        if os.path.getsize(full_path) > self._max_bytes:
+            raise ProductImageError(f"Image exceeds {self._max_bytes} bytes")
+        with open(full_path, "rb") as f:
+            return f.read()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import AsyncIterator, Dict, List, Optional
+
+from elasticsearch.helpers import async_scan
+
+from .config import ELASTICSEARCH_INDEX, REINDEX_BATCH_SIZE, REINDEX_STALE_SECONDS, SHARED_STATE_REFRESH_SECONDS
+from .metrics import stage, track_operation
+from .models import ProductIndexRequest
+
+logger = logging.getLogger(__name__)
+
+# Restored on the target index after loading when the source index does not set them;
+# sending null would leave the decision to whatever the cluster default happens to be
+DEFAULT_INDEX_SETTINGS = {"refresh_interval": "1s", "number_of_replicas": 1}
+
+SOURCE_FIELDS = ["id", "name", "description", "shortDescription", "categoryIds", "brandId", "price", "imageUrls"]
+
+
+class ReindexInProgressError(Exception):
+    pass
+
+
+def _status(item: Dict) -> int:
+    return next(iter(item.values())).get("status", 500)
+
+
+def restored_index_settings(current: Optional[Dict]) -> Dict:
+    """Settings to give a freshly loaded index: those of the index it replaces
+    (``current``, its ``index`` settings), or the defaults where it sets none."""
+    settings = dict(DEFAULT_INDEX_SETTINGS)
+    for name in settings:
+        if current and current.get(name) is not None:
+            settings[name] = current[name]
+    return settings
+
+
+class ReindexJob:
+    """Blue/green rebuild of the product index.
+
+    Products (given explicitly, or scanned from the live alias) are written to
+    a fresh ``<alias>_vN`` index created with refresh disabled and no
+    replicas. Once loaded, the index settings are restored, the alias is
+    swapped atomically and the previous index is dropped. Searches keep
+    hitting the old index until the swap, and live writes on every worker are
+    mirrored into the new index meanwhile. The snapshot only creates
+    documents, so it never overwrites a mirrored write, and products deleted
+    while it loads are deleted from the new index again before the swap.
+    Progress is kept in the shared state store, so any worker can report on
+    the job.
+    """
+
+    def __init__(self, search_engine, owner: str, products: Optional[List[ProductIndexRequest]] = None):
+        self.id = uuid.uuid4().hex
+        self._engine = search_engine
+        self._store = search_engine.shared_state
+        self._owner = owner
+        self._products = products
+        self.phase = "pending"
+        self.source_indices: List[str] = []
+        self.target_index: Optional[str] = None
+        self.total: Optional[int] = len(products) if products is not None else None
+        self.processed = 0
+        self.failed = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def _save(self, **fields):
+        await asyncio.to_thread(self._store.update_reindex, self.id, self._owner, **fields)
+
+    async def _set_phase(self, phase: str):
+        self.phase = phase
+        await self._save(phase=phase)
+
+    async def run(self):
+        es = self._engine.es
+        self.started_at = time.time()
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            await self._save(status="running", phase="creating", total=self.total, started_at=self.started_at)
+            self.phase = "creating"
+            self.source_indices = await self._engine.concrete_indices()
+            restore_settings = await self._source_settings()
+            self.target_index = await self._engine.create_versioned_index(
+                settings={"index": {"refresh_interval": "-1", "number_of_replicas": 0}}
+            )
+            # From here on every worker mirrors live writes into the target index
+            self.phase = "loading"
+            await self._save(phase="loading", source_indices=self.source_indices, target_index=self.target_index)
+            # Workers re-read the targets periodically; once all have seen this one,
+            # writes that reached the source before it was registered are only
+            # in the source, so make them visible to the snapshot scan
+            await self._engine.refresh_shared_state()
+            await asyncio.sleep(2 * SHARED_STATE_REFRESH_SECONDS)
+            if self.source_indices:
+                await es.indices.refresh(index=",".join(self.source_indices))
+
+            with track_operation("reindex"):
+                async for batch in self._batches():
+                    await self._load_batch(batch)
+                    await self._save(total=self.total, processed=self.processed, failed=self.failed)
+
+            self.phase = "finalizing"
+            await self._save(phase="finalizing", total=self.total)
+            await self._apply_recorded_deletes()
+            await es.indices.put_settings(index=self.target_index, settings={"index": restore_settings})
+            await es.indices.refresh(index=self.target_index)
+
+            await self._set_phase("swapping")
+            old_indices = await self._engine.swap_alias(self.target_index)
+            await self._set_phase("cleanup")
+            for old_index in old_indices:
+                await es.indices.delete(index=old_index, ignore_unavailable=True)
+
+            self.finished_at = time.time()
+            self.phase = "completed"
+            await self._save(status="completed", phase="completed", finished_at=self.finished_at)
+            logger.info(
+                f"Reindex {self.id} completed: {self.processed} products into {self.target_index} "
+                f"({self.docs_per_second:.1f} docs/s, {self.failed} failed)"
+            )
+        except asyncio.CancelledError:
+            # Shutting down: the partial target is never swapped in, so record the job as failed right away
+            self._store.update_reindex(
+                self.id, self._owner, status="failed", error="Worker shut down", finished_at=time.time()
+            )
+            raise
+        except Exception as e:
+            self.finished_at = time.time()
+            logger.error(f"Reindex {self.id} failed during {self.phase}: {e}")
+            try:
+                await self._save(status="failed", error=str(e), finished_at=self.finished_at)
+                if self.target_index and self.target_index not in await self._engine.concrete_indices():
+                    await es.indices.delete(index=self.target_index, ignore_unavailable=True)
+            except Exception as cleanup_error:
+                logger.error(f"Failed to drop partial index {self.target_index}: {cleanup_error}")
+        finally:
+            heartbeat.cancel()
+            if self.target_index:
+                try:
+                    self._store.clear_deletes(self.target_index)
+                except Exception as e:
+                    logger.warning(f"Failed to clear recorded deletes for {self.target_index}: {e}")
+
+    async def _load_batch(self, batch: List[ProductIndexRequest]):
+        images = await self._engine.image_fetcher.fetch(batch)
+        embeddings, image_vectors = await asyncio.to_thread(self._engine.embed_products, batch, None, images)
+        # create: a live write mirrored into the target is newer than the snapshot
+        actions = await asyncio.to_thread(
+            self._engine.product_actions, batch, embeddings, image_vectors, [self.target_index], "create"
+        )
+        with stage("es_bulk"):
+            _, errors = await self._engine.bulk_writer.write(self._engine.es, actions, refresh=False)
+        self.processed += len(batch)
+        self.failed += sum(1 for item in errors if _status(item) != 409)
+        # Nor may the snapshot's vectors replace those of the live writes ES kept
+        not_created = {result.get("_id") for item in errors for result in item.values()}
+        created = [row for row, product in enumerate(batch) if product.id not in not_created]
+        await asyncio.to_thread(
+            self._engine.store_product_vectors, [batch[row].id for row in created], embeddings[created]
+        )
+
+    async def _apply_recorded_deletes(self):
+        """The snapshot may have recreated products deleted while it loaded; delete them again."""
+        product_ids = await asyncio.to_thread(self._store.recorded_deletes, self.target_index)
+        if not product_ids:
+            return
+        actions = [{"_op_type": "delete", "_index": self.target_index, "_id": product_id} for product_id in product_ids]
+        _, errors = await self._engine.bulk_writer.write(self._engine.es, actions, refresh=False)
+        errors = [item for item in errors if _status(item) != 404]
+        if errors:
+            raise RuntimeError(f"Failed to delete {len(errors)} products removed during the reindex")
+        if self._engine.product_vectors is not None:
+            await asyncio.to_thread(self._engine.product_vectors.delete_many, product_ids)
+        logger.info(f"Reindex {self.id} re-applied {len(product_ids)} deletes made while loading")
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(REINDEX_STALE_SECONDS / 4)
+            try:
+                await self._save()
+            except Exception as e:
+                logger.warning(f"Failed to heartbeat reindex {self.id}: {e}")
+
+    async def _source_settings(self) -> Dict:
+        if not self.source_indices:
+            return restored_index_settings(None)
+        source = self.source_indices[0]
+        current = (await self._engine.es.indices.get_settings(index=source))[source]["settings"]["index"]
+        return restored_index_settings(current)
+
+    async def _batches(self) -> AsyncIterator[List[ProductIndexRequest]]:
+        if self._products is not None:
+            for start in range(0, len(self._products), REINDEX_BATCH_SIZE):
+                yield self._products[start:start + REINDEX_BATCH_SIZE]
+            return
+
+        if not self.source_indices:
+            self.total = 0
+            return
+        self.total = (await self._engine.es.count(index=ELASTICSEARCH_INDEX))["count"]
+        batch = []
+        async for hit in async_scan(self._engine.es, index=ELASTICSEARCH_INDEX, _source=SOURCE_FIELDS, size=REINDEX_BATCH_SIZE):
+            source = hit["_source"]
+            batch.append(ProductIndexRequest(
+                id=source.get("id") or hit["_id"],
+                name=source.get("name") or "",
+                description=source.get("description"),
+                shortDescription=source.get("shortDescription"),
+                categoryIds=source.get("categoryIds"),
+                brandId=source.get("brandId"),
+                price=source.get("price"),
+                imageUrls=source.get("imageUrls")
+            ))
+            if len(batch) >= REINDEX_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @property
+    def docs_per_second(self) -> float:
+        if not self.started_at:
+            return 0.0
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return self.processed / elapsed if elapsed > 0 else 0.0
+
+
+def job_to_dict(job: Dict) -> Dict:
+    end = job["finished_at"] or (time.time() if job["status"] == "running" else None)
+    elapsed = end - job["started_at"] if job["started_at"] and end else None
+    return {
+        "jobId": job["id"],
+        "status": job["status"],
+        "phase": job["phase"],
+        "sourceIndices": job["source_indices"],
+        "targetIndex": job["target_index"],
+        "total": job["total"],
+        "processed": job["processed"],
+        "failed": job["failed"],
+        "progress": job["processed"] / job["total"] if job["total"] else None,
+        "docsPerSecond": round(job["processed"] / elapsed, 1) if elapsed else 0.0,
+        "elapsedSeconds": round(elapsed, 1) if elapsed is not None else None,
+        "error": job["error"]
+    }
+
+
+class ReindexManager:
+    """Starts reindex jobs in this worker; at most one runs across all workers."""
+
+    def __init__(self, search_engine):
+        self._engine = search_engine
+        self._store = search_engine.shared_state
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._jobs: Dict[str, ReindexJob] = {}
+
+    async def submit(self, products: Optional[List[ProductIndexRequest]] = None) -> Dict:
+        job = ReindexJob(self._engine, self._owner, products)
+        active = await asyncio.to_thread(self._store.create_reindex, job.id, self._owner)
+        if active is not None:
+            raise ReindexInProgressError(f"Reindex {active['id']} is already running")
+        # Keep a reference so the task is not garbage collected while it runs
+        self._jobs[job.id] = job
+        job.start()
+        return await self.get(job.id)
+
+    async def close(self):
+        tasks = [job._task for job in self._jobs.values() if job._task is not None and not job._task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        job = await asyncio.to_thread(self._store.get_reindex, job_id)
+        return job_to_dict(job) if job is not None else None
+
+    async def current(self) -> Optional[Dict]:
+        job = await asyncio.to_thread(self._store.latest_reindex)
+        return job_to_dict(job) if job is not None else None
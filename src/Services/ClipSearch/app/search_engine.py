@@ -1,9 +1,14 @@
 import torch
-from sentence_transformers import SentenceTransformer
-from elasticsearch import Elasticsearch
+from elasticsearch import AsyncElasticsearch
 from typing import List, Dict, Optional, Tuple
+import asyncio
 import logging
+import base64
+import io
+import json
+from functools import partial
 import numpy as np
+from PIL import Image
 
 from .config import (
     ELASTICSEARCH_URL,
@@ -12,229 +17,1157 @@ from .config import (
     ELASTICSEARCH_INDEX,
     IMG_MODEL_NAME,
     TEXT_MODEL_NAME,
-    RRF_K
+    RRF_K,
+    EMBEDDING_DIMS,
+    ENCODE_BATCH_SIZE,
+    NAME_WEIGHT,
+    DESCRIPTION_WEIGHT,
+    REDIS_URL,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_TTL_SECONDS,
+    IMAGE_CACHE_MAX_MB,
+    IMAGE_CACHE_PERCEPTUAL_HASH,
+    IMAGE_MAX_PIXELS,
+    IMAGE_INPUT_SIZE,
+    RESULT_CACHE_SIZE,
+    RESULT_CACHE_TTL_SECONDS,
+    RESULT_CACHE_WINDOW,
+    SEARCH_FUSION_MODE,
+    RRF_WINDOW_SIZE,
+    CURSOR_KEEP_ALIVE,
+    CURSOR_KNN_K,
+    MODEL_WAIT_TIMEOUT_SECONDS,
+    TEXT_ENCODER_BACKEND,
+    EMBEDDING_STORE_ENABLED,
+    EMBEDDING_STORE_DIR,
+    ES_REQUEST_TIMEOUT,
+    ES_MAX_CONNECTIONS,
+    ES_HTTP_COMPRESS,
+    ES_MAX_RETRIES,
+    VECTOR_INDEX_TYPE,
+    RESCORE_ENABLED,
+    RESCORE_WINDOW,
+    PRODUCT_VECTOR_STORE_DIR,
+    ENCODER_SERVICE_SOCKET,
+    IMAGE_QUERY_IMAGE_WEIGHT,
+    SHARED_STATE_DB_PATH,
+    SHARED_STATE_REFRESH_SECONDS,
+    REINDEX_STALE_SECONDS
 )
 from .models import SearchRequest, ProductIndexRequest
+from .encoders import LazyModel, ModelNotReadyError, load_image_encoder, load_text_encoder
+from .encoder_service import RemoteEncoder
+from .bulk_writer import AdaptiveBulkWriter
+from .product_images import ProductImageFetcher
+from .embedding_store import EmbeddingStore, ProductVectorStore
+from .shared_state import SharedStateStore
+from .text_utils import strip_html
+from .metrics import stage
+from .cache import EmbeddingCache, ImageEmbeddingCache, SearchResultCache, normalize_query
 
 logger = logging.getLogger(__name__)
 
+# Exact-match fields used to pre-filter kNN and text search
+FILTER_FIELD_MAPPINGS = {
+    "categoryIds": {"type": "keyword"},
+    "brandId": {"type": "keyword"},
+    "price": {"type": "scaled_float", "scaling_factor": 100}
+}
+
 class SearchEngine:
     def __init__(self):
         logger.info(f"Initializing Search Engine with image model: {IMG_MODEL_NAME}, text model: {TEXT_MODEL_NAME}")
         
-        self.img_model = SentenceTransformer(IMG_MODEL_NAME)
-        self.text_model = SentenceTransformer(TEXT_MODEL_NAME)
+        image_loader, text_loader = load_image_encoder, load_text_encoder
+        if ENCODER_SERVICE_SOCKET:
+            # Models live in the shared encoder process, see app.encoder_service
+            image_loader, text_loader = partial(RemoteEncoder, "image"), partial(RemoteEncoder, "text")
+        self.img_model = LazyModel("image", image_loader, MODEL_WAIT_TIMEOUT_SECONDS)
+        self.text_model = LazyModel("text", text_loader, MODEL_WAIT_TIMEOUT_SECONDS)
+        self.query_cache = EmbeddingCache(
+            max_size=QUERY_CACHE_SIZE,
+            ttl_seconds=QUERY_CACHE_TTL_SECONDS,
+            namespace="clipsearch:query",
+            redis_url=REDIS_URL
+        )
+        self.image_cache = ImageEmbeddingCache(
+            max_bytes=int(IMAGE_CACHE_MAX_MB * 1024 * 1024),
+            dims=EMBEDDING_DIMS,
+            use_perceptual_hash=IMAGE_CACHE_PERCEPTUAL_HASH
+        )
+        self.result_cache = SearchResultCache(
+            max_size=RESULT_CACHE_SIZE,
+            ttl_seconds=RESULT_CACHE_TTL_SECONDS
+        )
+        self.embedding_store = None
+        if EMBEDDING_STORE_ENABLED:
+            self.embedding_store = EmbeddingStore(EMBEDDING_STORE_DIR, dims=EMBEDDING_DIMS)
+        self.product_vectors = None
+        if RESCORE_ENABLED:
+            self.product_vectors = ProductVectorStore(PRODUCT_VECTOR_STORE_DIR, dims=EMBEDDING_DIMS)
+        self.shared_state = SharedStateStore(SHARED_STATE_DB_PATH, REINDEX_STALE_SECONDS)
+        # Read on every search and write, so kept in memory and refreshed in the background
+        self._index_version = self.shared_state.index_version()
+        self._shadow_indices = self.shared_state.shadow_indices()
+        self._shared_state_task: Optional[asyncio.Task] = None
         
-        self.es = Elasticsearch(
+        # aiohttp keeps up to ES_MAX_CONNECTIONS persistent connections per node
+        self.es = AsyncElasticsearch(
             [ELASTICSEARCH_URL],
             basic_auth=(ELASTICSEARCH_USER, ELASTICSEARCH_PASSWORD),
-            request_timeout=30
+            request_timeout=ES_REQUEST_TIMEOUT,
+            connections_per_node=ES_MAX_CONNECTIONS,
+            http_compress=ES_HTTP_COMPRESS,
+            max_retries=ES_MAX_RETRIES,
+            retry_on_timeout=True
         )
-        
-        self._create_index_if_not_exists()
-        logger.info("Search Engine initialized successfully")
-    
-    def _create_index_if_not_exists(self):
-        if not self.es.indices.exists(index=ELASTICSEARCH_INDEX):
-            logger.info(f"Creating Elasticsearch index: {ELASTICSEARCH_INDEX}")
-            index_mapping = {
-                "mappings": {
-                    "properties": {
-                        "id": {"type": "keyword"},
-                        "name": {"type": "text", "analyzer": "standard"},
-                        "description": {"type": "text"},
-                        "shortDescription": {"type": "text"},
-                        "embedding": {
-                            "type": "dense_vector",
-                            "dims": 512,
-                            "index": True,
-                            "similarity": "cosine"
-                        }
-                    }
-                }
-            }
-            self.es.indices.create(index=ELASTICSEARCH_INDEX, body=index_mapping)
+        # Shared by every bulk caller so concurrency tracks the cluster, not one request
+        self.bulk_writer = AdaptiveBulkWriter()
+        self.image_fetcher = ProductImageFetcher()
+        self.es_ready = asyncio.Event()
+        self._es_error: Optional[str] = None
+        self._es_init_task: Optional[asyncio.Task] = None
+        logger.info("Search Engine initialized, models and Elasticsearch are connecting in background")
+    
+    def start(self):
+        """Start loading the text model and connecting to Elasticsearch in the
+        background. The image model is loaded on the first image query."""
+        self.text_model.start_loading()
+        self._es_init_task = asyncio.create_task(self._init_elasticsearch())
+        self._shared_state_task = asyncio.create_task(self._poll_shared_state())
+    
+    async def close(self):
+        if self._es_init_task is not None:
+            self._es_init_task.cancel()
+        if self._shared_state_task is not None:
+            self._shared_state_task.cancel()
+        await self.image_fetcher.close()
+        await self.es.close()
+        self.shared_state.close()
+    
+    async def _init_elasticsearch(self):
+        delay = 1.0
+        while not self.es_ready.is_set():
+            try:
+                await self._create_index_if_not_exists()
+                self._es_error = None
+                self.es_ready.set()
+                logger.info("Elasticsearch is ready")
+            except Exception as e:
+                self._es_error = str(e)
+                logger.warning(f"Elasticsearch not ready, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+    
+    def readiness(self) -> Dict:
+        """Blocking when models are served by the encoder service, which is pinged."""
+        text_status = self.text_model.status()
+        image_status = self.img_model.status()
+        es_status = {
+            "status": "ready" if self.es_ready.is_set() else "connecting",
+            "error": self._es_error
+        }
+        ready = self.text_model.is_ready and self.es_ready.is_set()
+        status = {
+            "ready": ready,
+            "textModel": text_status,
+            "imageModel": image_status,
+            "elasticsearch": es_status
+        }
+        if ENCODER_SERVICE_SOCKET and self.text_model.is_ready:
+            # The service may have died or been restarted since the model was loaded
+            try:
+                self.text_model.get().ping()
+                status["encoderService"] = {"status": "ready", "error": None}
+            except Exception as e:
+                status["encoderService"] = {"status": "unavailable", "error": str(e)}
+                status["ready"] = False
+        return status
+    
+    async def concrete_indices(self) -> List[str]:
+        """Indices behind the ELASTICSEARCH_INDEX alias, or the legacy concrete index of that name."""
+        if await self.es.indices.exists_alias(name=ELASTICSEARCH_INDEX):
+            return list((await self.es.indices.get_alias(name=ELASTICSEARCH_INDEX)).keys())
+        if await self.es.indices.exists(index=ELASTICSEARCH_INDEX):
+            return [ELASTICSEARCH_INDEX]
+        return []
+    
+    async def next_index_name(self) -> str:
+        existing = await self.es.indices.get(index=f"{ELASTICSEARCH_INDEX}_v*", allow_no_indices=True)
+        return next_versioned_index(existing)
+    
+    async def create_versioned_index(self, settings: Optional[Dict] = None, with_alias: bool = False) -> str:
+        index_name = await self.next_index_name()
+        body = index_body(settings)
+        if with_alias:
+            body["aliases"] = {ELASTICSEARCH_INDEX: {}}
+        logger.info(f"Creating Elasticsearch index: {index_name}")
+        await self.es.indices.create(index=index_name, body=body)
+        return index_name
+    
+    async def _create_index_if_not_exists(self):
+        if not await self.es.indices.exists(index=ELASTICSEARCH_INDEX):
+            await self.create_versioned_index(with_alias=True)
+        else:
+            await self._ensure_field_mappings()
+    
+    async def _ensure_field_mappings(self):
+        """Add the filter and product image fields to indices created before they
+        existed. A field that was already mapped dynamically can't be changed;
+        that needs /reindex."""
+        properties = {**FILTER_FIELD_MAPPINGS, **image_field_mappings()}
+        for index_name in await self.concrete_indices():
+            try:
+                await self.es.indices.put_mapping(index=index_name, properties=properties)
+            except Exception as e:
+                logger.warning(f"Could not add filter and image fields to {index_name}, run /reindex to apply them: {e}")
     
     def generate_embedding(self, text: str) -> List[float]:
-        if not text or not text.strip():
-            return [0.0] * 512
+        return self.encode_texts([text])[0].tolist()
+    
+    def encode_texts(self, texts: List[str]) -> np.ndarray:
+        result = np.zeros((len(texts), EMBEDDING_DIMS), dtype=np.float32)
+        pending: Dict[str, List[int]] = {}
+        for i, text in enumerate(texts):
+            if text and text.strip():
+                pending.setdefault(normalize_query(text), []).append(i)
+        if not pending:
+            return result
+
+        # Keyed by the loaded backend like the embedding store (the configured one while loading)
+        model_name = f"{TEXT_MODEL_NAME}:{self.text_model.backend or TEXT_ENCODER_BACKEND}"
+        queries = list(pending)
+        for query, cached in zip(queries, self.query_cache.get_many(model_name, queries)):
+            if cached is not None:
+                result[pending.pop(query)] = cached
         
-        embedding = self.text_model.encode(text, convert_to_tensor=False)
-        return embedding.tolist()
+        if pending:
+            queries = list(pending)
+            vectors = self.text_model.encode(
+                queries,
+                batch_size=ENCODE_BATCH_SIZE,
+                convert_to_numpy=True
+            )
+            self.query_cache.set_many(model_name, queries, vectors)
+            for query, vector in zip(queries, vectors):
+                result[pending[query]] = vector
+        return result
     
-    def generate_image_embedding(self, image_base64: str) -> List[float]:
-        import base64
-        import io
-        from PIL import Image
+    def _open_image(self, image_bytes: bytes) -> Image.Image:
+        """Decode an image straight to CLIP's input scale.
+
+        The size is checked from the header before any pixels are decoded.
+        JPEGs are decoded at a reduced DCT scale; the result is downscaled so
+        its shorter side is ``IMAGE_INPUT_SIZE``, the resolution CLIP resizes
+        to anyway.
+        """
+        image = Image.open(io.BytesIO(image_bytes))
+        width, height = image.size
+        if width * height > IMAGE_MAX_PIXELS:
+            raise ImageTooLargeError(f"Image of {width}x{height} pixels exceeds the {IMAGE_MAX_PIXELS} pixel limit")
         
-        try:
-            image_bytes = base64.b64decode(image_base64)
-            image = Image.open(io.BytesIO(image_bytes))
+        scale = IMAGE_INPUT_SIZE / min(width, height)
+        if scale < 1:
+            target = (max(1, round(width * scale)), max(1, round(height * scale)))
+            image.draft('RGB', target)
             if image.mode != 'RGB':
                 image = image.convert('RGB')
-            
-            embedding = self.img_model.encode(image, convert_to_tensor=False)
-            return embedding.tolist()
-        except Exception as e:
-            logger.error(f"Error generating image embedding: {e}")
-            return [0.0] * 512
+            if image.size != target:
+                image = image.resize(target, Image.BICUBIC, reducing_gap=2.0)
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        return image
+    
+    def decode_query_image(self, image_base64: str) -> Tuple[Optional[bytes], str]:
+        """Base64-decode a query image and hash it, once per request: the bytes
+        (``None`` if it isn't valid base64) and its result/image cache key.
+        Blocking; callers on the event loop run it in the thread pool."""
+        with stage("base64_decode"):
+            try:
+                image_bytes = base64.b64decode(image_base64)
+            except Exception as e:
+                logger.error(f"Error decoding image: {e}")
+                return None, self.image_cache.content_key(image_base64.encode("utf-8"))
+        with stage("image_cache"):
+            return image_bytes, self.image_cache.content_key(image_bytes)
 
-    def _strip_html(self, html_text: Optional[str]) -> str:
-        if not html_text:
-            return ""
+    def decode_query_images(self, requests: List[SearchRequest]) -> List[Optional[Tuple[Optional[bytes], str]]]:
+        return [self.decode_query_image(request.image) if request.image else None for request in requests]
+
+    def prepare_image_query(
+        self,
+        image_base64: str,
+        decoded: Optional[Tuple[Optional[bytes], str]] = None
+    ) -> Tuple[Optional[np.ndarray], Optional[Image.Image], Optional[Tuple[str, Optional[str]]]]:
+        """Resolve a base64 query image against the image cache.
+
+        Returns ``(embedding, None, None)`` on a cache hit, otherwise
+        ``(None, image, cache_keys)`` so the caller can encode ``image`` and
+        store the result with ``store_image_embedding``. Undecodable images
+        yield ``(None, None, None)``. ``decoded`` is the result of
+        ``decode_query_image`` if the caller already has it.
+        """
+        image_bytes, content_key = decoded or self.decode_query_image(image_base64)
+        if image_bytes is None:
+            return None, None, None
         try:
-            from bs4 import BeautifulSoup
-            soup = BeautifulSoup(html_text, 'html.parser')
-            return soup.get_text(separator=' ', strip=True)
+            return self.prepare_image_bytes(image_bytes, content_key)
         except Exception as e:
-            logger.warning(f"Failed to parse HTML, using raw text: {e}")
-            return html_text
+            logger.error(f"Error decoding image: {e}")
+            return None, None, None
+    
+    def prepare_image_bytes(self, image_bytes: bytes, content_key: Optional[str] = None) -> Tuple[Optional[np.ndarray], Optional[Image.Image], Optional[Tuple[str, Optional[str]]]]:
+        """Same as ``prepare_image_query`` for raw image bytes, but raises
+        ``ImageTooLargeError`` or PIL's errors for unusable images."""
+        with stage("image_cache"):
+            content_key = content_key or self.image_cache.content_key(image_bytes)
+            cached = self.image_cache.get(content_key)
+        if cached is not None:
+            return cached, None, None
+        
+        with stage("image_decode"):
+            image = self._open_image(image_bytes)
+        perceptual_key = None
+        if self.image_cache.use_perceptual_hash:
+            with stage("image_cache"):
+                perceptual_key = self.image_cache.perceptual_key(image)
+                cached = self.image_cache.get_perceptual(perceptual_key)
+            if cached is not None:
+                return cached, None, None
+        return None, image, (content_key, perceptual_key)
+    
+    def store_image_embedding(self, embedding: np.ndarray, cache_keys: Optional[Tuple[str, Optional[str]]]):
+        if cache_keys is not None and np.any(embedding):
+            self.image_cache.set(embedding, *cache_keys)
+    
+    def encode_images(self, images: List[Optional[Image.Image]]) -> np.ndarray:
+        result = np.zeros((len(images), EMBEDDING_DIMS), dtype=np.float32)
+        rows = [i for i, image in enumerate(images) if image is not None]
+        if rows:
+            try:
+                result[rows] = self.img_model.encode(
+                    [images[i] for i in rows],
+                    batch_size=ENCODE_BATCH_SIZE,
+                    convert_to_numpy=True
+                )
+            except ModelNotReadyError:
+                raise
+            except Exception as e:
+                logger.error(f"Error generating image embeddings: {e}")
+        return result
+    
+    def embed_product_images(self, images: List[List[bytes]]) -> List[List[np.ndarray]]:
+        """Decode fetched product images and encode them in batches of
+        ``ENCODE_BATCH_SIZE``; images that can't be decoded or encoded are left out."""
+        flat = [(row, image_bytes) for row, product_images in enumerate(images) for image_bytes in product_images]
+        vectors: List[List[np.ndarray]] = [[] for _ in images]
+        for start in range(0, len(flat), ENCODE_BATCH_SIZE):
+            rows, decoded = [], []
+            with stage("image_decode"):
+                for row, image_bytes in flat[start:start + ENCODE_BATCH_SIZE]:
+                    try:
+                        decoded.append(self._open_image(image_bytes))
+                        rows.append(row)
+                    except Exception as e:
+                        logger.warning(f"Skipping undecodable product image: {e}")
+            if not decoded:
+                continue
+            with stage("image_encode"):
+                encoded = self.encode_images(decoded)
+            for row, vector in zip(rows, encoded):
+                if np.any(vector):
+                    vectors[row].append(vector)
+        return vectors
 
-    def _generate_weighted_embedding(self, name: str, short_desc: Optional[str], description: Optional[str]) -> List[float]:
-        embeddings = []
+    def generate_image_embedding(self, image_base64: str) -> List[float]:
+        cached, image, cache_keys = self.prepare_image_query(image_base64)
+        if cached is not None:
+            return cached.tolist()
+        embedding = self.encode_images([image])[0]
+        self.store_image_embedding(embedding, cache_keys)
+        return embedding.tolist()
+
+    def combine_query_embeddings(self, embeddings: List[List[float]]) -> List[float]:
+        if len(embeddings) > 1:
+            embeddings_array = np.array(embeddings)
+            weights_array = np.ones((len(embeddings), 1))
+            return (np.sum(embeddings_array * weights_array, axis=0) / np.sum(weights_array)).tolist()
+        return list(embeddings[0])
+
+    def encode_search_queries(
+        self,
+        requests: List[SearchRequest],
+        decoded_images: Optional[List[Optional[Tuple[Optional[bytes], str]]]] = None
+    ) -> List[List[float]]:
+        """Query embeddings for several searches, with one batched encode call
+        per model for all texts and all uncached images. ``decoded_images`` are
+        the requests' ``decode_query_image`` results, if already computed."""
+        texts = [request.query for request in requests if request.query]
+        with stage("text_encode"):
+            text_vectors = iter(self.encode_texts(texts)) if texts else iter(())
+
+        image_vectors: Dict[int, np.ndarray] = {}
+        pending = []
+        for i, request in enumerate(requests):
+            if request.image:
+                decoded = decoded_images[i] if decoded_images is not None else None
+                cached, image, cache_keys = self.prepare_image_query(request.image, decoded)
+                if cached is not None:
+                    image_vectors[i] = cached
+                else:
+                    pending.append((i, image, cache_keys))
+        if pending:
+            with stage("image_encode"):
+                encoded = self.encode_images([image for _, image, _ in pending])
+            for (i, _, cache_keys), embedding in zip(pending, encoded):
+                self.store_image_embedding(embedding, cache_keys)
+                image_vectors[i] = embedding
+
+        query_embeddings = []
+        with stage("embedding_combine"):
+            for i, request in enumerate(requests):
+                embeddings = []
+                if request.query:
+                    embeddings.append(next(text_vectors).tolist())
+                if i in image_vectors:
+                    embeddings.append(image_vectors[i].tolist())
+                query_embeddings.append(self.combine_query_embeddings(embeddings))
+        return query_embeddings
+
+    def _generate_weighted_embeddings(self, products: List[ProductIndexRequest]) -> np.ndarray:
+        """Encode every field of every product in batched calls and reduce them
+        to one weighted-average vector per product (zero vector if no text)."""
+        return self.embed_field_texts(len(products), self.product_field_texts(products))
+
+    def product_field_texts(self, products: List[ProductIndexRequest]) -> Tuple[List[str], List[int], List[float]]:
+        """HTML-cleaned field texts of all products as ``(texts, rows, weights)``,
+        where ``rows`` maps each text back to its product."""
+        texts = []
+        rows = []
         weights = []
+        with stage("html_strip"):
+            for row, product in enumerate(products):
+                for text, weight in weighted_field_texts(product.name, product.shortDescription, product.description):
+                    texts.append(text)
+                    rows.append(row)
+                    weights.append(weight)
+        return texts, rows, weights
+
+    def embed_field_texts(self, count: int, field_texts: Tuple[List[str], List[int], List[float]]) -> np.ndarray:
+        texts, rows, weights = field_texts
+        if not texts:
+            return np.zeros((count, EMBEDDING_DIMS), dtype=np.float32)
         
-        if name and name.strip():
-            embeddings.append(self.generate_embedding(name))
-            weights.append(3.0)
-        
-        if short_desc and short_desc.strip():
-            short_clean = self._strip_html(short_desc)
-            if short_clean:
-                embeddings.append(self.generate_embedding(short_clean))
-                weights.append(2.0)
-        
-        if description and description.strip():
-            desc_clean = self._strip_html(description)
-            if desc_clean:
-                embeddings.append(self.generate_embedding(desc_clean))
-                weights.append(2.0)
-        
-        if not embeddings:
-            return [0.0] * 512
-        
-        embeddings_array = np.array(embeddings)
-        weights_array = np.array(weights).reshape(-1, 1)
-        weighted_sum = np.sum(embeddings_array * weights_array, axis=0)
-        weight_sum = np.sum(weights_array)
+        with stage("text_encode"):
+            vectors = self._encode_product_texts(texts)
+        with stage("weighted_average"):
+            return weighted_average(count, vectors, rows, weights)
+
+    def _encode_product_texts(self, texts: List[str]) -> np.ndarray:
+        """Encode product field texts, reusing vectors from the on-disk store."""
+        if self.embedding_store is None:
+            return self.text_model.encode(texts, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True)
         
-        return (weighted_sum / weight_sum).tolist()
+        # Key by the backend that actually loaded: an ONNX model that fell back
+        # to torch must not file torch vectors under the ONNX name
+        model = self.text_model.get()
+        model_name = f"{TEXT_MODEL_NAME}:{self.text_model.backend or TEXT_ENCODER_BACKEND}"
+        vectors, missing = self.embedding_store.get_many(model_name, texts)
+        if missing:
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            encoded = model.encode(unique_texts, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True)
+            self.embedding_store.put_many(model_name, unique_texts, encoded)
+            by_text = dict(zip(unique_texts, encoded))
+            for i in missing:
+                vectors[i] = by_text[texts[i]]
+        return vectors
+
+    def _generate_weighted_embedding(self, name: str, short_desc: Optional[str], description: Optional[str]) -> List[float]:
+        product = ProductIndexRequest(id="", name=name or "", shortDescription=short_desc, description=description)
+        return self._generate_weighted_embeddings([product])[0].tolist()
 
-    def index_product(self, product: ProductIndexRequest):
-        embedding = self._generate_weighted_embedding(
+    @property
+    def index_version(self) -> int:
+        return self._index_version
+
+    def write_indices(self) -> List[str]:
+        # While a reindex is running (in any worker), writes also go to the new
+        # index so they survive the alias swap.
+        return [ELASTICSEARCH_INDEX] + self._shadow_indices
+
+    async def refresh_shared_state(self):
+        version, shadows = await asyncio.to_thread(
+            lambda: (self.shared_state.index_version(), self.shared_state.shadow_indices())
+        )
+        # Versions only grow; a read that raced a local bump must not move it back
+        self._index_version = max(self._index_version, version)
+        self._shadow_indices = shadows
+
+    async def _poll_shared_state(self):
+        while True:
+            await asyncio.sleep(SHARED_STATE_REFRESH_SECONDS)
+            try:
+                await self.refresh_shared_state()
+            except Exception as e:
+                logger.warning(f"Failed to read shared state: {e}")
+
+    async def index_product(self, product: ProductIndexRequest):
+        images = await self.image_fetcher.fetch([product])
+        embedding = await asyncio.to_thread(
+            self._generate_weighted_embedding,
             product.name, product.shortDescription, product.description
         )
-        doc = {
-            "id": product.id,
-            "name": product.name,
-            "description": product.description,
-            "shortDescription": product.shortDescription,
-            "embedding": embedding
-        }
-        self.es.index(index=ELASTICSEARCH_INDEX, id=product.id, document=doc)
+        image_vectors = (await asyncio.to_thread(self.embed_product_images, images))[0] if images else []
+        doc = product_document(product, embedding, image_vectors)
+        if self.product_vectors is not None:
+            self.product_vectors.put_many([product.id], [embedding])
+        index_names = self.write_indices()
+        if len(index_names) > 1:
+            await asyncio.to_thread(self._forget_deletes, index_names, [product.id])
+        with stage("es_index"):
+            for index_name in index_names:
+                await self.es.index(index=index_name, id=product.id, document=doc)
+        await self._bump_index_version()
         logger.info(f"Indexed product: {product.id}")
 
-    def bulk_index_products(self, products: List[ProductIndexRequest]) -> Dict:
-        from elasticsearch.helpers import bulk
+    def build_bulk_actions(
+        self,
+        products: List[ProductIndexRequest],
+        field_texts: Optional[Tuple[List[str], List[int], List[float]]] = None,
+        images: Optional[List[List[bytes]]] = None
+    ) -> List[Dict]:
+        """Bulk index actions for ``products``; pass ``field_texts`` from
+        ``product_field_texts`` when the HTML was already cleaned, and
+        ``images`` from ``image_fetcher.fetch`` to embed product images.
+        ``write_bulk_actions`` adds the copies for a running reindex."""
+        embeddings, image_vectors = self.embed_products(products, field_texts, images)
+        self.store_product_vectors([product.id for product in products], embeddings)
+        return self.product_actions(products, embeddings, image_vectors, [ELASTICSEARCH_INDEX])
+
+    def embed_products(
+        self,
+        products: List[ProductIndexRequest],
+        field_texts: Optional[Tuple[List[str], List[int], List[float]]] = None,
+        images: Optional[List[List[bytes]]] = None
+    ) -> Tuple[np.ndarray, List[List[np.ndarray]]]:
+        """Weighted text embedding and image vectors of every product."""
+        if field_texts is None:
+            field_texts = self.product_field_texts(products)
+        embeddings = self.embed_field_texts(len(products), field_texts)
+        image_vectors = self.embed_product_images(images) if images else [[] for _ in products]
+        return embeddings, image_vectors
+
+    def product_actions(
+        self,
+        products: List[ProductIndexRequest],
+        embeddings: np.ndarray,
+        image_vectors: List[List[np.ndarray]],
+        index_names: List[str],
+        op_type: str = "index"
+    ) -> List[Dict]:
+        """Bulk actions for embedded products; ``op_type="create"`` leaves documents that already exist untouched."""
         actions = []
-        for product in products:
-            embedding = self._generate_weighted_embedding(
-                product.name, product.shortDescription, product.description
-            )
-            doc = {
-                "id": product.id,
-                "name": product.name,
-                "description": product.description,
-                "shortDescription": product.shortDescription,
-                "embedding": embedding
-            }
-            actions.append({"_index": ELASTICSEARCH_INDEX, "_id": product.id, "_source": doc})
-        
-        success, failed = bulk(self.es, actions, raise_on_error=False)
+        with stage("build_documents"):
+            for product, embedding, product_image_vectors in zip(products, embeddings, image_vectors):
+                doc = product_document(product, embedding.tolist(), product_image_vectors)
+                for index_name in index_names:
+                    actions.append({"_op_type": op_type, "_index": index_name, "_id": product.id, "_source": doc})
+        return actions
+
+    def store_product_vectors(self, product_ids: List[str], embeddings: np.ndarray):
+        if self.product_vectors is not None and product_ids:
+            with stage("product_vectors"):
+                self.product_vectors.put_many(product_ids, embeddings)
+
+    async def bulk_index_products(self, products: List[ProductIndexRequest]) -> Dict:
+        images = await self.image_fetcher.fetch(products)
+        actions = await asyncio.to_thread(self.build_bulk_actions, products, None, images)
+        success, failed = await self.write_bulk_actions(actions)
         logger.info(f"Bulk indexed {success} products, {len(failed)} failed")
         return {"success": success, "failed": len(failed)}
 
-    def delete_product(self, product_id: str):
-        self.es.delete(index=ELASTICSEARCH_INDEX, id=product_id, ignore=[404])
+    async def write_bulk_actions(self, actions: List[Dict]) -> Tuple[int, List[Dict]]:
+        """Send actions through the adaptive bulk writer; returns the success count and the failed items.
+        Index actions for the live index are also sent to the target of a running reindex."""
+        # Resolved right before the bulk call, not when the actions were built:
+        # a reindex that started while they were encoded must receive them too
+        shadows = self.write_indices()[1:]
+        if shadows:
+            mirrored = [
+                action for action in actions
+                if action["_op_type"] == "index" and action["_index"] == ELASTICSEARCH_INDEX
+            ]
+            await asyncio.to_thread(self._forget_deletes, shadows, [action["_id"] for action in mirrored])
+            actions = actions + [dict(action, _index=shadow) for shadow in shadows for action in mirrored]
+        with stage("es_bulk"):
+            success, failed = await self.bulk_writer.write(self.es, actions)
+        await self._bump_index_version()
+        return success, failed
+
+    def _forget_deletes(self, index_names: List[str], product_ids: List[str]):
+        for index_name in index_names:
+            if index_name != ELASTICSEARCH_INDEX:
+                self.shared_state.forget_deletes(index_name, product_ids)
+
+    async def delete_product(self, product_id: str):
+        index_names = self.write_indices()
+        for index_name in index_names[1:]:
+            await asyncio.to_thread(self.shared_state.record_deletes, index_name, [product_id])
+        for index_name in index_names:
+            await self.es.options(ignore_status=404).delete(index=index_name, id=product_id)
+        if self.product_vectors is not None:
+            self.product_vectors.delete_many([product_id])
+        await self._bump_index_version()
         logger.info(f"Deleted product: {product_id}")
 
-    def recreate_index(self):
+    async def recreate_index(self):
         logger.info(f"Recreating index: {ELASTICSEARCH_INDEX}")
-        if self.es.indices.exists(index=ELASTICSEARCH_INDEX):
-            self.es.indices.delete(index=ELASTICSEARCH_INDEX)
-        self._create_index_if_not_exists()
+        for index_name in await self.concrete_indices():
+            await self.es.indices.delete(index=index_name)
+        await self._create_index_if_not_exists()
+        if self.product_vectors is not None:
+            self.product_vectors.clear()
+        await self._bump_index_version()
         logger.info(f"Recreated index: {ELASTICSEARCH_INDEX}")
 
-    def hybrid_search(self, request: SearchRequest) -> Tuple[List[str], int]:
-        if not request.query and not request.image:
+    async def swap_alias(self, new_index: str) -> List[str]:
+        """Atomically point the alias at ``new_index`` and return the indices it left."""
+        old_indices = [name for name in await self.concrete_indices() if name != new_index]
+        await self.es.indices.update_aliases(actions=alias_swap_actions(old_indices, new_index))
+        await self._bump_index_version()
+        return [name for name in old_indices if name != ELASTICSEARCH_INDEX]
+
+    async def _bump_index_version(self):
+        # Other workers see the new version in their cache keys; the local cache can drop everything now
+        version = await asyncio.to_thread(self.shared_state.bump_index_version)
+        self._index_version = max(self._index_version, version)
+        self.result_cache.invalidate()
+
+    def _result_cache_key(self, request: SearchRequest, image_key: Optional[str] = None) -> str:
+        query = normalize_query(request.query) if request.query else ""
+        image_key = image_key or ""
+        if request.image and not image_key:
+            image_key = self.decode_query_image(request.image)[1]
+        filters = json.dumps(self._filter_clauses(request), sort_keys=True, separators=(",", ":"))
+        return f"{self.index_version}|{image_key}|{query}|{filters}"
+
+    def _slice_results(self, request: SearchRequest, product_ids: List[str], total: int) -> Tuple[List[str], int]:
+        offset = request.page * request.size
+        return product_ids[offset:offset + request.size], total
+
+    def _in_result_window(self, request: SearchRequest) -> bool:
+        return (request.page + 1) * request.size <= RESULT_CACHE_WINDOW
+
+    def get_cached_search(self, request: SearchRequest, image_key: Optional[str] = None) -> Optional[Tuple[List[str], int]]:
+        """``image_key`` identifies an uploaded query image that is not in ``request.image``."""
+        if not self._in_result_window(request):
+            return None
+        cached = self.result_cache.get(self._result_cache_key(request, image_key))
+        if cached is None:
+            return None
+        return self._slice_results(request, *cached)
+
+    async def hybrid_search(self, request: SearchRequest, query_embedding: Optional[List[float]] = None, image_key: Optional[str] = None) -> Tuple[List[str], int]:
+        """Run the hybrid kNN + BM25 search for one page of results.
+
+        Callers passing a precomputed ``query_embedding`` are expected to have
+        tried ``get_cached_search`` first; otherwise the cache is checked here.
+        The first ``RESULT_CACHE_WINDOW`` ids are fetched and cached in one go so
+        later pages of the same query are served by slicing. Searches by an
+        uploaded image pass its embedding and cache ``image_key`` instead of
+        ``request.image``.
+        """
+        if not request.query and not request.image and image_key is None:
             return [], 0
         
-        embeddings = []
-        weights = []
-        if request.query:
-            embeddings.append(self.generate_embedding(request.query))
-            weights.append(1.0)
-        if request.image:
-            embeddings.append(self.generate_image_embedding(request.image))
-            weights.append(1.0)
-        
-        if len(embeddings) > 1:
-            embeddings_array = np.array(embeddings)
-            weights_array = np.array(weights).reshape(-1, 1)
-            query_embedding = (np.sum(embeddings_array * weights_array, axis=0) / np.sum(weights_array)).tolist()
-        else:
-            query_embedding = embeddings[0]
+        if query_embedding is None:
+            with stage("result_cache"):
+                cached = self.get_cached_search(request)
+            if cached is not None:
+                return cached
+            embeddings = []
+            if request.query:
+                with stage("text_encode"):
+                    embeddings.append(await asyncio.to_thread(self.generate_embedding, request.query))
+            if request.image:
+                with stage("image_encode"):
+                    embeddings.append(await asyncio.to_thread(self.generate_image_embedding, request.image))
+            with stage("embedding_combine"):
+                query_embedding = self.combine_query_embeddings(embeddings)
 
-        offset = request.page * request.size
+        if self._in_result_window(request):
+            cache_key = self._result_cache_key(request, image_key)
+            result = await self._search_index(request, query_embedding, 0, RESULT_CACHE_WINDOW)
+            if result is None:
+                return [], 0
+            self.result_cache.set(cache_key, *result)
+            return self._slice_results(request, *result)
+
+        result = await self._search_index(request, query_embedding, request.page * request.size, request.size)
+        return result if result is not None else ([], 0)
+
+    async def batch_search(
+        self,
+        requests: List[SearchRequest],
+        query_embeddings: List[List[float]],
+        image_keys: Optional[List[Optional[str]]] = None
+    ) -> List[Tuple[List[str], int]]:
+        """Run several searches in a single msearch round trip.
+
+        Results are returned in request order; a search whose legs failed gets
+        an empty page rather than failing the whole batch. As in
+        ``hybrid_search``, pages inside the result window are fetched whole
+        and cached, under the query images' ``image_keys`` when given.
+        """
+        plans = []
+        searches = []
+        image_keys = image_keys or [None] * len(requests)
+        for request, query_embedding, image_key in zip(requests, query_embeddings, image_keys):
+            if self._in_result_window(request):
+                offset, size, cache_key = 0, RESULT_CACHE_WINDOW, self._result_cache_key(request, image_key)
+            else:
+                offset, size, cache_key = request.page * request.size, request.size, None
+            bodies = self._search_bodies(request, query_embedding, offset, size)
+            for body in bodies:
+                searches.extend([{}, body])
+            plans.append((request, query_embedding, offset, size, cache_key, len(bodies)))
+        if not searches:
+            return []
         
-        knn_param = [{
-            "field": "embedding",
-            "query_vector": query_embedding,
-            "k": 50,
-            "num_candidates": 100
-        }]
-
-        query_param = None
-        if request.query:
-            query_param = {
-                "multi_match": {
-                    "query": request.query,
-                    "fields": ["name^3", "description^2", "shortDescription^2"],
-                    "fuzziness": "AUTO"
-                }
-            }
-            
-        rank_param = None
-        if request.query:
-            rank_param = {
-                "rrf": {
-                    "window_size": 50,
-                    "rank_constant": 60
-                }
-            }
+        with stage("es_search"):
+            response = await self.es.msearch(index=ELASTICSEARCH_INDEX, searches=searches)
+        
+        results = []
+        position = 0
+        for request, query_embedding, offset, size, cache_key, leg_count in plans:
+            responses = response['responses'][position:position + leg_count]
+            position += leg_count
+            try:
+                result = self._search_result(request, query_embedding, responses, offset, size)
+            except Exception as e:
+                logger.error(f"Batch search failed for query '{request.query}': {e}")
+                results.append(([], 0))
+                continue
+            if cache_key is not None:
+                self.result_cache.set(cache_key, *result)
+                result = self._slice_results(request, *result)
+            results.append(result)
+        return results
+
+    async def _search_index(self, request: SearchRequest, query_embedding: List[float], offset: int, size: int) -> Optional[Tuple[List[str], int]]:
+        bodies = self._search_bodies(request, query_embedding, offset, size)
 
         try:
-            response = self.es.search(
-                index=ELASTICSEARCH_INDEX,
-                knn=knn_param,
-                query=query_param,
-                # rank=rank_param,
-                size=request.size,
-                from_=offset,
-                source=["id"]
-            )
-            
-            hits = response['hits']
-            if isinstance(hits['total'], int):
-                total = hits['total']
-            else:
-                total = hits['total']['value']
-                
-            product_ids = [hit['_source']['id'] for hit in hits['hits']]
-            return product_ids, total
+            with stage("es_search"):
+                if len(bodies) > 1:
+                    response = await self.es.msearch(
+                        index=ELASTICSEARCH_INDEX,
+                        searches=[part for body in bodies for part in ({}, body)]
+                    )
+                    responses = response['responses']
+                else:
+                    body = bodies[0]
+                    responses = [await self.es.search(
+                        index=ELASTICSEARCH_INDEX,
+                        knn=body["knn"],
+                        query=body.get("query"),
+                        size=body["size"],
+                        from_=body["from"],
+                        source=body["_source"]
+                    )]
+            return self._search_result(request, query_embedding, responses, offset, size)
             
         except Exception as e:
             logger.error(f"Search failed: {e}")
             import traceback
             logger.error(traceback.format_exc())
-            return [], 0
\ No newline at end of file
+            return None
+
+    async def cursor_search(self, request: SearchRequest, query_embedding: List[float]) -> Tuple[List[str], int, Optional[str]]:
+        """Cursor pagination over a point-in-time with search_after.
+
+        The first call (``useCursor`` without ``cursor``) opens a PIT; each call
+        returns the next page plus an opaque cursor, or ``None`` once the
+        results are exhausted, in which case the PIT is closed. Per-page cost is
+        constant because ES never has to skip ``from_`` hits. Pages are ranked
+        by the combined ES score since RRF fusion cannot be resumed.
+        """
+        if request.cursor:
+            state = _decode_cursor(request.cursor)
+        else:
+            pit = await self.es.open_point_in_time(index=ELASTICSEARCH_INDEX, keep_alive=CURSOR_KEEP_ALIVE)
+            state = {"pit": pit['id'], "after": None, "total": None}
+        
+        query_param = self._text_query_param(request)
+        
+        search_kwargs = {}
+        if state["after"] is not None:
+            search_kwargs["search_after"] = state["after"]
+        with stage("es_search"):
+            response = await self.es.search(
+                knn=self._knn_param(query_embedding, CURSOR_KNN_K, request),
+                query=query_param,
+                pit={"id": state["pit"], "keep_alive": CURSOR_KEEP_ALIVE},
+                sort=[{"_score": "desc"}, {"_shard_doc": "asc"}],
+                size=request.size,
+                source=["id"],
+                track_total_hits=state["total"] is None,
+                **search_kwargs
+            )
+        
+        hits = response['hits']['hits']
+        total = state["total"] if state["total"] is not None else _hits_total(response)
+        pit_id = response.get('pit_id', state["pit"])
+        product_ids = [hit['_source']['id'] for hit in hits]
+        
+        if len(hits) < request.size:
+            await self._close_point_in_time(pit_id)
+            return product_ids, total, None
+        return product_ids, total, _encode_cursor({"pit": pit_id, "after": hits[-1]['sort'], "total": total})
+
+    async def _close_point_in_time(self, pit_id: str):
+        try:
+            await self.es.close_point_in_time(id=pit_id)
+        except Exception as e:
+            logger.warning(f"Failed to close point-in-time: {e}")
+
+    def _exact_scores(self, hits: List[Dict], query_embedding: List[float], boost: float = 1.0) -> Dict[str, float]:
+        """Scores of text-vector kNN ``hits``, with the top RESCORE_WINDOW replaced
+        by exact cosine against the full-precision vectors kept locally. Exact
+        scores use the ES scale, ``boost * (1 + cos) / 2``, so a candidate
+        without a local vector keeps its ES score and stays where it belongs
+        instead of being demoted."""
+        scores = {}
+        for hit in hits:
+            scores.setdefault(hit['_source']['id'], hit.get('_score') or 0.0)
+        if self.product_vectors is None or not hits:
+            return scores
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return scores
+        with stage("rescore"):
+            head = [hit['_source']['id'] for hit in hits[:RESCORE_WINDOW]]
+            vectors, missing = self.product_vectors.get_many(head)
+            exact = boost * (1.0 + vectors @ (query / norm)) / 2.0
+            missing_rows = set(missing)
+            for i, product_id in enumerate(head):
+                if i not in missing_rows:
+                    scores[product_id] = float(exact[i])
+        return scores
+
+    def _rescore(self, hits: List[Dict], query_embedding: List[float]) -> List[str]:
+        """Re-rank the top RESCORE_WINDOW kNN hits by their exact scores."""
+        product_ids = [hit['_source']['id'] for hit in hits]
+        if self.product_vectors is None:
+            return product_ids
+        scores = self._exact_scores(hits, query_embedding)
+        # Stable sort: ties keep their ES order
+        head = sorted(product_ids[:RESCORE_WINDOW], key=scores.__getitem__, reverse=True)
+        return head + product_ids[RESCORE_WINDOW:]
+
+    def _filter_clauses(self, request: SearchRequest) -> List[Dict]:
+        """Category, brand and price restrictions as ES filter clauses."""
+        filters = []
+        if request.categoryIds:
+            filters.append({"terms": {"categoryIds": sorted(set(request.categoryIds))}})
+        if request.brandIds:
+            filters.append({"terms": {"brandId": sorted(set(request.brandIds))}})
+        price_range = {}
+        if request.minPrice is not None:
+            price_range["gte"] = request.minPrice
+        if request.maxPrice is not None:
+            price_range["lte"] = request.maxPrice
+        if price_range:
+            filters.append({"range": {"price": price_range}})
+        return filters
+
+    def _text_query_param(self, request: SearchRequest) -> Optional[Dict]:
+        if not request.query:
+            return None
+        query = {
+            "multi_match": {
+                "query": request.query,
+                "fields": ["name^3", "description^2", "shortDescription^2"],
+                "fuzziness": "AUTO"
+            }
+        }
+        filters = self._filter_clauses(request)
+        if filters:
+            query = {"bool": {"must": query, "filter": filters}}
+        return query
+
+    def _knn_param(self, query_embedding: List[float], k: int, request: Optional[SearchRequest] = None) -> List[Dict]:
+        # Filtering inside the knn clause makes ES pick the k nearest among
+        # eligible products instead of filtering the k nearest overall
+        knn = {
+            "field": "embedding",
+            "query_vector": index_vector(query_embedding),
+            "k": k,
+            "num_candidates": min(max(2 * k, 100), 10000)
+        }
+        filters = self._filter_clauses(request) if request is not None else []
+        if filters:
+            knn["filter"] = filters
+        if request is None or not _uses_image_knn(request):
+            return [knn]
+        # Image-only query: also match it against the product images. ES sums the
+        # boosted clause scores; a product is scored by its closest image.
+        image_knn = dict(knn, field="image_embedding.vector", boost=min(IMAGE_QUERY_IMAGE_WEIGHT, 1.0))
+        if IMAGE_QUERY_IMAGE_WEIGHT >= 1:
+            return [image_knn]
+        knn["boost"] = 1.0 - IMAGE_QUERY_IMAGE_WEIGHT
+        return [knn, image_knn]
+
+    def _search_bodies(self, request: SearchRequest, query_embedding: List[float], offset: int, size: int) -> List[Dict]:
+        """Request bodies for one search: separate kNN and BM25 legs when they
+        are fused client-side with RRF, otherwise one combined query."""
+        query_param = self._text_query_param(request)
+        if query_param is not None and SEARCH_FUSION_MODE == "rrf":
+            window = max(RRF_WINDOW_SIZE, offset + size)
+            return [
+                {"knn": self._knn_param(query_embedding, window, request), "size": window, "_source": ["id"]},
+                {"query": query_param, "size": window, "_source": ["id"]}
+            ]
+        
+        k = max(50, RESCORE_WINDOW) if self.product_vectors is not None else 50
+        if self._rescores_image_query(request):
+            # Separate text-vector and image legs, so the text part can be
+            # rescored before the two are combined client-side
+            window = max(k, offset + size)
+            return [
+                {"knn": [knn], "size": window, "_source": ["id"]}
+                for knn in self._knn_param(query_embedding, window, request)
+            ]
+        body = {"knn": self._knn_param(query_embedding, k, request), "size": size, "from": offset, "_source": ["id"]}
+        if query_param is not None:
+            body["query"] = query_param
+        return [body]
+
+    def _search_result(self, request: SearchRequest, query_embedding: List[float], responses: List[Dict], offset: int, size: int) -> Tuple[List[str], int]:
+        """Turn the responses to ``_search_bodies`` into one page of product ids."""
+        if self._rescores_image_query(request):
+            return self._combine_image_legs(query_embedding, responses, offset, size)
+        if len(responses) > 1:
+            return self._fuse_rrf(query_embedding, responses, offset, size)
+        
+        response = responses[0]
+        if 'error' in response:
+            raise RuntimeError(f"Search failed: {response['error']}")
+        hits = response['hits']['hits']
+        # The local full-precision vectors are text-derived; image queries that
+        # also match product images are rescored in _combine_image_legs
+        if not request.query and offset == 0 and not _uses_image_knn(request):
+            return self._rescore(hits, query_embedding), _hits_total(response)
+        return [hit['_source']['id'] for hit in hits], _hits_total(response)
+
+    def _rescores_image_query(self, request: SearchRequest) -> bool:
+        # With IMAGE_QUERY_IMAGE_WEIGHT >= 1 there is no text-vector part left to rescore
+        return self.product_vectors is not None and _uses_image_knn(request) and IMAGE_QUERY_IMAGE_WEIGHT < 1
+
+    def _combine_image_legs(self, query_embedding: List[float], responses: List[Dict], offset: int, size: int) -> Tuple[List[str], int]:
+        """Sum the rescored text-vector leg and the image leg, as ES would have
+        summed the boosted clauses of a single kNN search."""
+        scores: Dict[str, float] = {}
+        failed = 0
+        for leg, result in zip(("text", "image"), responses):
+            if 'error' in result:
+                logger.error(f"Image search {leg} leg failed: {result['error']}")
+                failed += 1
+                continue
+            hits = result['hits']['hits']
+            if leg == "text":
+                leg_scores = self._exact_scores(hits, query_embedding, boost=1.0 - IMAGE_QUERY_IMAGE_WEIGHT)
+            else:
+                leg_scores = {hit['_source']['id']: hit.get('_score') or 0.0 for hit in hits}
+            for product_id, score in leg_scores.items():
+                scores[product_id] = scores.get(product_id, 0.0) + score
+        if failed == len(responses):
+            raise RuntimeError("Both image search legs failed")
+        ranking = sorted(scores, key=scores.__getitem__, reverse=True)
+        return ranking[offset:offset + size], len(ranking)
+
+    def _fuse_rrf(self, query_embedding: List[float], responses: List[Dict], offset: int, size: int) -> Tuple[List[str], int]:
+        """Fuse the kNN and BM25 leg responses client-side."""
+        rankings = []
+        totals = []
+        for leg, result in zip(("knn", "bm25"), responses):
+            if 'error' in result:
+                logger.error(f"RRF {leg} leg failed: {result['error']}")
+                continue
+            hits = result['hits']['hits']
+            if leg == "knn":
+                ranking = self._rescore(hits, query_embedding)
+            else:
+                ranking = [hit['_source']['id'] for hit in hits]
+            rankings.append(ranking)
+            totals.append(_hits_total(result))
+        if not rankings:
+            raise RuntimeError("Both RRF search legs failed")
+        
+        with stage("rrf_fusion"):
+            fused = reciprocal_rank_fusion(rankings, RRF_K)
+        return fused[offset:offset + size], max([len(fused)] + totals)
+
+
+def next_versioned_index(existing: List[str]) -> str:
+    versions = [
+        int(name.rsplit("_v", 1)[1]) for name in existing
+        if name.rsplit("_v", 1)[1].isdigit()
+    ]
+    return f"{ELASTICSEARCH_INDEX}_v{max(versions, default=0) + 1}"
+
+
+def alias_swap_actions(old_indices: List[str], new_index: str) -> List[Dict]:
+    actions = []
+    for old_index in old_indices:
+        if old_index == ELASTICSEARCH_INDEX:
+            # Legacy deployments have a concrete index where the alias must go
+            actions.append({"remove_index": {"index": old_index}})
+        else:
+            actions.append({"remove": {"index": old_index, "alias": ELASTICSEARCH_INDEX}})
+    actions.append({"add": {"index": new_index, "alias": ELASTICSEARCH_INDEX}})
+    return actions
+
+
+def index_body(settings: Optional[Dict] = None) -> Dict:
+    body = {
+        "mappings": {
+            "properties": {
+                "id": {"type": "keyword"},
+                "name": {"type": "text", "analyzer": "standard"},
+                "description": {"type": "text"},
+                "shortDescription": {"type": "text"},
+                **FILTER_FIELD_MAPPINGS,
+                "embedding": _embedding_mapping(),
+                **image_field_mappings()
+            }
+        }
+    }
+    if settings:
+        body["settings"] = settings
+    return body
+
+
+def _embedding_mapping() -> Dict:
+    mapping = {
+        "type": "dense_vector",
+        "dims": EMBEDDING_DIMS,
+        "index": True,
+        "similarity": "cosine"
+    }
+    if VECTOR_INDEX_TYPE == "int8_hnsw":
+        mapping["index_options"] = {"type": "int8_hnsw"}
+    elif VECTOR_INDEX_TYPE == "byte":
+        mapping["element_type"] = "byte"
+    return mapping
+
+
+def image_field_mappings() -> Dict:
+    # One nested object per product image, so kNN scores a product by its best image
+    return {
+        "imageUrls": {"type": "keyword", "index": False},
+        "image_embedding": {
+            "type": "nested",
+            "properties": {"vector": _embedding_mapping()}
+        }
+    }
+
+
+def _uses_image_knn(request: SearchRequest) -> bool:
+    return not request.query and IMAGE_QUERY_IMAGE_WEIGHT > 0
+
+
+def index_vector(embedding: List[float]) -> List:
+    """Vector as sent to ES; byte indices take L2-normalized values scaled to int8."""
+    if VECTOR_INDEX_TYPE != "byte":
+        return embedding
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector = vector / norm
+    return np.clip(np.rint(vector * 127), -128, 127).astype(np.int8).tolist()
+
+
+def weighted_field_texts(name: str, short_desc: Optional[str], description: Optional[str]) -> List[Tuple[str, float]]:
+    fields = []
+
+    if name and name.strip():
+        fields.append((name, NAME_WEIGHT))
+
+    if short_desc and short_desc.strip():
+        short_clean = strip_html(short_desc)
+        if short_clean:
+            fields.append((short_clean, DESCRIPTION_WEIGHT))
+
+    if description and description.strip():
+        desc_clean = strip_html(description)
+        if desc_clean:
+            fields.append((desc_clean, DESCRIPTION_WEIGHT))
+
+    return fields
+
+
+def weighted_average(count: int, vectors: np.ndarray, rows: List[int], weights: List[float]) -> np.ndarray:
+    """Per-product weighted average of field vectors; products without text get a zero vector."""
+    result = np.zeros((count, EMBEDDING_DIMS), dtype=np.float32)
+    if not rows:
+        return result
+    rows_array = np.asarray(rows)
+    weights_array = np.asarray(weights, dtype=np.float32)
+
+    np.add.at(result, rows_array, vectors * weights_array[:, None])
+    weight_sums = np.bincount(rows_array, weights=weights_array, minlength=count)
+    has_text = weight_sums > 0
+    result[has_text] /= weight_sums[has_text, None]
+    return result
+
+
+def product_document(product: ProductIndexRequest, embedding: List[float], image_vectors: Optional[List[np.ndarray]] = None) -> Dict:
+    doc = {
+        "id": product.id,
+        "name": product.name,
+        "description": product.description,
+        "shortDescription": product.shortDescription,
+        "categoryIds": product.categoryIds,
+        "brandId": product.brandId,
+        "price": product.price,
+        "imageUrls": product.imageUrls,
+        "embedding": index_vector(embedding)
+    }
+    if image_vectors:
+        doc["image_embedding"] = [{"vector": index_vector(vector.tolist())} for vector in image_vectors]
+    return doc
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+def _encode_cursor(state: Dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Dict:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return {"pit": state["pit"], "after": state["after"], "total": state["total"]}
+    except Exception:
+        raise InvalidCursorError("Invalid search cursor")
+
+
+def _hits_total(response: Dict) -> int:
+    total = response['hits']['total']
+    return total if isinstance(total, int) else total['value']
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[str]:
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, product_id in enumerate(ranking, start=1):
+            scores[product_id] = scores.get(product_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
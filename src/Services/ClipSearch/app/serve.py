@@ -0,0 +1,96 @@
+"""Production entry point.
+
+Runs uvicorn with ``API_WORKERS`` worker processes. With more than one
+worker, a single encoder process is started first and every worker uses its
+models over a Unix socket (see ``app.encoder_service``), so model memory does
+not grow with the number of workers. The encoder process is restarted if it
+dies, and only accepts workers holding the key generated for this launch.
+Vector stores, the index version and reindex jobs are shared through files
+under ``/app/data``, and Prometheus metrics are aggregated across workers in
+multiprocess mode.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+import uvicorn
+
+from .config import API_WORKERS, ENCODER_SERVICE_SOCKET
+
+logger = logging.getLogger(__name__)
+
+# Delay before restarting a crashed encoder service, doubled while it keeps crashing
+ENCODER_RESTART_MIN_SECONDS = 1.0
+ENCODER_RESTART_MAX_SECONDS = 30.0
+
+
+def _spawn_encoder(socket_path: str, authkey: bytes) -> multiprocessing.Process:
+    from .encoder_service import run_encoder_service
+
+    process = multiprocessing.Process(
+        target=run_encoder_service,
+        args=(socket_path, authkey),
+        name="clipsearch-encoder",
+        daemon=True
+    )
+    process.start()
+    logger.info(f"Started encoder service (pid {process.pid}) on {socket_path}")
+    return process
+
+
+def _supervise_encoder(process: multiprocessing.Process, socket_path: str, authkey: bytes):
+    """Restart the encoder service whenever it exits; workers reconnect on their next request
+    and report not ready until its models have loaded again."""
+    backoff = ENCODER_RESTART_MIN_SECONDS
+    while True:
+        started = time.monotonic()
+        process.join()
+        logger.error(f"Encoder service (pid {process.pid}) exited with code {process.exitcode}")
+        if time.monotonic() - started > ENCODER_RESTART_MAX_SECONDS:
+            backoff = ENCODER_RESTART_MIN_SECONDS
+        time.sleep(backoff)
+        backoff = min(backoff * 2, ENCODER_RESTART_MAX_SECONDS)
+        process = _spawn_encoder(socket_path, authkey)
+
+
+def start_encoder_service() -> multiprocessing.Process:
+    socket_path = os.path.join(tempfile.gettempdir(), f"clipsearch-encoder-{os.getpid()}.sock")
+    # Requests are pickled, so the key must be unguessable; a fresh one per launch
+    authkey = os.urandom(32).hex()
+    # Workers read these when they import app.config
+    os.environ["ENCODER_SERVICE_SOCKET"] = socket_path
+    os.environ["ENCODER_SERVICE_AUTHKEY"] = authkey
+    process = _spawn_encoder(socket_path, authkey.encode("utf-8"))
+    threading.Thread(
+        target=_supervise_encoder,
+        args=(process, socket_path, authkey.encode("utf-8")),
+        name="clipsearch-encoder-supervisor",
+        daemon=True
+    ).start()
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the CLIP Search API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=80)
+    parser.add_argument("--workers", type=int, default=API_WORKERS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.workers > 1:
+        if not ENCODER_SERVICE_SOCKET:
+            start_encoder_service()
+        # Each worker has its own metric values; multiprocess mode aggregates them on scrape
+        if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+            os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="clipsearch-metrics-")
+    uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
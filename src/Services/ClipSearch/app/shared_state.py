@@ -0,0 +1,170 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS reindex_jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    source_indices TEXT NOT NULL DEFAULT '[]',
+    target_index TEXT,
+    total INTEGER,
+    processed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    owner TEXT,
+    heartbeat REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS reindex_jobs_status ON reindex_jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS reindex_deletes (
+    target_index TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    PRIMARY KEY (target_index, product_id)
+) WITHOUT ROWID;
+"""
+
+_INDEX_VERSION = "index_version"
+_ACTIVE = ("pending", "running")
+
+
+class SharedStateStore:
+    """State every API worker must agree on, in a local SQLite database.
+
+    Holds the index version that keys the result cache, the reindex jobs,
+    whose target index receives mirrored live writes while they load, and the
+    products deleted during a reindex. A job is only considered active while
+    its owner keeps heartbeating, so one left behind by a dead worker neither
+    blocks new reindexes nor keeps receiving writes.
+    """
+
+    def __init__(self, path: str, stale_seconds: float):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._stale_seconds = stale_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def index_version(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM counters WHERE name = ?", (_INDEX_VERSION,)).fetchone()
+        return row["value"] if row is not None else 0
+
+    def bump_index_version(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "INSERT INTO counters (name, value) VALUES (?, 1) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + 1 RETURNING value",
+                (_INDEX_VERSION,)
+            ).fetchone()
+        return row["value"]
+
+    def create_reindex(self, job_id: str, owner: str) -> Optional[Dict]:
+        """Insert a pending job unless another one is active; returns the active job if so."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                active = self._conn.execute(
+                    "SELECT * FROM reindex_jobs WHERE status IN (?, ?) AND heartbeat >= ? ORDER BY created_at DESC LIMIT 1",
+                    (*_ACTIVE, now - self._stale_seconds)
+                ).fetchone()
+                if active is None:
+                    self._conn.execute(
+                        "INSERT INTO reindex_jobs (id, status, phase, owner, heartbeat, created_at) "
+                        "VALUES (?, 'pending', 'pending', ?, ?, ?)",
+                        (job_id, owner, now, now)
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return dict(active) if active is not None else None
+
+    def update_reindex(self, job_id: str, owner: str, **fields):
+        """Record job progress and heartbeat; ``source_indices`` is stored as JSON."""
+        if "source_indices" in fields:
+            fields["source_indices"] = json.dumps(fields["source_indices"])
+        assignments = "".join(f"{name} = ?, " for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE reindex_jobs SET {assignments}heartbeat = ? WHERE id = ? AND owner = ?",
+                (*fields.values(), time.time(), job_id, owner)
+            )
+
+    def get_reindex(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM reindex_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row)
+
+    def latest_reindex(self) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM reindex_jobs ORDER BY created_at DESC LIMIT 1").fetchone()
+        return self._job(row)
+
+    def shadow_indices(self) -> List[str]:
+        """Target indices of active reindexes, which live writes must also go to."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT target_index FROM reindex_jobs "
+                "WHERE status IN (?, ?) AND heartbeat >= ? AND target_index IS NOT NULL",
+                (*_ACTIVE, time.time() - self._stale_seconds)
+            ).fetchall()
+        return [row["target_index"] for row in rows]
+
+    def record_deletes(self, target_index: str, product_ids: List[str]):
+        """Remember products deleted while ``target_index`` loads, so the snapshot cannot bring them back."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO reindex_deletes (target_index, product_id) VALUES (?, ?)",
+                ((target_index, product_id) for product_id in product_ids)
+            )
+
+    def forget_deletes(self, target_index: str, product_ids: List[str]):
+        """Products written again after their delete must survive the reindex."""
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM reindex_deletes WHERE target_index = ? AND product_id = ?",
+                ((target_index, product_id) for product_id in product_ids)
+            )
+
+    def recorded_deletes(self, target_index: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT product_id FROM reindex_deletes WHERE target_index = ?", (target_index,)
+            ).fetchall()
+        return [row["product_id"] for row in rows]
+
+    def clear_deletes(self, target_index: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM reindex_deletes WHERE target_index = ?", (target_index,))
+
+    def _job(self, row: Optional[sqlite3.Row]) -> Optional[Dict]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["source_indices"] = json.loads(job["source_indices"])
+        if job["status"] in _ACTIVE and (job["heartbeat"] or 0) < time.time() - self._stale_seconds:
+            # Its worker died mid-run; the partial target index is never swapped in
+            job["status"] = "failed"
+            job["error"] = job["error"] or "Worker running the reindex stopped"
+        return job
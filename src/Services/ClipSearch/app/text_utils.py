@@ -0,0 +1,65 @@
+import html
+import re
+from typing import Optional
+
+# Content of these elements, comments and CDATA never reach the text output,
+# matching BeautifulSoup's get_text(). Their ends are searched separately
+# (see _remove_skipped) so that unclosed ones cost one scan, not one per opener.
+_SKIPPED_START_RE = re.compile(r"<(?:(script|style|template)\b[^<>]*>|!--|!\[CDATA\[)", re.IGNORECASE)
+_SKIPPED_END_RES = {
+    name: re.compile(rf"</{name}\s*>", re.IGNORECASE) for name in ("script", "style", "template")
+}
+_SKIPPED_END_MARKERS = {"<!--": "-->", "<![CDATA[": "]]>"}
+# Only "<" followed by a tag-name start is markup; "a < b" stays text. Quoted
+# attribute values are skipped whole, so a ">" inside one does not end the tag.
+# An unquoted "<" ends the attempt, which keeps runs of unclosed "<x" linear.
+_TAG_RE = re.compile(r"""<[A-Za-z!?/](?:"[^"]*"|'[^']*'|[^'"<>])*>""")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def _remove_skipped(text: str) -> str:
+    parts = []
+    pos = 0
+    unclosed = set()
+    for match in _SKIPPED_START_RE.finditer(text):
+        if match.start() < pos:
+            continue
+        name = match.group(1)
+        kind = name.lower() if name else match.group(0).upper()
+        if kind in unclosed:
+            continue
+        if name:
+            end_match = _SKIPPED_END_RES[kind].search(text, match.end())
+            end = end_match.end() if end_match else -1
+        else:
+            marker = _SKIPPED_END_MARKERS[kind]
+            end = text.find(marker, match.end())
+            end = end + len(marker) if end >= 0 else -1
+        if end < 0:
+            # Nothing after this one closes it, so no later opener of the kind can be closed either
+            unclosed.add(kind)
+            continue
+        parts.append(text[pos:match.start()])
+        parts.append(" ")
+        pos = end
+    if not parts:
+        return text
+    parts.append(text[pos:])
+    return "".join(parts)
+
+
+def strip_html(html_text: Optional[str]) -> str:
+    """Convert an HTML fragment to plain text in a single regex pass.
+
+    Tags are replaced by a space, entities are decoded and runs of whitespace
+    (including ``&nbsp;``) are collapsed.
+    """
+    if not html_text:
+        return ""
+    text = html_text
+    if "<" in text:
+        text = _remove_skipped(text)
+        text = _TAG_RE.sub(" ", text)
+    if "&" in text:
+        text = html.unescape(text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
@@ -0,0 +1,86 @@
+"""Adaptive bulk concurrency under size-dependent latency.
+
+Run from the ClipSearch directory:
+
+    python -m benchmarks.bench_bulk_writer [--writes 30] [--ms-per-mb 200]
+
+Drives ``AdaptiveBulkWriter`` against ``FakeAsyncElasticsearch`` with bulk
+latency proportional to the payload, so bigger chunks are slower without the
+cluster being any busier. Each scenario reports throughput and the lowest
+and final concurrency. Writes of uniform chunks and writes of full chunks
+plus a small remainder must both keep the starting concurrency when there is
+no overload; with ``--capacity`` concurrent bulks accepted, the writer must
+back off to it at least once. Exits 1 when a scenario does not.
+"""
+import argparse
+import asyncio
+import time
+
+from app.bulk_writer import AdaptiveBulkWriter
+
+from .fake_es import FakeAsyncElasticsearch
+
+INDEX = "bench-bulk"
+DOC_BYTES = 1024
+
+
+def _actions(count: int, start: int):
+    return [
+        {"_index": INDEX, "_id": str(start + i), "_source": {"payload": "x" * DOC_BYTES}}
+        for i in range(count)
+    ]
+
+
+async def run_scenario(docs_per_write: int, args, capacity=None):
+    es = FakeAsyncElasticsearch(latency_ms=args.latency_ms, bulk_capacity=capacity, bulk_ms_per_mb=args.ms_per_mb)
+    await es.indices.create(index=INDEX)
+    writer = AdaptiveBulkWriter(
+        chunk_bytes=args.chunk_docs * (DOC_BYTES + 200),
+        max_docs=args.chunk_docs,
+        initial_concurrency=args.concurrency,
+        max_concurrency=args.concurrency,
+        backoff_seconds=0.01,
+        max_backoff_seconds=0.1
+    )
+    lowest = writer.concurrency
+    docs = 0
+    started = time.perf_counter()
+    for write in range(args.writes):
+        await writer.write(es, _actions(docs_per_write, write * docs_per_write), refresh=False)
+        lowest = min(lowest, writer.concurrency)
+        docs += docs_per_write
+    elapsed = time.perf_counter() - started
+    return docs / elapsed, lowest, writer.concurrency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writes", type=int, default=30)
+    parser.add_argument("--chunk-docs", type=int, default=50, help="Documents per full chunk")
+    parser.add_argument("--chunks", type=int, default=8, help="Full chunks per write")
+    parser.add_argument("--concurrency", type=int, default=8, help="Starting and maximum concurrency")
+    parser.add_argument("--capacity", type=int, default=2, help="Concurrent bulks accepted in the overload scenario")
+    parser.add_argument("--latency-ms", type=float, default=0.2, help="Fixed bulk round trip")
+    parser.add_argument("--ms-per-mb", type=float, default=200.0, help="Bulk latency per MiB of payload")
+    args = parser.parse_args()
+
+    full = args.chunk_docs * args.chunks
+    scenarios = [
+        ("uniform", full, None, lambda lowest, final: lowest == args.concurrency),
+        ("mixed sizes", full + max(1, args.chunk_docs // 10), None, lambda lowest, final: lowest == args.concurrency),
+        ("overloaded", full + max(1, args.chunk_docs // 10), args.capacity, lambda lowest, final: lowest <= args.capacity),
+    ]
+    failures = []
+    print(f"{'scenario':<14}{'docs/s':>10}{'lowest':>8}{'final':>8}")
+    for name, docs_per_write, capacity, expected in scenarios:
+        throughput, lowest, final = asyncio.run(run_scenario(docs_per_write, args, capacity))
+        print(f"{name:<14}{throughput:>10.0f}{lowest:>8}{final:>8}")
+        if not expected(lowest, final):
+            failures.append(name)
+    if failures:
+        print(f"Unexpected concurrency in: {', '.join(failures)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Micro-benchmark: regex HTML stripper vs. BeautifulSoup.
+
+Run from the ClipSearch directory:
+
+    python -m benchmarks.bench_strip_html [--data path/to/clean_*.json ...]
+
+``--data`` accepts the Product API seed files (JSON arrays) or JSONL dumps and
+benchmarks their ``description`` / ``short_description`` fields; without it a
+set of synthetic product descriptions of realistic size is used.
+"""
+import argparse
+import random
+import statistics
+import time
+from typing import Callable, List
+
+from app.text_utils import strip_html
+
+from .data import load_descriptions, synthetic_description
+
+
+# Markup the regex stripper must handle exactly like BeautifulSoup, with the expected text
+EDGE_CASES = [
+    ('<img alt="x>y" src=z>Hello', "Hello"),
+    ('<p title="a > b">t</p>', "t"),
+    ("<a href='/p?q=1>2'>link</a> text", "link text"),
+    ("price < 100 & > 50", "price < 100 & > 50"),
+]
+
+# Unclosed markup that made the stripper quadratic; each ~16 KiB input must be stripped in linear time
+SLOW_CASES = {
+    "unclosed tags": "<a" * 8000,
+    "unclosed script openers": "<script" * 2300,
+    "unclosed script elements": "<script>" * 2000,
+    "unclosed style elements": "<style>a" * 2000,
+    "unclosed comments": "<!--" * 4000,
+    "unclosed CDATA": "<![CDATA[" * 1800,
+    "unbalanced quotes": "<a '<a\" " * 2000,
+}
+SLOW_CASE_LIMIT_SECONDS = 0.05
+
+
+def load_samples(paths: List[str], limit: int) -> List[str]:
+    if not paths:
+        rng = random.Random(42)
+        return [synthetic_description(rng) for _ in range(limit)]
+    return load_descriptions(paths, limit)
+
+
+def beautifulsoup_strip(html_text: str) -> str:
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(html_text, "html.parser").get_text(separator=" ", strip=True)
+
+
+def _time_per_doc(fn: Callable[[str], str], samples: List[str], repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for sample in samples:
+            fn(sample)
+        timings.append((time.perf_counter() - start) / len(samples))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", nargs="*", default=[], help="Seed JSON / JSONL files with product descriptions")
+    parser.add_argument("--limit", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    samples = load_samples(args.data, args.limit)
+    if not samples:
+        raise SystemExit("No description samples found")
+    total_kb = sum(len(s) for s in samples) / 1024
+    print(f"{len(samples)} samples, {total_kb:.0f} KiB of HTML (avg {total_kb / len(samples):.1f} KiB)")
+
+    results = {}
+    for name, fn in (("beautifulsoup", beautifulsoup_strip), ("regex", strip_html)):
+        timings = _time_per_doc(fn, samples, args.repeat)
+        results[name] = statistics.median(timings)
+        print(f"{name:>14}: {results[name] * 1e6:9.1f} us/doc (best {min(timings) * 1e6:.1f})")
+    print(f"{'speedup':>14}: {results['beautifulsoup'] / results['regex']:9.1f}x")
+
+    identical = sum(
+        " ".join(beautifulsoup_strip(s).split()) == strip_html(s) for s in samples
+    )
+    print(f"{'agreement':>14}: {identical}/{len(samples)} identical after whitespace normalization")
+
+    mismatches = [
+        (html_text, expected, strip_html(html_text))
+        for html_text, expected in EDGE_CASES
+        if strip_html(html_text) != expected or " ".join(beautifulsoup_strip(html_text).split()) != expected
+    ]
+    print(f"{'edge cases':>14}: {len(EDGE_CASES) - len(mismatches)}/{len(EDGE_CASES)} as expected")
+    for html_text, expected, actual in mismatches:
+        print(f"{'':>14}  {html_text!r}: expected {expected!r}, got {actual!r}")
+
+    slow = []
+    for name, html_text in SLOW_CASES.items():
+        start = time.perf_counter()
+        strip_html(html_text)
+        elapsed = time.perf_counter() - start
+        if elapsed > SLOW_CASE_LIMIT_SECONDS:
+            slow.append((name, elapsed))
+    print(f"{'slow cases':>14}: {len(SLOW_CASES) - len(slow)}/{len(SLOW_CASES)} within {SLOW_CASE_LIMIT_SECONDS * 1000:.0f} ms")
+    for name, elapsed in slow:
+        print(f"{'':>14}  {name}: {elapsed * 1000:.0f} ms")
+    if mismatches or slow:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
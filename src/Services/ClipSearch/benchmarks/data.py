@@ -0,0 +1,93 @@
+"""Product fixtures for the benchmarks: Product API seed files or synthetic data."""
+import json
+import random
+from typing import List
+
+from app.models import ProductIndexRequest
+
+SAMPLE_PARAGRAPHS = [
+    "Sản phẩm chính hãng, bảo hành 12 tháng tại các trung tâm bảo hành trên toàn quốc.",
+    "Thiết kế nhỏ gọn, chất liệu nhôm nguyên khối &amp; kính cường lực Gorilla Glass.",
+    "Pin dung lượng 5000mAh, sạc nhanh 25W &ndash; sử dụng cả ngày dài.",
+    "Màn hình AMOLED 6.7&quot; độ phân giải Full HD+, tần số quét 120Hz.",
+    "Giá sản phẩm trên Tiki đã bao gồm thuế theo luật hiện hành.&nbsp;Bên cạnh đó, tuỳ vào loại sản phẩm, hình thức và địa chỉ giao hàng mà có thể phát sinh thêm chi phí khác.",
+]
+
+PRODUCT_WORDS = [
+    "điện thoại", "laptop", "tai nghe", "bluetooth", "chống ồn", "giày", "thể thao", "nam", "nữ",
+    "nồi chiên", "không dầu", "bàn phím", "cơ", "chuột", "không dây", "sữa rửa mặt", "da dầu",
+    "áo thun", "cotton", "balo", "chống nước", "đồng hồ", "thông minh", "máy lọc", "không khí",
+    "iphone", "samsung", "xiaomi", "sony", "logitech", "256gb", "pro", "max", "mini", "6L", "RGB",
+]
+
+
+def synthetic_description(rng: random.Random) -> str:
+    parts = ["<div class=\"product-description\">"]
+    for _ in range(rng.randint(5, 40)):
+        kind = rng.random()
+        text = rng.choice(SAMPLE_PARAGRAPHS)
+        if kind < 0.5:
+            parts.append(f"<p><strong>{text[:20]}</strong> {text}</p>")
+        elif kind < 0.7:
+            parts.append("<ul>" + "".join(f"<li>{p}</li>" for p in rng.sample(SAMPLE_PARAGRAPHS, 3)) + "</ul>")
+        elif kind < 0.85:
+            parts.append(
+                "<table><tbody>" + "".join(
+                    f"<tr><td>Thông số {i}</td><td>{rng.choice(SAMPLE_PARAGRAPHS)[:30]}</td></tr>" for i in range(4)
+                ) + "</tbody></table>"
+            )
+        else:
+            parts.append(f"<p><img src=\"https://salt.tikicdn.com/ts/tmp/{rng.getrandbits(64):x}.jpg\" alt=\"\" width=\"750\"></p>")
+    parts.append("</div>")
+    return "\n".join(parts)
+
+
+def synthetic_query(rng: random.Random) -> str:
+    return " ".join(rng.sample(PRODUCT_WORDS, rng.randint(1, 4)))
+
+
+def synthetic_products(count: int, seed: int = 42) -> List[ProductIndexRequest]:
+    rng = random.Random(seed)
+    return [
+        ProductIndexRequest(
+            id=f"bench-{i}",
+            name=" ".join(rng.sample(PRODUCT_WORDS, rng.randint(3, 8))).capitalize(),
+            shortDescription=rng.choice(SAMPLE_PARAGRAPHS),
+            description=synthetic_description(rng)
+        )
+        for i in range(count)
+    ]
+
+
+def _load_records(path: str) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    if content.lstrip().startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def load_products(paths: List[str], limit: int) -> List[ProductIndexRequest]:
+    """Read products from seed JSON arrays or JSONL files (snake_case or camelCase fields)."""
+    products = []
+    for path in paths:
+        for record in _load_records(path):
+            products.append(ProductIndexRequest(
+                id=str(record["id"]),
+                name=record.get("name") or "",
+                description=record.get("description"),
+                shortDescription=record.get("shortDescription", record.get("short_description"))
+            ))
+            if len(products) >= limit:
+                return products
+    return products
+
+
+def load_descriptions(paths: List[str], limit: int) -> List[str]:
+    samples = []
+    for path in paths:
+        for record in _load_records(path):
+            for field in ("description", "short_description", "shortDescription"):
+                if record.get(field):
+                    samples.append(record[field])
+    return samples[:limit]
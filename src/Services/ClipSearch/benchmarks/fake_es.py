@@ -0,0 +1,483 @@
+"""In-process stand-in for ``AsyncElasticsearch`` used by the benchmarks.
+
+Implements the subset of the client API that ``SearchEngine`` and
+``AdaptiveBulkWriter`` call: index management and aliases,
+``index``, ``bulk``, ``delete``, ``count``, ``search`` (exact brute-force kNN,
+including boosted clauses on the nested ``image_embedding.vector`` field,
+plus a token-overlap stand-in for ``multi_match``, both optionally restricted
+by ``terms`` / ``range`` filters) and ``msearch``. Point in time /
+``search_after`` and scroll are not supported.
+
+Scores are not meant to match ES; the point is to exercise the client-side
+code paths with realistic payload sizes. ``latency_ms`` adds a fixed
+per-request delay to model the network round trip, and ``bulk_ms_per_mb``
+a bulk delay proportional to the payload size. With ``bulk_capacity`` set,
+bulk requests beyond that many in flight have every item rejected with 429,
+like a full write thread pool queue.
+"""
+import asyncio
+import json
+import re
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class FakeResponse(dict):
+    """Dict response that also exposes ``.body`` like ``ObjectApiResponse``."""
+
+    @property
+    def body(self) -> Dict:
+        return self
+
+
+class FakeNotFoundError(Exception):
+    pass
+
+
+def _matches_filter(source: Dict, clause: Dict) -> bool:
+    (kind, spec), = clause.items()
+    (field, condition), = spec.items()
+    value = source.get(field)
+    if kind == "terms":
+        values = value if isinstance(value, list) else [value]
+        return any(v in condition for v in values if v is not None)
+    if kind == "range":
+        if value is None:
+            return False
+        return all({
+            "gte": value >= bound, "gt": value > bound, "lte": value <= bound, "lt": value < bound
+        }[op] for op, bound in condition.items())
+    raise NotImplementedError(f"Unsupported filter: {kind}")
+
+
+class _Serializer:
+    mimetype = "application/json"
+
+    def dumps(self, data: Any) -> bytes:
+        if isinstance(data, (str, bytes)):
+            return data.encode("utf-8") if isinstance(data, str) else data
+        return json.dumps(data, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class _Serializers:
+    def __init__(self):
+        self._serializer = _Serializer()
+
+    def get_serializer(self, mimetype: str) -> _Serializer:
+        return self._serializer
+
+
+class _Transport:
+    def __init__(self):
+        self.serializers = _Serializers()
+
+
+def _rejected_items(lines: List[Dict]) -> List[Dict]:
+    items = []
+    i = 0
+    while i < len(lines):
+        (op, meta), = lines[i].items()
+        i += 1 if op == "delete" else 2
+        items.append({op: {
+            "_index": meta.get("_index"),
+            "_id": meta.get("_id"),
+            "status": 429,
+            "error": {"type": "es_rejected_execution_exception", "reason": "rejected execution of bulk request"}
+        }})
+    return items
+
+
+class _FakeIndex:
+    def __init__(self, name: str, body: Optional[Dict]):
+        self.name = name
+        body = body or {}
+        self.mappings = body.get("mappings", {})
+        self.settings = {"index": {"refresh_interval": "1s", "number_of_replicas": "1"}}
+        for key, value in (body.get("settings", {}).get("index", {})).items():
+            self.settings["index"][key] = value
+        self.docs: Dict[str, Dict] = {}
+        self.rows: Dict[str, int] = {}
+        self.row_ids: List[Optional[str]] = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self.image_vectors: Dict[str, np.ndarray] = {}
+
+    def put(self, doc_id: str, source: Dict):
+        if doc_id in self.docs:
+            self.remove(doc_id)
+        self.docs[doc_id] = source
+        embedding = source.get("embedding")
+        if embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                vector = vector / norm
+            if self.vectors.shape[1] != vector.shape[0]:
+                self.vectors = np.zeros((0, vector.shape[0]), dtype=np.float32)
+            row = len(self.row_ids)
+            if row >= self.vectors.shape[0]:
+                grown = np.zeros((max(1024, row * 2), vector.shape[0]), dtype=np.float32)
+                grown[:self.vectors.shape[0]] = self.vectors
+                self.vectors = grown
+            self.vectors[row] = vector
+            self.row_ids.append(doc_id)
+            self.rows[doc_id] = row
+        images = [image["vector"] for image in source.get("image_embedding") or []]
+        if images:
+            vectors = np.asarray(images, dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self.image_vectors[doc_id] = vectors / norms
+        for field, boost in (("name", 3.0), ("description", 2.0), ("shortDescription", 2.0)):
+            for token in _TOKEN_RE.findall((source.get(field) or "").lower()):
+                self.postings[token][doc_id] = self.postings[token].get(doc_id, 0.0) + boost
+
+    def remove(self, doc_id: str) -> bool:
+        source = self.docs.pop(doc_id, None)
+        if source is None:
+            return False
+        row = self.rows.pop(doc_id, None)
+        if row is not None:
+            self.row_ids[row] = None
+            self.vectors[row] = 0
+        self.image_vectors.pop(doc_id, None)
+        for field in ("name", "description", "shortDescription"):
+            for token in set(_TOKEN_RE.findall((source.get(field) or "").lower())):
+                self.postings.get(token, {}).pop(doc_id, None)
+        return True
+
+    def filtered_ids(self, filters: Optional[List[Dict]]) -> Optional[set]:
+        if not filters:
+            return None
+        if isinstance(filters, dict):
+            filters = [filters]
+        return {
+            doc_id for doc_id, source in self.docs.items()
+            if all(_matches_filter(source, clause) for clause in filters)
+        }
+
+    def knn(self, query_vector: List[float], k: int, allowed: Optional[set] = None) -> Dict[str, float]:
+        if not self.rows:
+            return {}
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        scores = self.vectors[:len(self.row_ids)] @ query
+        live = np.fromiter(
+            (doc_id is not None and (allowed is None or doc_id in allowed) for doc_id in self.row_ids),
+            dtype=bool,
+            count=len(self.row_ids)
+        )
+        scores[~live] = -np.inf
+        k = min(k, int(live.sum()))
+        if k == 0:
+            return {}
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        return {self.row_ids[row]: float((1.0 + scores[row]) / 2.0) for row in top if live[row]}
+
+    def image_knn(self, query_vector: List[float], k: int, allowed: Optional[set] = None) -> Dict[str, float]:
+        # Nested kNN: each product scores by its closest image
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        scores = {
+            doc_id: float((1.0 + np.max(vectors @ query)) / 2.0)
+            for doc_id, vectors in self.image_vectors.items()
+            if allowed is None or doc_id in allowed
+        }
+        return dict(sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k])
+
+    def match(self, query: str) -> Dict[str, float]:
+        scores: Dict[str, float] = defaultdict(float)
+        total_docs = max(len(self.docs), 1)
+        for token in set(_TOKEN_RE.findall(query.lower())):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = np.log(1.0 + total_docs / len(postings))
+            for doc_id, weight in postings.items():
+                scores[doc_id] += weight * idf
+        return scores
+
+
+class _FakeIndices:
+    def __init__(self, client: "FakeAsyncElasticsearch"):
+        self._client = client
+
+    async def exists(self, index: str, **kwargs) -> bool:
+        await self._client._round_trip()
+        return bool(self._client._resolve(index, required=False))
+
+    async def exists_alias(self, name: str, **kwargs) -> bool:
+        await self._client._round_trip()
+        return name in self._client._aliases and bool(self._client._aliases[name])
+
+    async def get_alias(self, name: str, **kwargs) -> FakeResponse:
+        await self._client._round_trip()
+        return FakeResponse({index: {"aliases": {name: {}}} for index in self._client._aliases.get(name, [])})
+
+    async def get(self, index: str, **kwargs) -> FakeResponse:
+        await self._client._round_trip()
+        pattern = re.compile("^" + re.escape(index).replace(r"\*", ".*") + "$")
+        return FakeResponse({
+            name: {"mappings": idx.mappings, "settings": idx.settings}
+            for name, idx in self._client._indices.items() if pattern.match(name)
+        })
+
+    async def create(self, index: str, body: Optional[Dict] = None, **kwargs) -> FakeResponse:
+        await self._client._round_trip()
+        if index in self._client._indices:
+            raise ValueError(f"resource_already_exists_exception: {index}")
+        body = body or {key: kwargs[key] for key in ("mappings", "settings", "aliases") if key in kwargs}
+        self._client._indices[index] = _FakeIndex(index, body)
+        for alias in (body.get("aliases") or {}):
+            self._client._aliases.setdefault(alias, []).append(index)
+        return FakeResponse({"acknowledged": True, "index": index})
+
+    async def delete(self, index: str, ignore_unavailable: bool = False, **kwargs) -> FakeResponse:
+        await self._client._round_trip()
+        if index not in self._client._indices:
+            if ignore_unavailable:
+                return FakeResponse({"acknowledged": True})
+            raise FakeNotFoundError(f"index_not_found_exception: {index}")
+        del self._client._indices[index]
+        for members in self._client._aliases.values():
+            if index in members:
+                members.remove(index)
+        return FakeResponse({"acknowledged": True})
+
+    async def refresh(self, index: Optional[str] = None, **kwargs) -> FakeResponse:
+        await self._client._round_trip()
+        return FakeResponse({"_shards": {"total": 1, "successful": 1, "failed": 0}})
+
+    async def get_settings(self, index: str, **kwargs) -> FakeResponse:
+        await self._client._round_trip()
+        return FakeResponse({idx.name: {"settings": idx.settings} for idx in self._client._resolve(index)})
+
+    async def put_settings(self, index: str, settings: Dict, **kwargs) -> FakeResponse:
+        await self._client._round_trip()
+        for idx in self._client._resolve(index):
+            for key, value in settings.get("index", settings).items():
+                idx.settings["index"][key] = value
+        return FakeResponse({"acknowledged": True})
+
+    async def put_mapping(self, index: str, properties: Dict, **kwargs) -> FakeResponse:
+        await self._client._round_trip()
+        for idx in self._client._resolve(index):
+            idx.mappings.setdefault("properties", {}).update(properties)
+        return FakeResponse({"acknowledged": True})
+
+    async def update_aliases(self, actions: List[Dict], **kwargs) -> FakeResponse:
+        await self._client._round_trip()
+        aliases = self._client._aliases
+        for action in actions:
+            (op, args), = action.items()
+            if op == "add":
+                aliases.setdefault(args["alias"], []).append(args["index"])
+            elif op == "remove":
+                members = aliases.get(args["alias"], [])
+                if args["index"] in members:
+                    members.remove(args["index"])
+            elif op == "remove_index":
+                self._client._indices.pop(args["index"], None)
+        return FakeResponse({"acknowledged": True})
+
+
+class FakeAsyncElasticsearch:
+    def __init__(self, latency_ms: float = 0.0, bulk_capacity: Optional[int] = None, bulk_ms_per_mb: float = 0.0):
+        self._latency = latency_ms / 1000.0
+        self._bulk_seconds_per_byte = bulk_ms_per_mb / 1000.0 / (1024 * 1024)
+        self._bulk_capacity = bulk_capacity
+        self._bulks_in_flight = 0
+        self._indices: Dict[str, _FakeIndex] = {}
+        self._aliases: Dict[str, List[str]] = {}
+        self.indices = _FakeIndices(self)
+        self.transport = _Transport()
+        self._client_meta = ()
+        self.request_counts: Dict[str, int] = defaultdict(int)
+
+    def options(self, **kwargs) -> "FakeAsyncElasticsearch":
+        return self
+
+    async def close(self):
+        pass
+
+    async def _round_trip(self):
+        if self._latency:
+            await asyncio.sleep(self._latency)
+
+    def _resolve(self, name: str, required: bool = True) -> List[_FakeIndex]:
+        if name in self._indices:
+            return [self._indices[name]]
+        members = [self._indices[index] for index in self._aliases.get(name, []) if index in self._indices]
+        if required and not members:
+            raise FakeNotFoundError(f"index_not_found_exception: {name}")
+        return members
+
+    def _write_index(self, name: str) -> _FakeIndex:
+        indices = self._resolve(name)
+        if len(indices) != 1:
+            raise ValueError(f"alias [{name}] has more than one index and no write index")
+        return indices[0]
+
+    async def index(self, index: str, id: str, document: Dict, **kwargs) -> FakeResponse:
+        self.request_counts["index"] += 1
+        await self._round_trip()
+        self._write_index(index).put(id, json.loads(json.dumps(document, default=_json_default)))
+        return FakeResponse({"_index": index, "_id": id, "result": "created"})
+
+    async def delete(self, index: str, id: str, **kwargs) -> FakeResponse:
+        self.request_counts["delete"] += 1
+        await self._round_trip()
+        found = self._write_index(index).remove(id)
+        return FakeResponse({"_index": index, "_id": id, "result": "deleted" if found else "not_found"})
+
+    async def count(self, index: str, **kwargs) -> FakeResponse:
+        await self._round_trip()
+        return FakeResponse({"count": sum(len(idx.docs) for idx in self._resolve(index))})
+
+    async def bulk(self, operations: List[Any], **kwargs) -> FakeResponse:
+        self.request_counts["bulk"] += 1
+        self._bulks_in_flight += 1
+        try:
+            await self._round_trip()
+            if self._bulk_seconds_per_byte:
+                size = sum(len(op) + 1 if isinstance(op, (str, bytes)) else len(json.dumps(op)) + 1 for op in operations)
+                await asyncio.sleep(size * self._bulk_seconds_per_byte)
+            rejected = self._bulk_capacity is not None and self._bulks_in_flight > self._bulk_capacity
+        finally:
+            self._bulks_in_flight -= 1
+        lines = [json.loads(op) if isinstance(op, (str, bytes)) else op for op in operations]
+        if rejected:
+            self.request_counts["bulk_rejected"] += 1
+            return FakeResponse({"took": 0, "errors": True, "items": _rejected_items(lines)})
+        items = []
+        i = 0
+        while i < len(lines):
+            (op, meta), = lines[i].items()
+            i += 1
+            index_name = meta.get("_index")
+            try:
+                target = self._write_index(index_name)
+                if op == "delete":
+                    found = target.remove(meta["_id"])
+                    items.append({op: {"_index": index_name, "_id": meta["_id"], "status": 200 if found else 404}})
+                    continue
+                source = lines[i]
+                i += 1
+                if op == "create" and meta["_id"] in target.docs:
+                    items.append({op: {"_index": index_name, "_id": meta["_id"], "status": 409,
+                                       "error": {"type": "version_conflict_engine_exception"}}})
+                    continue
+                target.put(meta["_id"], source.get("doc", source) if op == "update" else source)
+                items.append({op: {"_index": index_name, "_id": meta["_id"], "status": 201}})
+            except Exception as e:
+                if op != "delete":
+                    i += 1
+                items.append({op: {"_index": index_name, "_id": meta.get("_id"), "status": 404, "error": str(e)}})
+        return FakeResponse({
+            "took": 0,
+            "errors": any(item[next(iter(item))]["status"] >= 300 for item in items),
+            "items": items
+        })
+
+    def _run_search(
+        self,
+        index: str,
+        knn: Optional[List[Dict]] = None,
+        query: Optional[Dict] = None,
+        size: int = 10,
+        from_: int = 0,
+        source: Optional[List[str]] = None
+    ) -> Dict:
+        scores: Dict[str, float] = defaultdict(float)
+        docs: Dict[str, Dict] = {}
+        for idx in self._resolve(index):
+            for clause in knn or []:
+                allowed = idx.filtered_ids(clause.get("filter"))
+                search = idx.image_knn if clause.get("field") == "image_embedding.vector" else idx.knn
+                boost = clause.get("boost", 1.0)
+                for doc_id, score in search(clause["query_vector"], clause["k"], allowed).items():
+                    scores[doc_id] += boost * score
+            if query is not None:
+                text_query, allowed = query, None
+                if "bool" in query:
+                    text_query = query["bool"]["must"]
+                    allowed = idx.filtered_ids(query["bool"].get("filter"))
+                if "multi_match" not in text_query:
+                    raise NotImplementedError(f"Unsupported query: {list(text_query)}")
+                for doc_id, score in idx.match(text_query["multi_match"]["query"]).items():
+                    if allowed is None or doc_id in allowed:
+                        scores[doc_id] += score
+            docs.update({doc_id: idx.docs[doc_id] for doc_id in scores if doc_id in idx.docs and doc_id not in docs})
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        hits = []
+        for doc_id in ranked[from_:from_ + size]:
+            doc = docs[doc_id]
+            hits.append({
+                "_index": index,
+                "_id": doc_id,
+                "_score": scores[doc_id],
+                "_source": {field: doc.get(field) for field in source} if source else doc
+            })
+        return {
+            "took": 0,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": len(ranked), "relation": "eq"}, "max_score": None, "hits": hits}
+        }
+
+    async def search(
+        self,
+        index: Optional[str] = None,
+        knn: Optional[List[Dict]] = None,
+        query: Optional[Dict] = None,
+        size: int = 10,
+        from_: int = 0,
+        source: Optional[List[str]] = None,
+        pit: Optional[Dict] = None,
+        **kwargs
+    ) -> FakeResponse:
+        self.request_counts["search"] += 1
+        await self._round_trip()
+        if pit is not None:
+            raise NotImplementedError("FakeAsyncElasticsearch does not support point in time searches")
+        if isinstance(knn, dict):
+            knn = [knn]
+        return FakeResponse(self._run_search(index, knn, query, size, from_, source))
+
+    async def msearch(self, searches: List[Dict], index: Optional[str] = None, **kwargs) -> FakeResponse:
+        self.request_counts["msearch"] += 1
+        await self._round_trip()
+        responses = []
+        for header, body in zip(searches[::2], searches[1::2]):
+            knn = body.get("knn")
+            try:
+                responses.append(self._run_search(
+                    header.get("index", index),
+                    [knn] if isinstance(knn, dict) else knn,
+                    body.get("query"),
+                    body.get("size", 10),
+                    body.get("from", 0),
+                    body.get("_source")
+                ))
+            except Exception as e:
+                responses.append({"error": {"type": type(e).__name__, "reason": str(e)}, "status": 400})
+        return FakeResponse({"took": 0, "responses": responses})
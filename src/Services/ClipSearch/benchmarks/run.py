@@ -0,0 +1,281 @@
+"""Offline ClipSearch benchmark suite.
+
+Drives a real ``SearchEngine`` against the in-process ``FakeAsyncElasticsearch``
+with deterministic stub encoders (or the real models when they are cached
+locally) and reports throughput, latency percentiles and peak RSS per workload.
+
+Run from the ClipSearch directory:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --products 20000 --queries 2000 --concurrency 16
+    python -m benchmarks.run --real-models --data clean_laptops.json
+    python -m benchmarks.run --output after.json --baseline before.json
+
+With ``--baseline`` the run exits non-zero when a workload's throughput drops
+or its p95 latency grows by more than ``--tolerance``. Engine settings come
+from the usual environment variables (e.g. ``SEARCH_FUSION_MODE``,
+``VECTOR_INDEX_TYPE``); the embedding and product vector stores are put in a
+temporary directory unless their paths are set explicitly. With
+``--product-images`` the products get one to three images each, drawn from
+a pool of random JPEGs written under ``PRODUCT_IMAGE_ROOT``.
+"""
+import os
+import tempfile
+
+_BENCH_DATA_DIR = tempfile.mkdtemp(prefix="clipsearch-bench-")
+os.environ.setdefault("EMBEDDING_STORE_DIR", os.path.join(_BENCH_DATA_DIR, "embeddings"))
+os.environ.setdefault("PRODUCT_VECTOR_STORE_DIR", os.path.join(_BENCH_DATA_DIR, "product_vectors"))
+os.environ.setdefault("SHARED_STATE_DB_PATH", os.path.join(_BENCH_DATA_DIR, "shared_state.sqlite3"))
+os.environ.setdefault("PRODUCT_IMAGE_ROOT", os.path.join(_BENCH_DATA_DIR, "images"))
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ["REDIS_URL"] = ""
+
+import argparse  # noqa: E402
+import asyncio  # noqa: E402
+import base64  # noqa: E402
+import io  # noqa: E402
+import json  # noqa: E402
+import logging  # noqa: E402
+import random  # noqa: E402
+import resource  # noqa: E402
+import shutil  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+from typing import Awaitable, Callable, Dict, List, Optional  # noqa: E402
+
+import numpy as np  # noqa: E402
+
+from app.config import MODEL_WAIT_TIMEOUT_SECONDS, PRODUCT_IMAGE_ROOT  # noqa: E402
+from app.encoders import LazyModel  # noqa: E402
+from app.ingest import StreamingIngest  # noqa: E402
+from app.models import SearchRequest  # noqa: E402
+from app.search_engine import SearchEngine  # noqa: E402
+
+from .data import load_products, synthetic_products, synthetic_query  # noqa: E402
+from .fake_es import FakeAsyncElasticsearch  # noqa: E402
+from .stub_encoder import load_encoders  # noqa: E402
+
+WORKLOADS = ("bulk_index", "stream_index", "index", "search_cold", "search_warm", "image_search", "delete")
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+async def measure(name: str, operations: List[Callable[[], Awaitable]], concurrency: int, docs: Optional[int] = None) -> Dict:
+    latencies = []
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def timed(operation: Callable[[], Awaitable]):
+        async with semaphore:
+            start = time.perf_counter()
+            await operation()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(operation) for operation in operations))
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = np.asarray(latencies) * 1000
+    docs = len(operations) if docs is None else docs
+    return {
+        "workload": name,
+        "operations": len(operations),
+        "docs": docs,
+        "seconds": round(elapsed, 3),
+        "docsPerSecond": round(docs / elapsed, 1) if elapsed > 0 else None,
+        "p50Ms": round(float(np.percentile(latencies_ms, 50)), 2) if latencies else None,
+        "p95Ms": round(float(np.percentile(latencies_ms, 95)), 2) if latencies else None,
+        "p99Ms": round(float(np.percentile(latencies_ms, 99)), 2) if latencies else None,
+        "peakRssMb": round(peak_rss_mb(), 1)
+    }
+
+
+def _random_image_bytes(rng: random.Random) -> bytes:
+    from PIL import Image
+    pixels = np.random.default_rng(rng.getrandbits(32)).integers(0, 256, (224, 224, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def _random_image_b64(rng: random.Random) -> str:
+    return base64.b64encode(_random_image_bytes(rng)).decode("ascii")
+
+
+def attach_product_images(products: List, pool_size: int, rng: random.Random) -> List:
+    os.makedirs(os.path.join(PRODUCT_IMAGE_ROOT, "bench"), exist_ok=True)
+    paths = []
+    for i in range(pool_size):
+        path = f"bench/{i}.jpg"
+        with open(os.path.join(PRODUCT_IMAGE_ROOT, path), "wb") as f:
+            f.write(_random_image_bytes(rng))
+        paths.append(path)
+    return [
+        product.model_copy(update={"imageUrls": rng.sample(paths, min(len(paths), rng.randint(1, 3)))})
+        for product in products
+    ]
+
+
+async def build_engine(args) -> SearchEngine:
+    text_encoder, image_encoder = load_encoders(args.real_models, args.encode_cost_ms)
+    engine = SearchEngine()
+    await engine.es.close()
+    engine.es = FakeAsyncElasticsearch(latency_ms=args.es_latency_ms, bulk_capacity=args.es_bulk_capacity)
+    engine.text_model = LazyModel("text", lambda: text_encoder, MODEL_WAIT_TIMEOUT_SECONDS)
+    engine.img_model = LazyModel("image", lambda: image_encoder, MODEL_WAIT_TIMEOUT_SECONDS)
+    engine.text_model.get()
+    engine.img_model.get()
+    await engine._create_index_if_not_exists()
+    engine.es_ready.set()
+    return engine
+
+
+async def run_workloads(args) -> List[Dict]:
+    rng = random.Random(args.seed)
+    products = load_products(args.data, args.products) if args.data else synthetic_products(args.products, args.seed)
+    if args.product_images:
+        products = attach_product_images(products, args.product_images, rng)
+    engine = await build_engine(args)
+    selected = args.workloads or list(WORKLOADS)
+    results = []
+    try:
+        if "bulk_index" in selected:
+            batches = [products[i:i + args.batch_size] for i in range(0, len(products), args.batch_size)]
+            results.append(await measure(
+                "bulk_index",
+                [lambda batch=batch: engine.bulk_index_products(batch) for batch in batches],
+                args.bulk_concurrency,
+                docs=len(products)
+            ))
+
+        if "stream_index" in selected:
+            async def stream_all():
+                async def body():
+                    for start in range(0, len(products), args.batch_size):
+                        batch = products[start:start + args.batch_size]
+                        yield "".join(product.model_dump_json() + "\n" for product in batch).encode("utf-8")
+                async for _ in StreamingIngest(engine, chunk_size=args.batch_size).run(body()):
+                    pass
+            results.append(await measure("stream_index", [stream_all], 1, docs=len(products)))
+
+        if "index" in selected:
+            singles = products[:args.single_docs]
+            results.append(await measure(
+                "index",
+                [lambda product=product: engine.index_product(product) for product in singles],
+                args.concurrency
+            ))
+
+        queries = [synthetic_query(rng) for _ in range(args.queries)]
+        if "search_cold" in selected:
+            # Numbered queries are all distinct, so neither cache can serve them
+            requests = [SearchRequest(query=f"{query} {i}", size=20) for i, query in enumerate(queries)]
+            results.append(await measure(
+                "search_cold",
+                [lambda request=request: engine.hybrid_search(request) for request in requests],
+                args.concurrency
+            ))
+
+        if "search_warm" in selected:
+            hot = queries[:max(1, len(queries) // 10)]
+            requests = [SearchRequest(query=rng.choice(hot), size=20) for _ in queries]
+            results.append(await measure(
+                "search_warm",
+                [lambda request=request: engine.hybrid_search(request) for request in requests],
+                args.concurrency
+            ))
+
+        if "image_search" in selected:
+            images = [_random_image_b64(rng) for _ in range(max(1, args.queries // 10))]
+            results.append(await measure(
+                "image_search",
+                [lambda image=image: engine.hybrid_search(SearchRequest(image=image, size=20)) for image in images],
+                args.concurrency
+            ))
+
+        if "delete" in selected:
+            victims = products[-args.single_docs:]
+            results.append(await measure(
+                "delete",
+                [lambda product=product: engine.delete_product(product.id) for product in victims],
+                args.concurrency
+            ))
+    finally:
+        await engine.close()
+    return results
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    previous = {result["workload"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result["workload"])
+        if before is None:
+            continue
+        if before.get("docsPerSecond") and result["docsPerSecond"] < before["docsPerSecond"] * (1 - tolerance):
+            regressions.append(
+                f"{result['workload']}: {result['docsPerSecond']} docs/s vs {before['docsPerSecond']} baseline"
+            )
+        if before.get("p95Ms") and result["p95Ms"] > before["p95Ms"] * (1 + tolerance):
+            regressions.append(f"{result['workload']}: p95 {result['p95Ms']} ms vs {before['p95Ms']} ms baseline")
+    return regressions
+
+
+def print_table(results: List[Dict]):
+    print(f"{'workload':<14}{'ops':>8}{'docs/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak RSS MB':>14}")
+    for result in results:
+        print(
+            f"{result['workload']:<14}{result['operations']:>8}{result['docsPerSecond']:>12}"
+            f"{result['p50Ms']:>10}{result['p95Ms']:>10}{result['p99Ms']:>10}{result['peakRssMb']:>14}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workloads", nargs="*", choices=WORKLOADS, help="Workloads to run (default: all)")
+    parser.add_argument("--data", nargs="*", default=[], help="Seed JSON / JSONL product files instead of synthetic products")
+    parser.add_argument("--products", type=int, default=5000, help="Products for bulk_index")
+    parser.add_argument("--batch-size", type=int, default=500, help="Products per bulk_index_products call")
+    parser.add_argument("--bulk-concurrency", type=int, default=1)
+    parser.add_argument("--product-images", type=int, default=0, help="Pool of random images to attach to products (0: none)")
+    parser.add_argument("--single-docs", type=int, default=200, help="Products for the index and delete workloads")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8, help="In-flight requests for per-request workloads")
+    parser.add_argument("--es-latency-ms", type=float, default=0.0, help="Simulated ES round-trip latency")
+    parser.add_argument("--es-bulk-capacity", type=int, help="Reject bulk items with 429 above this many concurrent bulk requests")
+    parser.add_argument("--encode-cost-ms", type=float, default=0.0, help="Simulated stub encoder cost per input")
+    parser.add_argument("--real-models", action="store_true", help="Use the cached production models instead of stubs")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write results as JSON")
+    parser.add_argument("--baseline", help="Results JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative regression vs the baseline")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    try:
+        results = asyncio.run(run_workloads(args))
+    finally:
+        shutil.rmtree(_BENCH_DATA_DIR, ignore_errors=True)
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%} of {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Deterministic stand-ins for the sentence-transformers encoders."""
+import hashlib
+import time
+from typing import Any, List, Tuple
+
+import numpy as np
+
+from app.config import EMBEDDING_DIMS
+
+
+class StubEncoder:
+    """Maps each input to a fixed pseudo-random unit vector derived from its
+    content, so repeated runs index and rank identically.
+
+    ``cost_ms`` is slept per input to model encoder compute, letting the
+    batching and threading paths be measured without a model.
+    """
+
+    def __init__(self, dims: int = EMBEDDING_DIMS, cost_ms: float = 0.0):
+        self.dims = dims
+        self._cost = cost_ms / 1000.0
+        self.calls = 0
+        self.items = 0
+
+    def _seed(self, item: Any) -> int:
+        if isinstance(item, str):
+            data = item.encode("utf-8")
+        elif hasattr(item, "tobytes"):
+            data = item.tobytes()
+        else:
+            data = repr(item).encode("utf-8")
+        return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+    def encode(self, sentences: List[Any], batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        items = [sentences] if single else list(sentences)
+        self.calls += 1
+        self.items += len(items)
+        if self._cost:
+            time.sleep(self._cost * len(items))
+        vectors = np.empty((len(items), self.dims), dtype=np.float32)
+        for i, item in enumerate(items):
+            vectors[i] = np.random.default_rng(self._seed(item)).standard_normal(self.dims, dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors[0] if single else vectors
+
+
+def load_encoders(real_models: bool, cost_ms: float = 0.0) -> Tuple[Any, Any]:
+    """Return ``(text_encoder, image_encoder)``.
+
+    With ``real_models`` the production loaders are used; run with
+    ``HF_HUB_OFFLINE=1`` (``benchmarks.run`` sets it) so only models already in
+    ``MODEL_CACHE_DIR`` are used.
+    """
+    if not real_models:
+        return StubEncoder(cost_ms=cost_ms), StubEncoder(cost_ms=cost_ms)
+
+    from app.encoders import load_image_encoder, load_text_encoder
+    try:
+        return load_text_encoder(), load_image_encoder()
+    except Exception as e:
+        raise SystemExit(f"Real models are not available in the local cache: {e}")